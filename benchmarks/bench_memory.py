@@ -0,0 +1,73 @@
+"""Compare resident memory per entry of the object tree and the columnar store
+
+Usage: python benchmarks/bench_memory.py [SNAPSHOT]
+
+Without SNAPSHOT a synthetic snapshot with about 200k entries is generated.
+"""
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pyls.file_system_loader import FileSystemLoader
+
+def write_synthetic_snapshot(path: Path, directories: int = 2000, files_per_directory: int = 100):
+    """Write a two-level synthetic snapshot"""
+    root = {"name": "root", "size": 4096, "time_modified": 1700000000,
+            "permissions": "drwxr-xr-x", "contents": []}
+    for d in range(directories):
+        root["contents"].append({
+            "name": f"dir_{d}", "size": 4096, "time_modified": 1700000000 + d,
+            "permissions": "drwxr-xr-x",
+            "contents": [{"name": f"file_{d}_{f}.txt", "size": d * f,
+                          "time_modified": 1700000000 + d * f, "permissions": "-rw-r--r--"}
+                         for f in range(files_per_directory)]
+        })
+    with open(path, 'w') as f:
+        json.dump(root, f)
+
+def measure(label: str, load, entries: int) -> dict:
+    """Load once under tracemalloc and report retained bytes per entry"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    root = load()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del root
+    result = {"loader": label, "seconds": round(elapsed, 3),
+              "bytes_per_entry": round(current / entries, 1),
+              "peak_bytes_per_entry": round(peak / entries, 1)}
+    print(json.dumps(result))
+    return result
+
+def main():
+    if len(sys.argv) > 1:
+        snapshot = Path(sys.argv[1])
+        cleanup = False
+    else:
+        fd, name = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        snapshot = Path(name)
+        write_synthetic_snapshot(snapshot)
+        cleanup = True
+    try:
+        store_root = FileSystemLoader.load_columnar_from_json(snapshot)
+        entries = len(store_root.store)
+        del store_root
+        print(json.dumps({"snapshot": str(snapshot), "entries": entries}))
+        measure("objects", lambda: FileSystemLoader.load_from_json(snapshot), entries)
+        measure("columnar", lambda: FileSystemLoader.load_columnar_from_json(snapshot), entries)
+    finally:
+        if cleanup:
+            os.unlink(snapshot)
+
+if __name__ == '__main__':
+    main()
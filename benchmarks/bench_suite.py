@@ -0,0 +1,316 @@
+"""Benchmark suite timing every pyls stage on synthetic snapshots
+
+Usage:
+  python benchmarks/bench_suite.py run [--sizes 10k,1m,10m] [--repeat N] [--output FILE]
+  python benchmarks/bench_suite.py compare OLD.json NEW.json [--threshold 0.1]
+
+Each benchmark runs in a fresh process, so its peak RSS is measured without
+interference from the others. The orchestrating process never loads a tree
+itself: on Linux a child's ru_maxrss starts at its parent's high-water mark,
+so the copies of each snapshot are written by a child process as well. Snapshots are generated once per size with
+generate_snapshot.py and kept in --data-dir for later runs. Results are written
+as JSON; compare reports the change of every benchmark between two result
+files and exits with status 1 if any of them regressed beyond the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from generate_snapshot import SnapshotGenerator, parse_count
+
+NAVIGATIONS = 1000
+SESSION_REPEATS = 100
+# Compressed copies of structure.json written for the decompression benchmarks
+COMPRESSED_SUFFIXES = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+def _all_items(root) -> list:
+    items = []
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        for item in directory.contents:
+            items.append(item)
+            if item.is_directory():
+                stack.append(item)
+    return items
+
+def _in_process_benchmarks() -> Dict[str, Tuple[str, Callable]]:
+    """
+    Return the benchmarks that run inside the measuring process
+
+    Each entry maps a name to the setup it needs ('none', 'tree', 'items' or 'store')
+    and a function taking (snapshot, deepest_path, prepared) that runs the
+    measured operation once. The navigate benchmark repeats its operation
+    NAVIGATIONS times and reports the time of one navigation. The parallel
+    search uses one worker per CPU.
+    """
+    from pyls.file_system_loader import FileSystemLoader
+    from pyls.file_system_flat import FlatSnapshot
+    from pyls.file_system_navigator import FileSystemNavigator
+    from pyls.file_system_filter import HiddenItemsFilter, TypeFilter, PermissionFilter
+    from pyls.file_system_sorter import ReverseSorter, TimeSorter
+    from pyls.file_system_formatter import NameFormatter, DetailedFormatter, HumanReadableSizeFormatter
+    from pyls.file_system_session import FileSystemSession
+    from pyls.file_system_search import FileSystemSearch, SearchExpression
+
+    def navigate(snapshot, deepest_path, root):
+        for _ in range(NAVIGATIONS):
+            FileSystemNavigator.navigate(root, deepest_path)
+
+    def session_repeat(snapshot, deepest_path, root):
+        # A batch of repeated root listings, all but the first two answered from memory
+        session = FileSystemSession(root)
+        for _ in range(SESSION_REPEATS):
+            session.listing(long_format=True, time_sort=True)
+            session.listing(long_format=True, time_sort=True, reverse=True)
+
+    def search(store, jobs):
+        # Large recent files, the query the search subcommand is made for
+        expression = SearchExpression.parse(['-type', 'f', '-size', '+100k', '-mtime', '-365'], store)
+        for _ in FileSystemSearch(store, expression).search(jobs=jobs):
+            pass
+
+    return {
+        'load_from_json': ('none', lambda snapshot, path, _: FileSystemLoader.load_from_json(snapshot)),
+        'load_path_from_json': ('none', lambda snapshot, path, _:
+                                FileSystemLoader.load_path_from_json(snapshot, path)),
+        'load_ndjson_serial': ('none', lambda snapshot, path, _:
+                               FlatSnapshot.load(snapshot.with_suffix('.ndjson'), 1)),
+        'load_ndjson_parallel': ('none', lambda snapshot, path, _:
+                                 FlatSnapshot.load(snapshot.with_suffix('.ndjson'))),
+        # The same scan over compressed copies, to compare decompression with reading plain bytes
+        **{f'load_path_from_json_{compression}': ('none', lambda snapshot, path, _, suffix=suffix:
+                                                  FileSystemLoader.load_path_from_json(
+                                                      Path(f"{snapshot}{suffix}"), path))
+           for compression, suffix in COMPRESSED_SUFFIXES.items()},
+        'navigate': ('tree', navigate),
+        'session_repeat': ('tree', session_repeat),
+        'search_serial': ('store', lambda snapshot, path, store: search(store, 1)),
+        'search_parallel': ('store', lambda snapshot, path, store: search(store, os.cpu_count() or 1)),
+        'filter_hidden': ('items', lambda snapshot, path, items: HiddenItemsFilter(False).filter(items)),
+        'filter_type': ('items', lambda snapshot, path, items: TypeFilter('file').filter(items)),
+        'filter_perm': ('items', lambda snapshot, path, items: PermissionFilter('/002').filter(items)),
+        'sort_time': ('items', lambda snapshot, path, items: TimeSorter().sort(items)),
+        'sort_reverse': ('items', lambda snapshot, path, items: ReverseSorter().sort(items)),
+        'format_name': ('items', lambda snapshot, path, items: NameFormatter().format(items)),
+        'format_detailed': ('items', lambda snapshot, path, items: DetailedFormatter().format(items)),
+        'format_human': ('items', lambda snapshot, path, items:
+                         HumanReadableSizeFormatter(DetailedFormatter()).format(items)),
+    }
+
+# End-to-end benchmarks: arguments of the pyls command, '{deepest}' is replaced by the deepest path
+CLI_BENCHMARKS = {
+    'cli_list_root': ['-l'],
+    'cli_list_deep': ['-l', '{deepest}'],
+    'cli_list_sorted': ['-l', '-t', '-r', '-A'],
+}
+
+def benchmark_names() -> List[str]:
+    return list(_in_process_benchmarks()) + list(CLI_BENCHMARKS)
+
+def measure_in_process(name: str, snapshot: Path, deepest_path: str, repeat: int):
+    """Run one in-process benchmark and print its timing as JSON"""
+    from pyls.file_system_loader import FileSystemLoader
+    setup, function = _in_process_benchmarks()[name]
+    prepared = None
+    if setup == 'store':
+        prepared = FileSystemLoader.load_store(snapshot)
+    elif setup != 'none':
+        prepared = FileSystemLoader.load_from_json(snapshot)
+        if setup == 'items':
+            prepared = _all_items(prepared)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(snapshot, deepest_path, prepared)
+        elapsed = (time.perf_counter() - start) / (NAVIGATIONS if name == 'navigate' else 1)
+        best = elapsed if best is None else min(best, elapsed)
+    print(json.dumps({"seconds": best}))
+
+def _run_child(command: List[str], cwd: Path) -> Tuple[float, int, str]:
+    """
+    Run a command and return its wall time, peak RSS in bytes and output
+    """
+    with tempfile.TemporaryFile() as output, tempfile.TemporaryFile() as errors:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, stdout=output, stderr=errors,
+                                   env={**os.environ, 'PYTHONPATH': str(ROOT)})
+        # Reap the child ourselves to get its own resource usage
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+        if process.returncode:
+            errors.seek(0)
+            raise RuntimeError(f"{' '.join(command)} failed: {errors.read().decode(errors='replace')}")
+        output.seek(0)
+        text = output.read().decode(errors='replace')
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return elapsed, usage.ru_maxrss * scale, text
+
+def prepare_snapshot(data_dir: Path, entries: int) -> Tuple[Path, str]:
+    """
+    Generate the snapshot for a size unless an identical one exists
+
+    :param data_dir: Directory holding the generated snapshots
+    :param entries: Number of entries
+    :return: Path of structure.json and the path of its deepest directory
+
+    The same tree is also written as structure.ndjson for the NDJSON benchmarks,
+    and structure.json is compressed with gzip, bz2 and xz for the
+    decompression benchmarks.
+    """
+    directory = data_dir / str(entries)
+    snapshot = directory / 'structure.json'
+    description_path = directory / 'snapshot.json'
+    generator = SnapshotGenerator(entries)
+    try:
+        description = json.loads(description_path.read_text())
+        if (snapshot.exists() and snapshot.with_suffix('.ndjson').exists() and
+                all(Path(f"{snapshot}{suffix}").exists() for suffix in COMPRESSED_SUFFIXES.values()) and
+                description["seed"] == generator.seed and description["entries"] == entries):
+            return snapshot, description["deepest_path"]
+    except (OSError, ValueError, KeyError):
+        pass
+    directory.mkdir(parents=True, exist_ok=True)
+    print(f"generating {entries} entries in {snapshot}", file=sys.stderr)
+    description = generator.write(snapshot)
+    # Loading the tree here would raise the peak RSS that every later child inherits
+    _run_child([sys.executable, __file__, 'derive', str(snapshot)], ROOT)
+    description_path.write_text(json.dumps(description))
+    return snapshot, description["deepest_path"]
+
+def derive_copies(snapshot: Path):
+    """Write the NDJSON and compressed copies of a snapshot, in a process of their own"""
+    from pyls.file_system_flat import FlatSnapshot
+    from pyls.file_system_loader import FileSystemLoader
+    FlatSnapshot.write(FileSystemLoader.load_from_json(snapshot), snapshot.with_suffix('.ndjson'))
+    _compress(snapshot)
+
+def _compress(snapshot: Path):
+    """Write the compressed copies of a snapshot, streaming it through each compressor"""
+    import bz2
+    import gzip
+    import lzma
+    import shutil
+    openers = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+    for compression, suffix in COMPRESSED_SUFFIXES.items():
+        with open(snapshot, 'rb') as source, openers[compression](f"{snapshot}{suffix}", 'wb') as target:
+            shutil.copyfileobj(source, target, 1 << 20)
+
+def _version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run(args: argparse.Namespace):
+    sizes = [parse_count(size) for size in args.sizes.split(',')]
+    names = args.benchmarks.split(',') if args.benchmarks else benchmark_names()
+    unknown = set(names) - set(benchmark_names())
+    if unknown:
+        raise SystemExit(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = []
+    for entries in sizes:
+        snapshot, deepest_path = prepare_snapshot(args.data_dir, entries)
+        for name in names:
+            if name in CLI_BENCHMARKS:
+                command = [sys.executable, '-m', 'pyls'] + [
+                    argument.replace('{deepest}', deepest_path) for argument in CLI_BENCHMARKS[name]]
+                runs = [_run_child(command, snapshot.parent) for _ in range(args.repeat)]
+                seconds = min(elapsed for elapsed, _, _ in runs)
+                peak_rss = max(rss for _, rss, _ in runs)
+            else:
+                command = [sys.executable, __file__, 'measure', name, str(snapshot), deepest_path,
+                           '--repeat', str(args.repeat)]
+                _, peak_rss, output = _run_child(command, ROOT)
+                seconds = json.loads(output)["seconds"]
+            result = {"benchmark": name, "entries": entries, "seconds": seconds, "peak_rss_bytes": peak_rss}
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+
+    report = {
+        "version": _version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + '\n')
+    else:
+        print(text)
+
+def compare(args: argparse.Namespace) -> int:
+    old = json.loads(args.old.read_text())
+    new = json.loads(args.new.read_text())
+    old_results = {(result["benchmark"], result["entries"]): result for result in old["results"]}
+    regressions = 0
+    print(f"{'benchmark':<26}{'entries':>10}{'old s':>12}{'new s':>12}{'time':>8}{'old MiB':>10}{'new MiB':>10}{'rss':>8}")
+    for result in new["results"]:
+        previous = old_results.get((result["benchmark"], result["entries"]))
+        if previous is None:
+            continue
+        time_ratio = result["seconds"] / previous["seconds"] if previous["seconds"] else 1.0
+        rss_ratio = result["peak_rss_bytes"] / previous["peak_rss_bytes"] if previous["peak_rss_bytes"] else 1.0
+        regressed = time_ratio > 1 + args.threshold or rss_ratio > 1 + args.threshold
+        regressions += regressed
+        print(f"{result['benchmark']:<26}{result['entries']:>10}{previous['seconds']:>12.6f}{result['seconds']:>12.6f}"
+              f"{time_ratio:>7.2f}x{previous['peak_rss_bytes'] / 2**20:>10.1f}{result['peak_rss_bytes'] / 2**20:>10.1f}"
+              f"{rss_ratio:>7.2f}x{'  REGRESSION' if regressed else ''}")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pyls on synthetic snapshots')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--sizes', default='10k', help='Comma-separated entry counts, e.g. 10k,1m,10m')
+    run_parser.add_argument('--benchmarks', help=f"Comma-separated subset of: {', '.join(benchmark_names())}")
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark; the fastest is kept')
+    run_parser.add_argument('--data-dir', type=Path, default=Path(tempfile.gettempdir()) / 'pyls-bench',
+                            help='Directory for the generated snapshots')
+    run_parser.add_argument('--output', type=Path, help='Write the results to this file instead of stdout')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('old', type=Path)
+    compare_parser.add_argument('new', type=Path)
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='Relative slowdown or growth reported as a regression')
+
+    measure_parser = subparsers.add_parser('measure')
+    measure_parser.add_argument('name')
+    measure_parser.add_argument('snapshot', type=Path)
+    measure_parser.add_argument('deepest_path')
+    measure_parser.add_argument('--repeat', type=int, default=1)
+
+    derive_parser = subparsers.add_parser('derive')
+    derive_parser.add_argument('snapshot', type=Path)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        sys.exit(compare(args))
+    elif args.command == 'derive':
+        derive_copies(args.snapshot)
+    else:
+        measure_in_process(args.name, args.snapshot, args.deepest_path, args.repeat)
+
+if __name__ == '__main__':
+    main()
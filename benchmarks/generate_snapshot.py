@@ -0,0 +1,168 @@
+"""Generate synthetic structure.json snapshots of any size
+
+Usage: python benchmarks/generate_snapshot.py OUTPUT --entries N [options]
+
+The tree is written while it is generated, so snapshots with tens of millions
+of entries do not need to fit in memory. The same arguments and seed always
+produce the same file.
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+from typing import List, Optional, TextIO
+
+BASE_TIME = 1700000000
+TIME_SPAN = 5 * 365 * 86400
+EXTENSIONS = ['.txt', '.go', '.py', '.json', '.md', '.c', '.h', '']
+FILE_PERMISSIONS = ['-rw-r--r--', '-rw-r--r--', '-rw-r--r--', '-rwxr-xr-x', '-rw-------']
+SIZE_DISTRIBUTIONS = ('lognormal', 'uniform', 'fixed')
+TIME_DISTRIBUTIONS = ('uniform', 'recent')
+
+class SnapshotGenerator:
+    """Writes a synthetic tree with exactly the requested number of entries
+
+    Every directory above the deepest level gets up to breadth children, of
+    which about directory_ratio are directories, and the remaining entries are
+    shared evenly between those subdirectories. Directories at the deepest
+    level hold all the entries left for them, which produces a few very large
+    directories when the breadth and depth are small for the entry count.
+    """
+    def __init__(self, entries: int, breadth: int = 50, depth: int = 6, directory_ratio: float = 0.1,
+                 hidden_ratio: float = 0.05, size_distribution: str = 'lognormal',
+                 time_distribution: str = 'uniform', seed: int = 0):
+        if size_distribution not in SIZE_DISTRIBUTIONS:
+            raise ValueError(f"Size distribution must be one of: {', '.join(SIZE_DISTRIBUTIONS)}")
+        if time_distribution not in TIME_DISTRIBUTIONS:
+            raise ValueError(f"Time distribution must be one of: {', '.join(TIME_DISTRIBUTIONS)}")
+        self.entries = entries
+        self.breadth = max(1, breadth)
+        self.depth = max(1, depth)
+        self.directory_ratio = directory_ratio
+        self.hidden_ratio = hidden_ratio
+        self.size_distribution = size_distribution
+        self.time_distribution = time_distribution
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._counter = 0
+        self._parts: List[str] = []
+        self._buffered = 0
+        self._output: Optional[TextIO] = None
+        # Path of the first directory at the deepest level reached, for navigation benchmarks
+        self.deepest_path: List[str] = []
+
+    def _size(self) -> int:
+        if self.size_distribution == 'fixed':
+            return 4096
+        if self.size_distribution == 'uniform':
+            return self._random.randrange(1 << 20)
+        return min(int(self._random.lognormvariate(8, 2.5)), 1 << 40)
+
+    def _time(self) -> int:
+        if self.time_distribution == 'recent':
+            return BASE_TIME - min(int(self._random.expovariate(20 / TIME_SPAN)), TIME_SPAN)
+        return BASE_TIME - self._random.randrange(TIME_SPAN)
+
+    def _name(self, prefix: str, extension: str = '') -> str:
+        self._counter += 1
+        hidden = '.' if self._random.random() < self.hidden_ratio else ''
+        return f"{hidden}{prefix}_{self._counter}{extension}"
+
+    def _write(self, text: str):
+        self._parts.append(text)
+        self._buffered += len(text)
+        if self._buffered >= 1 << 20:
+            self._output.write(''.join(self._parts))
+            self._parts, self._buffered = [], 0
+
+    def _write_item(self, name: str, size: int, time_modified: int, permissions: str):
+        self._write(f'{{"name": {json.dumps(name)}, "size": {size}, '
+                    f'"time_modified": {time_modified}, "permissions": "{permissions}"')
+
+    def _write_directory(self, name: str, level: int, budget: int, path: List[str]):
+        """
+        Write a directory with budget entries below it
+
+        :param name: Directory name
+        :param level: Depth of the directory, 0 for the root
+        :param budget: Number of entries to write below the directory
+        :param path: Names of the directory's ancestors below the root
+        """
+        self._write_item(name, 4096, self._time(), 'drwxr-xr-x')
+        self._write(', "contents": [')
+        if level > len(self.deepest_path):
+            self.deepest_path = path
+        if level >= self.depth:
+            children, directories = budget, 0
+        else:
+            children = min(self.breadth, budget)
+            rest = budget - children
+            directories = min(children, round(children * self.directory_ratio))
+            if rest and not directories:
+                directories = 1
+
+        directory_positions = set(self._random.sample(range(children), directories))
+        rest = budget - children
+        # Entries below each subdirectory, in order
+        shares = [rest // directories + (share < rest % directories) for share in range(directories)]
+        for position in range(children):
+            if position:
+                self._write(', ')
+            if position in directory_positions:
+                child_name = self._name('dir')
+                self._write_directory(child_name, level + 1, shares.pop(0), path + [child_name])
+            else:
+                self._write_item(self._name('file', self._random.choice(EXTENSIONS)), self._size(),
+                                 self._time(), self._random.choice(FILE_PERMISSIONS))
+                self._write('}')
+        self._write(']}')
+
+    def write(self, output_path: Path) -> dict:
+        """
+        Write the snapshot
+
+        :param output_path: Path of the JSON file to write
+        :return: Description of the generated snapshot
+        """
+        with open(output_path, 'w') as self._output:
+            self._write_directory('root', 0, self.entries, [])
+            self._output.write(''.join(self._parts))
+        self._output, self._parts, self._buffered = None, [], 0
+        return {
+            "entries": self.entries,
+            "breadth": self.breadth,
+            "depth": self.depth,
+            "directory_ratio": self.directory_ratio,
+            "hidden_ratio": self.hidden_ratio,
+            "size_distribution": self.size_distribution,
+            "time_distribution": self.time_distribution,
+            "seed": self.seed,
+            "deepest_path": '/'.join(self.deepest_path),
+        }
+
+def parse_count(value: str) -> int:
+    """Parse an entry count such as 10000, 10k or 1m"""
+    multipliers = {'k': 1_000, 'm': 1_000_000}
+    value = value.strip().lower()
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic pyls snapshot')
+    parser.add_argument('output', type=Path, help='JSON file to write')
+    parser.add_argument('--entries', type=parse_count, default=10_000, help='Number of entries, e.g. 10k or 1m')
+    parser.add_argument('--breadth', type=int, default=50, help='Children per directory above the deepest level')
+    parser.add_argument('--depth', type=int, default=6, help='Deepest directory level')
+    parser.add_argument('--directory-ratio', type=float, default=0.1, help='Share of children that are directories')
+    parser.add_argument('--hidden-ratio', type=float, default=0.05, help='Share of hidden entries')
+    parser.add_argument('--size-distribution', choices=SIZE_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--time-distribution', choices=TIME_DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generator = SnapshotGenerator(args.entries, args.breadth, args.depth, args.directory_ratio,
+                                  args.hidden_ratio, args.size_distribution, args.time_distribution, args.seed)
+    print(json.dumps(generator.write(args.output)))
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,43 @@
+import threading
 from abc import abstractmethod
-from typing import List, Union
+from typing import Callable, Dict, List, Optional, Union
+
+from .file_system_error import FileSystemError
+from .file_system_mode import MODES, MODE_STRINGS, PermissionMode
 
 class FileSystemItem:
-    """Base class for file system items"""
+    """Base class for file system items
+
+    Permissions are kept as an integer mode, parsed once when the item is
+    created, and turned back into a string when they are printed. The few
+    strings the mode does not reproduce, such as ones with an ACL marker, are
+    kept as well.
+    """
+    __slots__ = ('name', 'size', 'time_modified', 'mode', '_permissions')
+
     def __init__(self, name: str, size: int, time_modified: int, permissions: str):
         self.name = name
         self.size = size
         self.time_modified = time_modified
-        self.permissions = permissions
+        # Every mode in the table is nonzero, since it has a file type
+        mode = MODES.get(permissions)
+        if mode:
+            self.mode, self._permissions = mode, None
+        else:
+            self.mode, self._permissions = PermissionMode.parse_keeping(permissions)
+
+    @property
+    def permissions(self) -> str:
+        """Permissions in the format of ls -l, such as '-rw-r--r--'"""
+        return self._permissions or MODE_STRINGS.get(self.mode) or PermissionMode.format(self.mode)
+
+    @permissions.setter
+    def permissions(self, permissions: str):
+        mode = MODES.get(permissions)
+        if mode:
+            self.mode, self._permissions = mode, None
+        else:
+            self.mode, self._permissions = PermissionMode.parse_keeping(permissions)
 
     @abstractmethod
     def is_directory(self) -> bool:
@@ -16,14 +46,173 @@ class FileSystemItem:
 
 class File(FileSystemItem):
     """Represents a file in the file system"""
+    __slots__ = ()
+
     def is_directory(self) -> bool:
         return False
 
 class Directory(FileSystemItem):
     """Represents a directory in the file system"""
+    __slots__ = ('_contents', '_children_by_name', '_indexed_length', 'total_size', 'total_entries', 'digest',
+                 'version')
+
     def __init__(self, name: str, size: int, time_modified: int, permissions: str, contents: List[Union[File, 'Directory']]):
         super().__init__(name, size, time_modified, permissions)
+        # Incremented whenever the contents change through this class
+        self.version = 0
         self.contents = contents
+        # Cumulative size and number of entries below, set by FileSystemAggregator
+        self.total_size: Optional[int] = None
+        self.total_entries: Optional[int] = None
+        # Merkle digest of the subtree, set by SubtreeHasher
+        self.digest: Optional[bytes] = None
+
+    @property
+    def contents(self) -> List[Union[File, 'Directory']]:
+        """Items in the directory"""
+        return self._contents
+
+    @contents.setter
+    def contents(self, contents: List[Union[File, 'Directory']]):
+        self._contents = contents
+        self._children_by_name: Optional[Dict[str, Union[File, 'Directory']]] = None
+        self._indexed_length = 0
+        self.version += 1
+
+    def get_child(self, name: str) -> Optional[Union[File, 'Directory']]:
+        """
+        Look up an item in the directory by name
+
+        The name index is built on first use and rebuilt when contents is
+        replaced or changes length. If several items share a name, the first
+        one wins.
+
+        :param name: Name of the item
+        :return: The item, or None if there is none
+        """
+        if self._children_by_name is None or self._indexed_length != len(self._contents):
+            children_by_name: Dict[str, Union[File, 'Directory']] = {}
+            for item in self._contents:
+                children_by_name.setdefault(item.name, item)
+            self._children_by_name = children_by_name
+            self._indexed_length = len(self._contents)
+        return self._children_by_name.get(name)
+
+    def add_child(self, item: Union[File, 'Directory']):
+        """
+        Append an item, keeping the name index current
+
+        :param item: Item to add
+        """
+        self._contents.append(item)
+        self.version += 1
+        if self._children_by_name is not None and self._indexed_length == len(self._contents) - 1:
+            self._children_by_name.setdefault(item.name, item)
+            self._indexed_length += 1
+
+    def remove_child(self, item: Union[File, 'Directory']):
+        """
+        Remove an item, keeping the name index current
+
+        :param item: Item to remove, compared by identity
+        """
+        for position, child in enumerate(self._contents):
+            if child is item:
+                break
+        else:
+            raise ValueError(f"'{item.name}' is not in '{self.name}'")
+        current = self._children_by_name is not None and self._indexed_length == len(self._contents)
+        del self._contents[position]
+        self.version += 1
+        if not current:
+            return
+        self._indexed_length -= 1
+        if self._children_by_name.get(item.name) is item:
+            del self._children_by_name[item.name]
+            # A later item with the same name is no longer shadowed
+            for child in self._contents[position:]:
+                if child.name == item.name:
+                    self._children_by_name[item.name] = child
+                    break
+
+    def mark_changed(self):
+        """Record that an item in the directory was changed in place"""
+        self.version += 1
 
     def is_directory(self) -> bool:
-        return True
\ No newline at end of file
+        return True
+
+class LazyDirectory(Directory):
+    """Directory whose contents are loaded on first access
+
+    The loader returns a directory whose contents become the contents of this
+    one, while the name and attributes given here are kept. Loading is
+    thread-safe, so several threads may touch the directory at once.
+    """
+    __slots__ = ('_loader', '_lock')
+
+    def __init__(self, name: str, size: int, time_modified: int, permissions: str,
+                 loader: Callable[[], Union[File, Directory]]):
+        super().__init__(name, size, time_modified, permissions, [])
+        self._loader: Optional[Callable[[], Union[File, Directory]]] = loader
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the contents have been loaded"""
+        return self._loader is None
+
+    def load(self):
+        """Load the contents unless they are loaded already"""
+        with self._lock:
+            if self._loader is None:
+                return
+            loaded = self._loader()
+            if not loaded.is_directory():
+                raise FileSystemError(f"Cannot load '{self.name}': Not a directory")
+            Directory.contents.fset(self, loaded.contents)
+            self._loader = None
+
+    def unload(self, loader: Callable[[], Union[File, Directory]]):
+        """
+        Drop the contents, to be loaded again on next access
+
+        :param loader: Loader returning the directory to take the contents of
+        """
+        with self._lock:
+            Directory.contents.fset(self, [])
+            self._loader = loader
+
+    def release(self):
+        """
+        Drop contents that can be loaded again, once a caller is done with them
+
+        Directories loaded from sources without a cheap way to reload them
+        keep their contents, which is the default.
+        """
+
+    def _ensure_loaded(self):
+        if self._loader is not None:
+            self.load()
+
+    @property
+    def contents(self) -> List[Union[File, Directory]]:
+        """Items in the directory, loaded on first access"""
+        self._ensure_loaded()
+        return self._contents
+
+    @contents.setter
+    def contents(self, contents: List[Union[File, Directory]]):
+        Directory.contents.fset(self, contents)
+
+    def get_child(self, name: str) -> Optional[Union[File, Directory]]:
+        self._ensure_loaded()
+        return super().get_child(name)
+
+    def add_child(self, item: Union[File, Directory]):
+        self._ensure_loaded()
+        super().add_child(item)
+
+    def remove_child(self, item: Union[File, Directory]):
+        self._ensure_loaded()
+        super().remove_child(item)
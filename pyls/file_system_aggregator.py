@@ -0,0 +1,96 @@
+from typing import Iterator, List, Optional, Union
+
+from .file_system import File, Directory
+from .file_system_filter import FileSystemFilter
+from .file_system_formatter import HumanReadableSizeFormatter
+from .file_system_sorter import FileSystemSorter, SortPlan
+from .file_system_store import DirectoryView
+
+class FileSystemAggregator:
+    """Computes cumulative sizes and entry counts of directory subtrees"""
+    @staticmethod
+    def compute_totals(root: Union[File, Directory]):
+        """
+        Set total_size and total_entries on every directory below root
+
+        total_size includes the directory's own size, total_entries counts all
+        files and directories below it. The tree is traversed once, bottom-up,
+        with an explicit stack.
+
+        :param root: Root directory or file
+        """
+        if not root.is_directory():
+            return
+        if isinstance(root, DirectoryView):
+            root.store.compute_totals()
+            return
+        stack = [(root, False)]
+        while stack:
+            directory, children_done = stack.pop()
+            if not children_done:
+                stack.append((directory, True))
+                stack.extend((item, False) for item in directory.contents if item.is_directory())
+                continue
+            total_size = directory.size
+            total_entries = 0
+            for item in directory.contents:
+                if item.is_directory():
+                    total_size += item.total_size
+                    total_entries += item.total_entries + 1
+                else:
+                    total_size += item.size
+                    total_entries += 1
+            directory.total_size = total_size
+            directory.total_entries = total_entries
+
+class DiskUsageReporter:
+    """Reports cumulative directory sizes like du"""
+    def __init__(self, sorters: Optional[List[FileSystemSorter]] = None,
+                 descend_filters: Optional[List[FileSystemFilter]] = None,
+                 human_readable: bool = False):
+        """
+        :param sorters: Sorters ordering sibling directories
+        :param descend_filters: Filters selecting the subdirectories to report
+        :param human_readable: Whether to print sizes in human-readable format
+        """
+        self.sorters = sorters or []
+        self.descend_filters = descend_filters or []
+        self.human_readable = human_readable
+
+    def report(self, item: Union[File, Directory], label: str = '.', max_depth: Optional[int] = None) -> Iterator[str]:
+        """
+        Generate one line per directory with its total size, entry count and path
+
+        Subdirectories are reported before their parent, as du does. A file is
+        reported on its own.
+
+        :param item: Directory or file to report on
+        :param label: Path printed for item
+        :param max_depth: Deepest level of subdirectories to report, all if None
+        :return: Iterator over output lines
+        """
+        if not item.is_directory():
+            yield self._format(item.size, 0, label)
+            return
+        if item.total_size is None:
+            FileSystemAggregator.compute_totals(item)
+        stack = [(item, label, 0, False)]
+        while stack:
+            directory, label, depth, children_done = stack.pop()
+            if children_done or (max_depth is not None and depth >= max_depth):
+                yield self._format(directory.total_size, directory.total_entries, label)
+                continue
+            stack.append((directory, label, depth, True))
+            subdirectories = self._subdirectories(directory)
+            stack.extend((item, f"{label.rstrip('/')}/{item.name}", depth + 1, False)
+                         for item in reversed(subdirectories))
+
+    def _subdirectories(self, directory: Directory) -> List[Directory]:
+        items = [item for item in directory.contents if item.is_directory()]
+        for filter_obj in self.descend_filters:
+            items = filter_obj.filter(items)
+        return SortPlan(self.sorters).sort(items)
+
+    def _format(self, size: int, entries: int, label: str) -> str:
+        size_text = HumanReadableSizeFormatter.humanize_size(size) if self.human_readable else str(size)
+        return f"{size_text}\t{entries}\t{label}"
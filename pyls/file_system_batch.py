@@ -0,0 +1,87 @@
+import json
+import shlex
+from pathlib import Path
+from typing import Iterable, List, Optional, TYPE_CHECKING
+
+from .file_system_error import FileSystemError
+from .file_system_loader import FileSystemLoader
+from .file_system_server import _RequestArgumentParser
+from .file_system_session import FileSystemSession
+from .file_system_writer import StreamWriter
+
+if TYPE_CHECKING:
+    from .pyls import PyLSCommandLineInterface
+
+class PyLSBatchRunner:
+    """Answers many listing queries against a snapshot loaded once
+
+    Each query is one line holding the arguments of a pyls listing, split like
+    a shell command line. Blank lines and lines starting with '#' are ignored.
+    Plain listings are answered by a FileSystemSession, which memoizes them,
+    and processors are shared between other queries with the same options.
+    """
+    FORMATS = ('text', 'json')
+
+    def __init__(self, cli: 'PyLSCommandLineInterface', snapshot_path: Path, output_format: str = 'text'):
+        """
+        :param cli: Command-line interface used to render each query
+        :param snapshot_path: Path of the snapshot to load
+        :param output_format: 'text' for a header line before each result,
+                              'json' for one JSON object per query
+        """
+        if output_format not in self.FORMATS:
+            raise ValueError(f"Format must be one of: {', '.join(self.FORMATS)}")
+        self.cli = cli
+        self.snapshot_path = snapshot_path
+        self.output_format = output_format
+        self._parser = cli._create_argument_parser(_RequestArgumentParser)
+        self._root = None
+        self._session: Optional[FileSystemSession] = None
+
+    def load(self):
+        """Load the whole snapshot"""
+        self._root = FileSystemLoader.load_snapshot(self.snapshot_path, depth=None)
+        self._session = FileSystemSession(self._root)
+
+    def _render(self, query: str) -> List[str]:
+        parsed_args = self._parser.parse_args(shlex.split(query))
+        if parsed_args.help:
+            return self.cli.HELP_TEXT.splitlines()
+        lines = self._session.render(parsed_args)
+        return lines if lines is not None else self.cli.render(self._root, parsed_args)
+
+    def run(self, queries: Iterable[str], writer: StreamWriter) -> int:
+        """
+        Answer queries in order and write their results, flushing the writer at the end
+
+        :param queries: Query lines
+        :param writer: Writer receiving the results
+        :return: 0 if every query succeeded, 1 otherwise
+        """
+        if self._root is None:
+            self.load()
+        status = 0
+        first = True
+        for query in queries:
+            query = query.strip()
+            if not query or query.startswith('#'):
+                continue
+            try:
+                lines = self._render(query)
+                error = None
+            except (FileSystemError, ValueError) as e:
+                lines, error = [], str(e)
+                status = 1
+
+            if self.output_format == 'json':
+                result = {"query": query, "status": 1, "error": error} if error else \
+                         {"query": query, "status": 0, "lines": lines}
+                writer.write_lines([json.dumps(result)])
+                continue
+            if not first:
+                writer.write_lines([''])
+            first = False
+            writer.write_lines([f"==> {query} <=="])
+            writer.write_lines([f"error: {error}"] if error else lines)
+        writer.flush()
+        return status
@@ -0,0 +1,129 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+from .file_system_error import FileSystemError
+from .file_system_loader import FileSystemLoader
+from .file_system_snapshot import SnapshotCompiler, VERSION
+
+class SnapshotCache:
+    """On-disk cache of compiled snapshots keyed on the identity of their JSON source
+
+    An entry is keyed on the source's resolved path, size and modification time,
+    and optionally on a hash of its content, so a changed snapshot never hits a
+    stale entry. Entries for older versions of the same source are removed when
+    a new one is written, and the least recently used entries are evicted when
+    the cache grows beyond max_bytes.
+    """
+    DEFAULT_MAX_BYTES = 1 << 30
+    SUFFIX = '.pyls'
+
+    def __init__(self, cache_dir: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 verify_content: bool = False):
+        self.cache_dir = Path(cache_dir) if cache_dir else self.default_directory()
+        self.max_bytes = max_bytes
+        self.verify_content = verify_content
+
+    @staticmethod
+    def default_directory() -> Path:
+        """
+        Return the default cache directory
+
+        :return: $PYLS_CACHE_DIR, else $XDG_CACHE_HOME/pyls, else ~/.cache/pyls
+        """
+        if os.environ.get('PYLS_CACHE_DIR'):
+            return Path(os.environ['PYLS_CACHE_DIR'])
+        cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+        return Path(cache_home) / 'pyls'
+
+    def _source_key(self, source: Path) -> str:
+        return hashlib.sha256(str(source.resolve()).encode('utf-8')).hexdigest()[:16]
+
+    def _identity_key(self, source: Path) -> str:
+        try:
+            stat = source.stat()
+            identity = hashlib.sha256(f"{VERSION}\0{stat.st_size}\0{stat.st_mtime_ns}".encode('utf-8'))
+            if self.verify_content:
+                with open(source, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        identity.update(chunk)
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{source}': No such file or directory")
+        except OSError as e:
+            raise FileSystemError(f"Cannot read '{source}': {e.strerror}")
+        return identity.hexdigest()[:16]
+
+    def entry_path(self, source: Path) -> Path:
+        """
+        Return the cache entry path for the current state of a source
+
+        :param source: Path to the JSON snapshot
+        :return: Path of the compiled snapshot in the cache
+        """
+        return self.cache_dir / f"{self._source_key(source)}-{self._identity_key(source)}{self.SUFFIX}"
+
+    def get(self, source: Path) -> Optional[Path]:
+        """
+        Return a compiled snapshot for source, compiling it on a miss
+
+        :param source: Path to the JSON snapshot
+        :return: Path of the compiled snapshot in the cache, or None if the
+                 cache directory cannot be written
+        :raises FileSystemError: If source cannot be read
+        """
+        entry = self.entry_path(source)
+        try:
+            # Touch the entry so eviction sees it as recently used
+            os.utime(entry)
+            return entry
+        except FileNotFoundError:
+            # Not cached yet, or evicted by another process since
+            pass
+        except OSError:
+            # A read-only cache still serves its entries
+            if entry.exists():
+                return entry
+
+        root = FileSystemLoader.load_from_json(source)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            SnapshotCompiler.write(root, entry)
+        except (OSError, FileSystemError):
+            return None
+        for stale in self.cache_dir.glob(f"{self._source_key(source)}-*{self.SUFFIX}"):
+            if stale != entry:
+                try:
+                    stale.unlink()
+                except OSError:
+                    # Already removed by another process, or not ours to remove
+                    pass
+        self.evict(keep=entry)
+        return entry
+
+    def evict(self, keep: Optional[Path] = None):
+        """
+        Remove least recently used entries until the cache fits in max_bytes
+
+        :param keep: Entry that must not be removed
+        """
+        entries = []
+        for entry in self.cache_dir.glob(f"*{self.SUFFIX}"):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            total -= size
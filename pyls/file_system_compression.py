@@ -0,0 +1,108 @@
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+from .file_system_error import FileSystemError
+
+# Compression name -> (magic bytes, file suffix)
+COMPRESSIONS: Dict[str, Tuple[bytes, str]] = {
+    'gzip': (b'\x1f\x8b', '.gz'),
+    'bz2': (b'BZh', '.bz2'),
+    'xz': (b'\xfd7zXZ\x00', '.xz'),
+}
+SUFFIXES = tuple(suffix for _, suffix in COMPRESSIONS.values())
+_MAGIC_BYTES = max(len(magic) for magic, _ in COMPRESSIONS.values())
+
+class _DecompressingReader:
+    """Binary stream decompressing a snapshot as it is read
+
+    Errors of the decompressor, which only show up while reading, are
+    reported as FileSystemError.
+    """
+    def __init__(self, stream: BinaryIO, path: Path, errors: Tuple[type, ...]):
+        self._stream = stream
+        self._path = path
+        self._errors = errors
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            return self._stream.read(size)
+        except self._errors:
+            raise FileSystemError(f"Invalid compressed snapshot '{self._path}'")
+
+    def readline(self, size: int = -1) -> bytes:
+        try:
+            return self._stream.readline(size)
+        except self._errors:
+            raise FileSystemError(f"Invalid compressed snapshot '{self._path}'")
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self) -> '_DecompressingReader':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class CompressedInput:
+    """Opens snapshots compressed with gzip, bz2 or xz as plain binary streams
+
+    Snapshots are decompressed while they are read, so no temporary copy is
+    written and a streaming parser only holds one chunk at a time.
+    """
+    @staticmethod
+    def compression(path: Path) -> Optional[str]:
+        """
+        Detect the compression of a file from its suffix, or else its first bytes
+
+        :param path: Path to the file
+        :return: Key of COMPRESSIONS, or None for uncompressed or missing files
+        """
+        suffix = Path(path).suffix
+        for name, (_, compressed_suffix) in COMPRESSIONS.items():
+            if suffix == compressed_suffix:
+                return name
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(_MAGIC_BYTES)
+        except OSError:
+            return None
+        for name, (magic, _) in COMPRESSIONS.items():
+            if head.startswith(magic):
+                return name
+        return None
+
+    @staticmethod
+    def inner_path(path: Path) -> Path:
+        """
+        Return the path without its compression suffix
+
+        :param path: Path such as structure.ndjson.xz
+        :return: Path such as structure.ndjson
+        """
+        path = Path(path)
+        return path.with_suffix('') if path.suffix in SUFFIXES else path
+
+    @staticmethod
+    def open(path: Path, compression: Optional[str] = None) -> Union[BinaryIO, _DecompressingReader]:
+        """
+        Open a snapshot for reading, decompressing it on the fly
+
+        :param path: Path to the snapshot
+        :param compression: Key of COMPRESSIONS, detected if None
+        :return: Binary stream of the uncompressed content
+        :raises FileNotFoundError: If path does not exist
+        """
+        compression = compression or CompressedInput.compression(path)
+        if compression is None:
+            return open(path, 'rb')
+        if compression == 'gzip':
+            import gzip
+            stream, errors = gzip.open(path, 'rb'), (OSError, EOFError)
+        elif compression == 'bz2':
+            import bz2
+            stream, errors = bz2.open(path, 'rb'), (OSError, EOFError)
+        else:
+            import lzma
+            stream, errors = lzma.open(path, 'rb'), (lzma.LZMAError, EOFError)
+        return _DecompressingReader(stream, Path(path), errors)
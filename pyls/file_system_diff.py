@@ -0,0 +1,147 @@
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+from .file_system import File, Directory
+from .file_system_hash import SubtreeHasher
+from .file_system_loader import FileSystemLoader
+from .file_system_snapshot import CompiledSnapshot
+
+ADDED = 'A'
+REMOVED = 'D'
+MODIFIED = 'M'
+
+class _TreeSide:
+    """Nodes of a loaded tree, which are the items themselves"""
+    def __init__(self, root: Union[File, Directory]):
+        SubtreeHasher.compute(root)
+        self.root = root
+
+    def digest(self, node: Union[File, Directory]) -> bytes:
+        return SubtreeHasher.digest(node)
+
+    def is_directory(self, node: Union[File, Directory]) -> bool:
+        return node.is_directory()
+
+    def children(self, node: Directory) -> Dict[str, Union[File, Directory]]:
+        children: Dict[str, Union[File, Directory]] = {}
+        for item in node.contents:
+            children.setdefault(item.name, item)
+        return children
+
+    def item(self, node: Union[File, Directory]) -> Union[File, Directory]:
+        return node
+
+class _CompiledSide:
+    """Nodes of a compiled snapshot, which are record indexes"""
+    def __init__(self, snapshot: CompiledSnapshot):
+        self.snapshot = snapshot
+        self.root = 0
+
+    def digest(self, node: int) -> bytes:
+        return self.snapshot.digest(node)
+
+    def is_directory(self, node: int) -> bool:
+        return self.snapshot.is_directory(node)
+
+    def children(self, node: int) -> Dict[str, int]:
+        children: Dict[str, int] = {}
+        for child in self.snapshot.children(node):
+            children.setdefault(self.snapshot.name(child), child)
+        return children
+
+    def item(self, node: int) -> Union[File, Directory]:
+        return self.snapshot.item(node)
+
+class SnapshotDiff:
+    """Finds the entries that differ between two snapshots
+
+    Both trees carry Merkle digests of every subtree: compiled snapshots
+    store them, other snapshots are hashed while they are loaded. Subtrees
+    with equal digests are skipped without being visited, so only the paths
+    leading to changes are compared. With compiled snapshots on both sides
+    nothing else is even read from disk.
+    """
+    def __init__(self, old_path: Path, new_path: Path):
+        """
+        :param old_path: Path of the old snapshot
+        :param new_path: Path of the new snapshot
+        """
+        self._snapshots: List[CompiledSnapshot] = []
+        self.old = self._open(old_path)
+        self.new = self._open(new_path)
+        # Number of node pairs whose digests were compared
+        self.nodes_compared = 0
+
+    def _open(self, path: Path) -> Union[_TreeSide, _CompiledSide]:
+        if CompiledSnapshot.is_compiled(path):
+            snapshot = CompiledSnapshot(path)
+            if snapshot.has_digests:
+                self._snapshots.append(snapshot)
+                return _CompiledSide(snapshot)
+            snapshot.close()
+            return _TreeSide(FileSystemLoader.load_snapshot(path, depth=None))
+        return _TreeSide(FileSystemLoader.load_from_json(path))
+
+    def close(self):
+        """Release the compiled snapshots"""
+        for snapshot in self._snapshots:
+            snapshot.close()
+        self._snapshots = []
+
+    def __enter__(self) -> 'SnapshotDiff':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def iter_changes(self) -> Iterator[Tuple[str, str, Union[File, Directory]]]:
+        """
+        Generate the differences, depth-first in name order
+
+        An added or removed directory is reported once, without its contents.
+        An entry whose type changed is reported as removed and added again.
+
+        :return: Iterator over (status, path, item), where status is ADDED,
+                 REMOVED or MODIFIED, path is relative to the root ('.' for the
+                 root) and item is the new entry, or the old one if it was removed
+        """
+        old, new = self.old, self.new
+        # Holds changes to report and, with a None status, node pairs still
+        # to compare, the next one on top
+        stack: List[Tuple[Any, ...]] = [(None, '', old.root, new.root)]
+        while stack:
+            entry = stack.pop()
+            if entry[0] is not None:
+                yield entry
+                continue
+            _, path, old_node, new_node = entry
+            self.nodes_compared += 1
+            if old.digest(old_node) == new.digest(new_node):
+                continue
+            old_item, new_item = old.item(old_node), new.item(new_node)
+            if not (old.is_directory(old_node) and new.is_directory(new_node)):
+                stack.append((MODIFIED, path or '.', new_item))
+                continue
+
+            pending: List[Tuple[Any, ...]] = []
+            if (old_item.size, old_item.time_modified, old_item.permissions) != \
+                    (new_item.size, new_item.time_modified, new_item.permissions):
+                pending.append((MODIFIED, path or '.', new_item))
+            old_children, new_children = old.children(old_node), new.children(new_node)
+            for name in sorted(old_children.keys() | new_children.keys()):
+                child_path = f"{path}/{name}" if path else name
+                old_child, new_child = old_children.get(name), new_children.get(name)
+                if new_child is None:
+                    pending.append((REMOVED, child_path, old.item(old_child)))
+                elif old_child is None:
+                    pending.append((ADDED, child_path, new.item(new_child)))
+                elif old.is_directory(old_child) != new.is_directory(new_child):
+                    pending.append((REMOVED, child_path, old.item(old_child)))
+                    pending.append((ADDED, child_path, new.item(new_child)))
+                elif old.is_directory(old_child):
+                    pending.append((None, child_path, old_child, new_child))
+                else:
+                    self.nodes_compared += 1
+                    if old.digest(old_child) != new.digest(new_child):
+                        pending.append((MODIFIED, child_path, new.item(new_child)))
+            stack.extend(reversed(pending))
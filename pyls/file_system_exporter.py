@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Iterator, Optional, TextIO, Union
+
+from .file_system import File, Directory
+from .file_system_error import FileSystemError
+from .file_system_flat import FlatSnapshot, SUFFIXES
+
+FORMATS = ('json', 'ndjson', 'compiled')
+# Text written to the output at once
+_CHUNK_CHARS = 1 << 16
+
+class SnapshotExporter:
+    """Writes trees back out as snapshots in any of the supported formats"""
+    @staticmethod
+    def format_for(output_path: Optional[Path]) -> str:
+        """
+        Pick the snapshot format from the suffix of the output path
+
+        :param output_path: Path to write, None for stdout
+        :return: 'compiled' for .pyls, 'ndjson' for .ndjson and .jsonl, else 'json'
+        """
+        if output_path is None:
+            return 'json'
+        if output_path.suffix == '.pyls':
+            return 'compiled'
+        if output_path.suffix in SUFFIXES:
+            return 'ndjson'
+        return 'json'
+
+    @staticmethod
+    def iter_json(root: Union[File, Directory]) -> Iterator[str]:
+        """
+        Generate the nested JSON document of a tree in pieces
+
+        The tree is walked with an explicit stack, so deep trees do not hit
+        the recursion limit.
+
+        :param root: Root Directory or File
+        :return: Iterator over pieces of the document
+        """
+        stack = [root]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                yield item
+                continue
+            head = (f'{{"name": {json.dumps(item.name)}, "size": {json.dumps(item.size)}, '
+                    f'"time_modified": {json.dumps(item.time_modified)}, '
+                    f'"permissions": {json.dumps(item.permissions)}')
+            if not item.is_directory():
+                yield head + '}'
+                continue
+            yield head + ', "contents": ['
+            stack.append(']}')
+            for position in range(len(item.contents) - 1, -1, -1):
+                stack.append(item.contents[position])
+                if position:
+                    stack.append(', ')
+
+    @staticmethod
+    def _write_text(pieces: Iterator[str], stream: TextIO, newlines: bool = False):
+        chunk = []
+        length = 0
+        for piece in pieces:
+            chunk.append(piece)
+            length += len(piece)
+            if length >= _CHUNK_CHARS:
+                stream.write(('\n' if newlines else '').join(chunk) + ('\n' if newlines else ''))
+                chunk, length = [], 0
+        if chunk:
+            stream.write(('\n' if newlines else '').join(chunk) + ('\n' if newlines else ''))
+
+    @staticmethod
+    def write(root: Union[File, Directory], output_path: Optional[Path] = None,
+              output_format: Optional[str] = None, stream: Optional[TextIO] = None):
+        """
+        Write a tree as a snapshot
+
+        :param root: Root Directory or File
+        :param output_path: Path to write, replaced atomically; stream if None
+        :param output_format: One of FORMATS, chosen from output_path if None
+        :param stream: Stream written when there is no output_path, stdout by default
+        """
+        output_format = output_format or SnapshotExporter.format_for(output_path)
+        if output_format not in FORMATS:
+            raise FileSystemError(f"Unknown snapshot format '{output_format}'")
+        if output_format == 'compiled':
+            if output_path is None:
+                raise FileSystemError("Compiled snapshots must be written to a file")
+            from .file_system_snapshot import SnapshotCompiler
+            SnapshotCompiler.write(root, output_path)
+            return
+
+        pieces = FlatSnapshot.iter_lines(root) if output_format == 'ndjson' else SnapshotExporter.iter_json(root)
+        newlines = output_format == 'ndjson'
+        if output_path is None:
+            SnapshotExporter._write_text(pieces, stream or sys.stdout, newlines)
+            if not newlines:
+                (stream or sys.stdout).write('\n')
+            return
+        temp_path = f"{output_path}.tmp{os.getpid()}"
+        try:
+            with open(temp_path, 'w') as f:
+                SnapshotExporter._write_text(pieces, f, newlines)
+            os.replace(temp_path, output_path)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise FileSystemError(f"Cannot write '{output_path}': {e.strerror}")
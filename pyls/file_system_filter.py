@@ -1,22 +1,37 @@
 from .file_system import FileSystemItem
+from .file_system_store import ColumnarContents
 from abc import ABC, abstractmethod
-from typing import List
+from array import array
+from itertools import compress
+from operator import attrgetter
+from typing import Iterable, Iterator, List
 
 class FileSystemFilter(ABC):
     """Abstract base class for filtering filesystem items"""
     @abstractmethod
-    def filter(self, items: List[FileSystemItem]) -> List[FileSystemItem]:
-        """Filter the list of items"""
+    def matches(self, item: FileSystemItem) -> bool:
+        """Check whether an item passes the filter"""
         pass
 
+    def filter(self, items: Iterable[FileSystemItem]) -> List[FileSystemItem]:
+        """Filter the list of items"""
+        return [item for item in items if self.matches(item)]
+
+    def select(self, items: Iterable[FileSystemItem]) -> Iterable[FileSystemItem]:
+        """Lazily select the items that pass the filter"""
+        return filter(self.matches, items)
+
 class HiddenItemsFilter(FileSystemFilter):
     """Filter out hidden items"""
     def __init__(self, show_hidden: bool = False):
         self.show_hidden = show_hidden
 
-    def filter(self, items: List[FileSystemItem]) -> List[FileSystemItem]:
+    def matches(self, item: FileSystemItem) -> bool:
+        return self.show_hidden or not item.name.startswith('.')
+
+    def filter(self, items: Iterable[FileSystemItem]) -> List[FileSystemItem]:
         if self.show_hidden:
-            return items
+            return list(items)
         return [item for item in items if not item.name.startswith('.')]
 
 class TypeFilter(FileSystemFilter):
@@ -26,7 +41,73 @@ class TypeFilter(FileSystemFilter):
             raise ValueError("Type must be 'file' or 'dir'")
         self.item_type = item_type
 
-    def filter(self, items: List[FileSystemItem]) -> List[FileSystemItem]:
-        if self.item_type == 'file':
-            return [item for item in items if not item.is_directory()]
-        return [item for item in items if item.is_directory()]
\ No newline at end of file
+    def matches(self, item: FileSystemItem) -> bool:
+        return item.is_directory() == (self.item_type == 'dir')
+
+class PermissionFilter(FileSystemFilter):
+    """Filter items by their permission bits, like find -perm
+
+    The specification is an octal mode that the permission bits must equal,
+    an octal mode prefixed with '-' whose bits must all be set, one prefixed
+    with '/' of which any bit must be set, or one of NAMES. Items are tested
+    with integer operations only. Over a list of items, or the contents of
+    a directory of the columnar store, the modes are tested in one pass
+    that runs no Python code per item; a store's modes are read from its
+    mode array without creating item views.
+    """
+    NAMES = {
+        'world-writable': '/002',
+        'group-writable': '/020',
+        'executable': '/111',
+        'setuid': '-4000',
+        'setgid': '-2000',
+        'sticky': '-1000',
+    }
+
+    def __init__(self, spec: str):
+        """
+        :param spec: Permission specification, such as '644', '-755', '/022' or 'executable'
+        """
+        text = self.NAMES.get(spec, spec)
+        self.test = text[0] if text[:1] in ('-', '/') else '='
+        digits = text[1:] if self.test != '=' else text
+        if not digits or len(digits) > 4 or any(digit not in '01234567' for digit in digits):
+            raise ValueError(f"Permissions must be an octal mode, -MODE, /MODE or one of: {', '.join(self.NAMES)}")
+        self.mask = int(digits, 8)
+
+    def _tests(self, modes: Iterable[int]) -> Iterator[bool]:
+        """Test modes without running Python code per mode"""
+        mask = self.mask
+        if self.test == '/':
+            return map(mask.__and__, modes)
+        if self.test == '-':
+            return map(mask.__eq__, map(mask.__and__, modes))
+        return map(mask.__eq__, map(0o7777.__and__, modes))
+
+    def matches(self, item: FileSystemItem) -> bool:
+        return self.matches_mode(item.mode)
+
+    def matches_mode(self, mode: int) -> bool:
+        """
+        Test a mode without an item
+
+        :param mode: Mode with the file type and permission bits of st_mode
+        :return: True if the mode passes the filter
+        """
+        if self.test == '/':
+            return bool(mode & self.mask)
+        if self.test == '-':
+            return mode & self.mask == self.mask
+        return mode & 0o7777 == self.mask
+
+    def filter(self, items: Iterable[FileSystemItem]) -> List[FileSystemItem]:
+        return list(self.select(items))
+
+    def select(self, items: Iterable[FileSystemItem]) -> Iterable[FileSystemItem]:
+        if isinstance(items, ColumnarContents):
+            store = items.store
+            selected = compress(items.indexes, self._tests(map(store.modes.__getitem__, items.indexes)))
+            return ColumnarContents(store, array('I', selected))
+        if isinstance(items, list):
+            return compress(items, self._tests(map(attrgetter('mode'), items)))
+        return filter(self.matches, items)
@@ -0,0 +1,255 @@
+import gc
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from .file_system import File, Directory
+from .file_system_compression import CompressedInput
+from .file_system_error import FileSystemError
+from .file_system_navigator import FileSystemNavigator
+
+SUFFIXES = ('.ndjson', '.jsonl')
+# Longest first line read when checking whether a file is a flat snapshot
+_SNIFF_BYTES = 1 << 16
+# Files smaller than this are parsed in-process
+_PARALLEL_MIN_BYTES = 8 << 20
+_MIN_CHUNK_BYTES = 4 << 20
+_CHUNKS_PER_JOB = 4
+# Decompressed bytes parsed at once from compressed snapshots
+_STREAM_CHUNK_BYTES = 4 << 20
+
+# path -> (is directory, size, time_modified, permissions, name)
+_Record = Tuple[bool, int, int, str, Optional[str]]
+
+@contextmanager
+def _gc_paused():
+    """Pause the cyclic garbage collector, which would otherwise keep
+    rescanning the millions of new objects while a snapshot is built"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _normalize(path: str) -> str:
+    if not path or path[0] in './' or path[-1] == '/' or '//' in path or '/.' in path:
+        return '/'.join(FileSystemNavigator.split_path(path))
+    return path
+
+def _parse_lines(data: bytes) -> List[Tuple[str, _Record]]:
+    """
+    Parse the entries of complete lines
+
+    :param data: Lines of a flat snapshot
+    :return: (path, record) pairs in file order
+    """
+    lines = [line for line in data.split(b'\n') if line.strip()]
+    if not lines:
+        return []
+    try:
+        entries = json.loads(b'[' + b','.join(lines) + b']')
+        return [(_normalize(entry['path']),
+                 (entry.get('type', 'file') == 'dir', entry['size'], entry['time_modified'],
+                  entry['permissions'], entry.get('name')))
+                for entry in entries]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise FileSystemError("Invalid NDJSON snapshot")
+
+def _parse_range(path: str, start: int, end: int) -> List[Tuple[str, _Record]]:
+    """
+    Parse the lines starting within a byte range of a flat snapshot
+
+    :param path: Path of the snapshot
+    :param start: First byte of the range
+    :param end: Byte after the range
+    :return: (path, record) pairs in file order
+    """
+    with open(path, 'rb') as f:
+        if start:
+            # Skip the line that started before the range
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        if position >= end:
+            return []
+        data = f.read(end - position)
+        if not data.endswith(b'\n'):
+            data += f.readline()
+    with _gc_paused():
+        return _parse_lines(data)
+
+def _parse_stream(stream: BinaryIO) -> Iterator[List[Tuple[str, _Record]]]:
+    """
+    Parse the lines of a stream that cannot be split into byte ranges
+
+    :param stream: Binary stream of a flat snapshot
+    :return: Iterator over lists of (path, record) pairs, in file order
+    """
+    rest = b''
+    while True:
+        chunk = stream.read(_STREAM_CHUNK_BYTES)
+        if not chunk:
+            break
+        # The last line may continue in the next chunk
+        data, newline, rest = (rest + chunk).rpartition(b'\n')
+        if newline:
+            yield _parse_lines(data)
+    yield _parse_lines(rest)
+
+class FlatSnapshot:
+    """Reads and writes the flat, line-delimited snapshot format
+
+    Every line is a JSON object describing one entry by its full path:
+    {"path": "parser/parser.go", "type": "file", "size": 1622,
+    "time_modified": 1700000000, "permissions": "-rw-r--r--"}. The root has
+    the path "." and may carry its name. Directories have the type "dir", and
+    every directory above an entry needs an entry of its own. When a path
+    occurs on several lines the last one wins, while the entry keeps the
+    position of the first, so snapshots can be updated by appending lines.
+
+    Since lines are independent, large files are split into byte ranges that
+    are parsed in a process pool before the tree is assembled. Compressed
+    files cannot be split and are parsed in one streaming pass instead.
+    """
+    @staticmethod
+    def is_flat(path: Path) -> bool:
+        """
+        Check whether a file is a flat snapshot
+
+        :param path: Path to the file
+        :return: True for .ndjson and .jsonl files, compressed or not, and for
+                 files whose first line is a JSON object with a path
+        """
+        if CompressedInput.inner_path(path).suffix in SUFFIXES:
+            return True
+        try:
+            with CompressedInput.open(path) as f:
+                line = f.readline(_SNIFF_BYTES)
+        except (OSError, FileSystemError):
+            return False
+        if not line.endswith(b'\n'):
+            return False
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return False
+        return isinstance(entry, dict) and 'path' in entry
+
+    @staticmethod
+    def _ranges(size: int, jobs: int) -> List[Tuple[int, int]]:
+        chunk = max(_MIN_CHUNK_BYTES, -(-size // (jobs * _CHUNKS_PER_JOB)))
+        return [(start, min(start + chunk, size)) for start in range(0, size, chunk)]
+
+    @staticmethod
+    def load(path: Path, jobs: Optional[int] = None) -> Union[File, Directory]:
+        """
+        Load a flat snapshot
+
+        :param path: Path to the snapshot
+        :param jobs: Number of worker processes, the number of CPUs if None;
+                     compressed snapshots are always parsed in-process
+        :return: Root Directory or File
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            raise FileSystemError(f"Cannot access '{path}': No such file or directory")
+        jobs = jobs or os.cpu_count() or 1
+        records: Dict[str, _Record] = {}
+        compression = CompressedInput.compression(path)
+        if compression is not None:
+            with CompressedInput.open(path, compression) as f, _gc_paused():
+                for pairs in _parse_stream(f):
+                    records.update(pairs)
+        elif jobs <= 1 or size < _PARALLEL_MIN_BYTES:
+            records.update(_parse_range(str(path), 0, size))
+        else:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            ranges = FlatSnapshot._ranges(size, jobs)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            with ProcessPoolExecutor(jobs, mp_context=context) as executor:
+                # Chunks arrive in file order, so later lines still win
+                for pairs in executor.map(_parse_range, [str(path)] * len(ranges),
+                                          [start for start, _ in ranges], [end for _, end in ranges]):
+                    records.update(pairs)
+        with _gc_paused():
+            return FlatSnapshot._assemble(records)
+
+    @staticmethod
+    def _assemble(records: Dict[str, _Record]) -> Union[File, Directory]:
+        """
+        Build the tree of the parsed entries
+
+        :param records: Entries by normalized path, in listing order
+        :return: Root Directory or File
+        """
+        root_record = records.pop('', None)
+        if root_record is None:
+            raise FileSystemError("Invalid NDJSON snapshot: no root entry")
+        is_directory, size, time_modified, permissions, name = root_record
+        if not is_directory:
+            if records:
+                raise FileSystemError("Invalid NDJSON snapshot: the root is not a directory")
+            return File(name or '.', size, time_modified, permissions)
+
+        root = Directory(name or '.', size, time_modified, permissions, [])
+        items: Dict[str, Union[File, Directory]] = {}
+        for path, (is_directory, size, time_modified, permissions, _) in records.items():
+            name = path.rpartition('/')[2]
+            if is_directory:
+                items[path] = Directory(name, size, time_modified, permissions, [])
+            else:
+                items[path] = File(name, size, time_modified, permissions)
+        for path, item in items.items():
+            parent_path = path.rpartition('/')[0]
+            parent = items.get(parent_path) if parent_path else root
+            if parent is None or not parent.is_directory():
+                raise FileSystemError(f"Invalid NDJSON snapshot: '{parent_path}' is not a directory")
+            parent.contents.append(item)
+        return root
+
+    @staticmethod
+    def iter_lines(root: Union[File, Directory]) -> Iterator[str]:
+        """
+        Generate the lines describing a tree, parents before their contents
+
+        :param root: Root Directory or File
+        :return: Iterator over lines without line breaks
+        """
+        stack = [(root, '.')]
+        while stack:
+            item, path = stack.pop()
+            entry = {"path": path}
+            if path == '.':
+                entry["name"] = item.name
+            entry.update(type='dir' if item.is_directory() else 'file', size=item.size,
+                         time_modified=item.time_modified, permissions=item.permissions)
+            yield json.dumps(entry)
+            if item.is_directory():
+                prefix = '' if path == '.' else f"{path}/"
+                stack.extend((child, f"{prefix}{child.name}") for child in reversed(item.contents))
+
+    @staticmethod
+    def write(root: Union[File, Directory], output_path: Path):
+        """
+        Write a tree as a flat snapshot
+
+        :param root: Root Directory or File
+        :param output_path: Path of the snapshot to write
+        """
+        temp_path = f"{output_path}.tmp{os.getpid()}"
+        try:
+            with open(temp_path, 'w') as f:
+                for line in FlatSnapshot.iter_lines(root):
+                    f.write(line + '\n')
+            os.replace(temp_path, output_path)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise FileSystemError(f"Cannot write '{output_path}': {e.strerror}")
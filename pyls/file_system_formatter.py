@@ -1,50 +1,106 @@
+import time
 from abc import ABC, abstractmethod
-from typing import List
+from itertools import repeat
+from operator import attrgetter, floordiv
+from typing import Any, Callable, Iterable, Iterator, List, Sequence
 from .file_system import FileSystemItem
-from datetime import datetime
 
 class FileSystemFormatter(ABC):
     """Abstract base class for formatting filesystem items"""
     @abstractmethod
-    def format(self, items: List[FileSystemItem]) -> List[str]:
-        """Format the list of items"""
+    def iter_format(self, items: Iterable[FileSystemItem]) -> Iterator[str]:
+        """Format items one at a time as they are consumed"""
         pass
 
+    def format(self, items: Iterable[FileSystemItem]) -> List[str]:
+        """Format the list of items"""
+        return list(self.iter_format(items))
+
 class NameFormatter(FileSystemFormatter):
     """Formatter that returns just the names of items"""
-    def format(self, items: List[FileSystemItem]) -> List[str]:
-        return [item.name for item in items]
+    def iter_format(self, items: Iterable[FileSystemItem]) -> Iterator[str]:
+        return (item.name for item in items)
+
+class _LookupTable(dict):
+    """Dictionary that computes missing entries on lookup and keeps at most max_entries"""
+    def __init__(self, compute: Callable[[Any], str], max_entries: int = 1 << 16):
+        super().__init__()
+        self.compute = compute
+        self.max_entries = max_entries
+
+    def __missing__(self, key: Any) -> str:
+        if len(self) >= self.max_entries:
+            self.clear()
+        value = self[key] = self.compute(key)
+        return value
+
+# Text of each minute, counted from the epoch, as shown by ls -l
+_MINUTE_TEXTS = _LookupTable(lambda minute: time.strftime('%b %d %H:%M', time.localtime(minute * 60)))
 
 class DetailedFormatter(FileSystemFormatter):
-    """Formatter that provides detailed information about items"""
-    def format(self, items: List[FileSystemItem]) -> List[str]:
-        return [
-            f"{item.permissions} {item.size:>4} "
-            f"{datetime.fromtimestamp(item.time_modified).strftime('%b %d %H:%M')} {item.name}"
-            for item in items
-        ]
+    """Formatter that provides detailed information about items
+
+    Lines are built from the items' fields. The size column is right-aligned
+    to its widest entry like ls -l, and timestamps are converted once per
+    minute since the seconds are never shown.
+    """
+    MIN_SIZE_WIDTH = 4
+
+    def iter_format(self, items: Iterable[FileSystemItem]) -> Iterator[str]:
+        return self.iter_columns(items, str)
+
+    def iter_columns(self, items: Iterable[FileSystemItem], size_text: Callable[[int], str]) -> Iterator[str]:
+        """
+        Format items with the size column rendered by size_text
+
+        The size column is as wide as its widest entry, so every size is read
+        before the first line is produced. Sequences, such as the contents of
+        a directory, are read twice instead of being copied. Other iterables
+        are collected into a list of the items first, which is the only part of
+        a long listing held at once; the lines are still built one at a time
+        as they are consumed.
+
+        :param items: Filesystem items
+        :param size_text: Function converting a size to its column text
+        :return: Iterator over formatted lines
+        """
+        if not isinstance(items, Sequence):
+            items = list(items)
+        sizes = map(attrgetter('size'), items)
+        if size_text is str:
+            # Sizes are never negative, so the largest one has the longest text
+            widest = len(str(max(sizes, default=0)))
+        else:
+            widest = max(map(len, map(size_text, sizes)), default=0)
+        width = max(self.MIN_SIZE_WIDTH, widest)
+        minutes = map(floordiv, map(attrgetter('time_modified'), items), repeat(60))
+        return map(' '.join, zip(map(attrgetter('permissions'), items),
+                                 map(str.rjust, map(size_text, map(attrgetter('size'), items)), repeat(width)),
+                                 map(_MINUTE_TEXTS.__getitem__, minutes),
+                                 map(attrgetter('name'), items)))
+
+def _humanize(size: int) -> str:
+    units = [('G', 1_073_741_824), ('M', 1_048_576), ('K', 1_024)]
+    for unit, divisor in units:
+        if size >= divisor:
+            return f"{size/divisor:.1f}{unit}"
+    return str(size)
+
+_HUMANIZED_SIZES = _LookupTable(_humanize)
 
 class HumanReadableSizeFormatter(FileSystemFormatter):
     """Formatter that converts sizes to human-readable format"""
     def __init__(self, base_formatter: FileSystemFormatter):
         self.base_formatter = base_formatter
 
-    def _humanize_size(self, size: int) -> str:
+    @staticmethod
+    def humanize_size(size: int) -> str:
         """Convert size to human-readable format"""
-        units = [('G', 1_073_741_824), ('M', 1_048_576), ('K', 1_024)]
-        for unit, divisor in units:
-            if size >= divisor:
-                return f"{size/divisor:.1f}{unit}"
-        return str(size)
-
-    def format(self, items: List[FileSystemItem]) -> List[str]:
-        formatted_items = self.base_formatter.format(items)
-        
-        # If the base formatter is DetailedFormatter, modify size representation
+        return _HUMANIZED_SIZES[size]
+
+    def iter_format(self, items: Iterable[FileSystemItem]) -> Iterator[str]:
+        # If the base formatter is DetailedFormatter, render its size column humanized
         if isinstance(self.base_formatter, DetailedFormatter):
-            return [
-                line.replace(str(line.split()[1]), self._humanize_size(int(line.split()[1])))
-                for line in formatted_items
-            ]
+            return self.base_formatter.iter_columns(items, _HUMANIZED_SIZES.__getitem__)
         
-        return formatted_items
\ No newline at end of file
+        return self.base_formatter.iter_format(items)
@@ -0,0 +1,67 @@
+from hashlib import blake2b
+from typing import Union
+
+from .file_system import File, Directory
+
+DIGEST_SIZE = 16
+
+class SubtreeHasher:
+    """Computes Merkle digests of filesystem items
+
+    The digest of a file covers its name, size, time and permissions. The
+    digest of a directory also covers the names and digests of its contents,
+    taken in name order, so two directories have the same digest exactly
+    when their whole subtrees are equal, and listing order does not matter.
+    """
+    @staticmethod
+    def _fields(kind: bytes, item: Union[File, Directory]) -> bytes:
+        return b'\0'.join((kind, item.name.encode('utf-8'), str(item.size).encode(),
+                           str(item.time_modified).encode(), item.permissions.encode('utf-8')))
+
+    @staticmethod
+    def file_digest(item: File) -> bytes:
+        """
+        Compute the digest of a file
+
+        :param item: The file
+        :return: Digest bytes
+        """
+        return blake2b(SubtreeHasher._fields(b'f', item), digest_size=DIGEST_SIZE).digest()
+
+    @staticmethod
+    def digest(item: Union[File, Directory]) -> bytes:
+        """
+        Return the digest of an item, computing directory digests if needed
+
+        :param item: File or Directory
+        :return: Digest bytes
+        """
+        if not item.is_directory():
+            return SubtreeHasher.file_digest(item)
+        if item.digest is None:
+            SubtreeHasher.compute(item)
+        return item.digest
+
+    @staticmethod
+    def compute(root: Union[File, Directory]):
+        """
+        Set digest on every directory below root
+
+        The tree is traversed once, bottom-up, with an explicit stack.
+
+        :param root: Root directory or file
+        """
+        if not root.is_directory():
+            return
+        stack = [(root, False)]
+        while stack:
+            directory, children_done = stack.pop()
+            if not children_done:
+                stack.append((directory, True))
+                stack.extend((item, False) for item in directory.contents if item.is_directory())
+                continue
+            hasher = blake2b(SubtreeHasher._fields(b'd', directory), digest_size=DIGEST_SIZE)
+            for item in sorted(directory.contents, key=lambda item: item.name):
+                hasher.update(b'\0' + item.name.encode('utf-8') + b'\0')
+                hasher.update(item.digest if item.is_directory() else SubtreeHasher.file_digest(item))
+            directory.digest = hasher.digest()
@@ -0,0 +1,81 @@
+from typing import Dict, List, Optional, Union
+from .file_system import File, Directory
+
+class PathIndex:
+    """Maps every path in a filesystem tree to its item"""
+    def __init__(self, root: Union[File, Directory]):
+        """
+        Build the index with a single traversal of the tree
+
+        :param root: Root directory or file
+        """
+        self.root = root
+        self._items: Dict[str, Union[File, Directory]] = {'': root}
+        self._add_below('', root)
+
+    def _add_below(self, prefix: str, item: Union[File, Directory]):
+        """Index everything below the item at prefix"""
+        stack = [(prefix, item)]
+        while stack:
+            prefix, directory = stack.pop()
+            if not directory.is_directory():
+                continue
+            seen = set()
+            for item in directory.contents:
+                # Shadowed duplicates are unreachable through navigation too
+                if item.name in seen:
+                    continue
+                seen.add(item.name)
+                path = f"{prefix}/{item.name}" if prefix else item.name
+                self._items[path] = item
+                stack.append((path, item))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, components: List[str]) -> Optional[Union[File, Directory]]:
+        """
+        Look up an item by its path components
+
+        :param components: Path components relative to the root
+        :return: The item, or None if the path does not exist
+        """
+        return self._items.get('/'.join(components))
+
+    def add(self, components: List[str], item: Union[File, Directory]):
+        """
+        Index an item that was added to the tree, with its whole subtree
+
+        :param components: Path components of the item
+        :param item: The item
+        """
+        path = '/'.join(components)
+        if path in self._items:
+            # Shadowed by an item with the same name
+            return
+        self._items[path] = item
+        self._add_below(path, item)
+
+    def remove(self, components: List[str], parent: Directory):
+        """
+        Drop an item that was removed from the tree, with its whole subtree
+
+        :param components: Path components of the item
+        :param parent: Directory the item was removed from
+        """
+        path = '/'.join(components)
+        item = self._items.pop(path, None)
+        if item is not None and item.is_directory():
+            stack = [(path, item)]
+            while stack:
+                prefix, directory = stack.pop()
+                for child in directory.contents:
+                    child_path = f"{prefix}/{child.name}"
+                    if self._items.get(child_path) is child:
+                        del self._items[child_path]
+                        if child.is_directory():
+                            stack.append((child_path, child))
+        # An item with the same name that was shadowed becomes reachable
+        replacement = parent.get_child(components[-1])
+        if replacement is not None:
+            self.add(components, replacement)
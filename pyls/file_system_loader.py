@@ -1,8 +1,24 @@
 from pathlib import Path
 import json
-from typing import Union, Dict, Any
+import os
+from typing import Union, Dict, Any, List, Optional
 from .file_system import File, Directory
+from .file_system_compression import CompressedInput
 from .file_system_error import FileSystemError
+from .file_system_flat import FlatSnapshot
+from .file_system_navigator import FileSystemNavigator
+from .file_system_scanner import JsonStreamScanner
+from .file_system_snapshot import CompiledSnapshot
+from .file_system_store import ColumnarStore, FileView, DirectoryView
+
+_ITEM_FIELDS = ('name', 'size', 'time_modified', 'permissions')
+# Runs of items up to this encoded size are decoded in one piece instead of field by field
+_BATCH_BYTES = 1 << 20
+
+class _ScanState:
+    """Shared state of one path-directed scan"""
+    def __init__(self):
+        self.stopped = False
 
 class FileSystemLoader:
     """Responsible for loading filesystem from JSON"""
@@ -10,29 +26,242 @@ class FileSystemLoader:
     def load_from_json(json_path: Path) -> Union[File, Directory]:
         """
         Load filesystem structure from a JSON file
+
+        Flat NDJSON snapshots are loaded with FlatSnapshot, and shard stores
+        are paged in as they are accessed. Compressed files are decompressed
+        while they are parsed.
         
         :param json_path: Path to the JSON file
         :return: Root Directory or File
         """
+        if os.path.isdir(json_path):
+            return FileSystemLoader.load_shards(json_path)
+        if FlatSnapshot.is_flat(json_path):
+            return FlatSnapshot.load(json_path)
         try:
-            with open(json_path, 'r') as f:
+            with CompressedInput.open(json_path) as f:
                 data = json.load(f)
             return FileSystemLoader._convert_to_filesystem(data)
         except FileNotFoundError:
             raise FileSystemError(f"Cannot access '{json_path}': No such file or directory")
-        except json.JSONDecodeError:
+        except OSError as e:
+            raise FileSystemError(f"Cannot read '{json_path}': {e.strerror or e}")
+        except (json.JSONDecodeError, UnicodeDecodeError):
             raise FileSystemError("Invalid JSON file")
 
     @staticmethod
-    def _convert_to_filesystem(item_dict: Dict[str, Any]) -> Union[File, Directory]:
+    def load_columnar_from_json(json_path: Path) -> Union[FileView, DirectoryView]:
+        """
+        Load filesystem structure from a JSON file into a columnar store
+
+        :param json_path: Path to the JSON file
+        :return: View of the root Directory or File
+        """
+        return ColumnarStore.from_json(json_path).root()
+
+    @staticmethod
+    def load_store(snapshot_path: Path) -> ColumnarStore:
+        """
+        Load a whole snapshot of any format into a columnar store
+
+        Plain JSON snapshots are decoded straight into the store, anything
+        else is loaded as a tree first.
+
+        :param snapshot_path: Path to a snapshot
+        :return: Populated store
+        """
+        if (os.path.isfile(snapshot_path) and not CompiledSnapshot.is_compiled(snapshot_path)
+                and not FlatSnapshot.is_flat(snapshot_path) and CompressedInput.compression(snapshot_path) is None):
+            return ColumnarStore.from_json(snapshot_path)
+        return ColumnarStore.from_tree(FileSystemLoader.load_snapshot(snapshot_path, depth=None))
+
+    @staticmethod
+    def load_snapshot(snapshot_path: Path, path: Optional[str] = None,
+                      depth: Optional[int] = 1, lazy: bool = False) -> Union[File, Directory]:
+        """
+        Load the part of a snapshot needed to list a path
+
+        Compiled snapshots are read through a memory mapping and flat NDJSON
+        snapshots are loaded whole, since any line may update any entry.
+        Shard stores are paged in as they are accessed. Anything else is
+        scanned as JSON.
+
+        With lazy, the subtree below path is instead built as it is accessed
+        where the format allows it: compiled snapshots then stay mapped while
+        the tree is in use. JSON and NDJSON snapshots are still loaded down to
+        depth.
+
+        :param snapshot_path: Path to a compiled snapshot or JSON file
+        :param path: Path to load, relative to the root
+        :param depth: Number of levels to load below path, all if None
+        :param lazy: Whether to build the subtree below path on access
+        :return: Root Directory or File
+        """
+        if CompiledSnapshot.is_compiled(snapshot_path):
+            if lazy:
+                # The directories built on access keep the snapshot mapped
+                return CompiledSnapshot(snapshot_path).load_path(FileSystemNavigator.split_path(path), lazy=True)
+            with CompiledSnapshot(snapshot_path) as snapshot:
+                return snapshot.load_path(FileSystemNavigator.split_path(path), depth)
+        if os.path.isdir(snapshot_path):
+            return FileSystemLoader.load_shards(snapshot_path)
+        if FlatSnapshot.is_flat(snapshot_path):
+            return FlatSnapshot.load(snapshot_path)
+        return FileSystemLoader.load_path_from_json(snapshot_path, path, depth)
+
+    @staticmethod
+    def load_shards(store_dir: Path) -> Union[File, Directory]:
+        """
+        Open a shard store, with the memory budget from PYLS_SHARD_MEMORY
+
+        :param store_dir: Directory written by ShardedStore.write
+        :return: Root Directory or File, with nothing loaded yet
+        """
+        from .file_system_shards import ShardedStore, DEFAULT_MEMORY_BUDGET
+        return ShardedStore(store_dir, int(os.environ.get('PYLS_SHARD_MEMORY', DEFAULT_MEMORY_BUDGET))).root()
+
+    @staticmethod
+    def load_path_from_json(json_path: Path, path: Optional[str] = None,
+                            depth: Optional[int] = 1) -> Union[File, Directory]:
+        """
+        Load only the part of the filesystem needed to list a path
+
+        The JSON file is scanned incrementally. Directories on the way to path
+        only contain the next directory on the path, the item at path gets its
+        contents down to depth levels (all levels if None), and every other
+        subtree is skipped without being decoded. Directories below depth are
+        returned with empty contents. If path does not exist, the returned tree
+        stops at its deepest existing ancestor. Compressed files are
+        decompressed as they are scanned, so memory use stays proportional to
+        the returned tree.
+
+        :param json_path: Path to the JSON file
+        :param path: Path to load, relative to the root
+        :param depth: Number of levels to load below path
+        :return: Root Directory or File
+        """
+        components = FileSystemNavigator.split_path(path)
+        try:
+            with CompressedInput.open(json_path) as f:
+                scanner = JsonStreamScanner(f)
+                return FileSystemLoader._scan_item(scanner, components, depth, None, True, _ScanState())
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{json_path}': No such file or directory")
+        except OSError as e:
+            raise FileSystemError(f"Cannot read '{json_path}': {e.strerror or e}")
+        except UnicodeDecodeError:
+            raise FileSystemError("Invalid JSON file")
+
+    @staticmethod
+    def _scan_item(scanner: JsonStreamScanner, components: List[str], depth: Optional[int],
+                   wanted: Optional[str], can_stop: bool, state: _ScanState) -> Optional[Union[File, Directory]]:
+        """
+        Scan one item object, materializing only what is needed for components
+
+        :param scanner: Scanner positioned at the item object
+        :param components: Remaining path components below this item
+        :param depth: Number of levels to load below the end of the path
+        :param wanted: Name the item must have to be kept, None if it is on the path
+        :param can_stop: Whether every ancestor has already read all of its fields
+        :param state: Shared scan state
+        :return: The item, or None if its name is not wanted
+        """
+        fields: Dict[str, Any] = {}
+        contents = None
+        for key in scanner.iter_object():
+            if key != 'contents':
+                fields[key] = scanner.read_value()
+                continue
+            name = fields.get('name')
+            if wanted is not None and name is None:
+                # Name not seen yet, so the item might still be on the path
+                contents = FileSystemLoader._prune(scanner.read_value(), components, depth)
+            elif wanted is not None and name != wanted:
+                scanner.skip_value()
+                contents = []
+            elif components:
+                contents = []
+                complete = can_stop and all(field in fields for field in _ITEM_FIELDS)
+                for _ in scanner.iter_array():
+                    if contents:
+                        scanner.skip_value()
+                        continue
+                    child = FileSystemLoader._scan_item(scanner, components[1:], depth,
+                                                        components[0], complete, state)
+                    if child is not None:
+                        contents.append(child)
+                    if state.stopped:
+                        break
+            elif depth is None:
+                contents = [FileSystemLoader._convert_to_filesystem(content) for content in scanner.read_value()]
+            elif depth > 0:
+                contents = []
+                for batch in scanner.iter_array_batches(_BATCH_BYTES):
+                    if batch is None:
+                        contents.append(FileSystemLoader._scan_item(scanner, [], depth - 1, None, False, state))
+                    else:
+                        contents.extend(FileSystemLoader._convert_to_filesystem(content, depth - 1)
+                                        for content in batch)
+            else:
+                scanner.skip_value()
+                contents = []
+            if state.stopped:
+                break
+
+        if wanted is not None and fields.get('name') != wanted:
+            return None
+        if any(field not in fields for field in _ITEM_FIELDS):
+            raise FileSystemError("Invalid JSON file")
+        if contents is not None:
+            item = Directory(contents=contents, **{field: fields[field] for field in _ITEM_FIELDS})
+        else:
+            item = File(**{field: fields[field] for field in _ITEM_FIELDS})
+        if not components and can_stop and wanted is not None:
+            state.stopped = True
+        return item
+
+    @staticmethod
+    def _prune(contents: List[Dict[str, Any]], components: List[str],
+               depth: Optional[int]) -> List[Union[File, Directory]]:
+        """
+        Convert decoded contents, keeping only what is needed for components
+
+        :param contents: Decoded contents of a directory
+        :param components: Remaining path components
+        :param depth: Number of levels to load below the end of the path
+        :return: Materialized contents
+        """
+        if not components:
+            if depth is None:
+                return [FileSystemLoader._convert_to_filesystem(content) for content in contents]
+            if depth == 0:
+                return []
+            return [FileSystemLoader._convert_to_filesystem(content, depth - 1) for content in contents]
+        for content in contents:
+            if content.get('name') == components[0]:
+                item = FileSystemLoader._convert_to_filesystem(content, 0)
+                if item.is_directory():
+                    item.contents = FileSystemLoader._prune(content['contents'], components[1:], depth)
+                return [item]
+        return []
+
+    @staticmethod
+    def _convert_to_filesystem(item_dict: Dict[str, Any], depth: Optional[int] = None) -> Union[File, Directory]:
         """
         Recursively convert dictionary to File or Directory
         
         :param item_dict: Dictionary representation of filesystem item
+        :param depth: Number of levels of contents to convert, all if None
         :return: File or Directory instance
         """
         if 'contents' in item_dict:
-            contents = [FileSystemLoader._convert_to_filesystem(content) for content in item_dict['contents']]
+            if depth is None:
+                contents = [FileSystemLoader._convert_to_filesystem(content) for content in item_dict['contents']]
+            elif depth > 0:
+                contents = [FileSystemLoader._convert_to_filesystem(content, depth - 1)
+                            for content in item_dict['contents']]
+            else:
+                contents = []
             return Directory(
                 name=item_dict['name'],
                 size=item_dict['size'],
@@ -0,0 +1,85 @@
+import stat
+from typing import Dict, List, Optional, Tuple
+
+from .file_system_error import FileSystemError
+
+# Permission strings of regular files and directories without special bits,
+# indexed by the nine permission bits, plus 0o1000 for directories
+PERMISSION_STRINGS: List[str] = [stat.filemode((stat.S_IFDIR if index & 0o1000 else stat.S_IFREG) | index & 0o777)
+                                 for index in range(1024)]
+# The table both ways, keyed by string and by mode
+MODES: Dict[str, int] = {permissions: (stat.S_IFDIR if index & 0o1000 else stat.S_IFREG) | index & 0o777
+                         for index, permissions in enumerate(PERMISSION_STRINGS)}
+MODE_STRINGS: Dict[int, str] = {mode: permissions for permissions, mode in MODES.items()}
+_TYPES = {'-': stat.S_IFREG, 'd': stat.S_IFDIR, 'l': stat.S_IFLNK, 'c': stat.S_IFCHR, 'b': stat.S_IFBLK,
+          'p': stat.S_IFIFO, 's': stat.S_IFSOCK, '?': 0}
+# Bits of each permission character, and for the execute positions the special
+# bit that 's'/'S' or 't'/'T' add
+_BITS = (stat.S_IRUSR, stat.S_IWUSR, stat.S_IXUSR, stat.S_IRGRP, stat.S_IWGRP, stat.S_IXGRP,
+         stat.S_IROTH, stat.S_IWOTH, stat.S_IXOTH)
+_SPECIAL = {2: (stat.S_ISUID, 's'), 5: (stat.S_ISGID, 's'), 8: (stat.S_ISVTX, 't')}
+# Characters ls -l appends for an ACL ('+'), an SELinux context ('.') or extended attributes ('@')
+MARKERS = '+.@'
+
+class PermissionMode:
+    """Converts between permission strings such as 'drwxr-xr-x' and st_mode integers
+
+    Strings of regular files and directories without setuid, setgid or sticky
+    bits, which are nearly all of them, are looked up in a table of the 1024
+    possible strings both ways, and the strings returned are shared. Anything
+    else is parsed character by character and formatted by stat.filemode.
+    A trailing ACL, SELinux or extended attribute marker is accepted but not
+    part of the mode, so items keep such strings as they were given.
+    """
+    @staticmethod
+    def parse(permissions: str) -> int:
+        """
+        Convert a permission string to a mode
+
+        :param permissions: String in the format of ls -l, such as '-rw-r--r--'
+                            or '-rw-r--r--+'
+        :return: Mode with the file type and permission bits of st_mode
+        """
+        mode = MODES.get(permissions)
+        if mode is not None:
+            return mode
+        if (not isinstance(permissions, str) or len(permissions) not in (10, 11) or permissions[0] not in _TYPES
+                or permissions[10:] not in ('',) + tuple(MARKERS)):
+            raise FileSystemError(f"Invalid permissions '{permissions}'")
+        mode = _TYPES[permissions[0]]
+        for position, char in enumerate(permissions[1:10]):
+            expected = 'rwx'[position % 3]
+            special, special_char = _SPECIAL.get(position, (0, None))
+            if char == expected:
+                mode |= _BITS[position]
+            elif special and char == special_char:
+                mode |= _BITS[position] | special
+            elif special and char == special_char.upper():
+                mode |= special
+            elif char != '-':
+                raise FileSystemError(f"Invalid permissions '{permissions}'")
+        return mode
+
+    @staticmethod
+    def parse_keeping(permissions: str) -> Tuple[int, Optional[str]]:
+        """
+        Convert a permission string to a mode, keeping strings the mode does not reproduce
+
+        :param permissions: String in the format of ls -l
+        :return: The mode, and permissions if format would return something else, or else None
+        """
+        mode = MODES.get(permissions)
+        if mode is not None:
+            return mode, None
+        mode = PermissionMode.parse(permissions)
+        return mode, (permissions if PermissionMode.format(mode) != permissions else None)
+
+    @staticmethod
+    def format(mode: int) -> str:
+        """
+        Convert a mode to its permission string
+
+        :param mode: Mode as returned by parse
+        :return: String in the format of ls -l
+        """
+        return MODE_STRINGS.get(mode) or stat.filemode(mode)
@@ -0,0 +1,192 @@
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from .file_system import File, Directory, LazyDirectory
+from .file_system_error import FileSystemError
+from .file_system_loader import FileSystemLoader
+from .file_system_navigator import FileSystemNavigator
+
+MOUNT_PERMISSIONS = 'drwxr-xr-x'
+# Largest number of threads loading shards at once
+MAX_LOAD_THREADS = 8
+
+class Mount:
+    """A snapshot presented at a path of the combined tree"""
+    __slots__ = ('components', 'snapshot_path')
+
+    def __init__(self, prefix: str, snapshot_path: Path):
+        """
+        :param prefix: Path the snapshot's root appears at
+        :param snapshot_path: Snapshot in any supported format
+        """
+        self.components = FileSystemNavigator.split_path(prefix)
+        self.snapshot_path = Path(snapshot_path)
+        if not self.components:
+            raise FileSystemError(f"Invalid mount '{prefix}': the prefix must not be empty")
+
+class MountTable:
+    """Presents several snapshots, each below its own prefix, as one tree
+
+    The directories above the prefixes are synthetic. The directory at each
+    prefix is a LazyDirectory that loads its snapshot the first time it is
+    touched, so a query below one prefix never loads the other snapshots.
+    Prefixes may not be nested.
+    """
+    def __init__(self, mounts: List[Mount]):
+        self.mounts = sorted(mounts, key=lambda mount: mount.components)
+        for mount, following in zip(self.mounts, self.mounts[1:]):
+            if following.components[:len(mount.components)] == mount.components:
+                raise FileSystemError(f"Invalid mount '{'/'.join(following.components)}': "
+                                      f"it is inside '{'/'.join(mount.components)}'")
+
+    @staticmethod
+    def parse_spec(spec: str, base: Optional[Path] = None) -> Mount:
+        """
+        Parse a PREFIX=FILE mount
+
+        :param spec: The mount specification
+        :param base: Directory that relative snapshot paths are relative to
+        :return: The mount
+        """
+        prefix, equals, snapshot = spec.partition('=')
+        if not equals or not snapshot.strip():
+            raise FileSystemError(f"Invalid mount '{spec}': expected PREFIX=FILE")
+        snapshot_path = Path(snapshot.strip())
+        if base is not None and not snapshot_path.is_absolute():
+            snapshot_path = base / snapshot_path
+        return Mount(prefix.strip(), snapshot_path)
+
+    @staticmethod
+    def from_file(table_path: Path) -> List[Mount]:
+        """
+        Read the mounts of a mount table file
+
+        Every line holds one PREFIX=FILE mount, where FILE is relative to the
+        table's directory. Blank lines and lines starting with '#' are ignored.
+
+        :param table_path: Path of the mount table
+        :return: Mounts in file order
+        """
+        try:
+            with open(table_path, 'r') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{table_path}': No such file or directory")
+        return [MountTable.parse_spec(line, Path(table_path).parent) for line in lines
+                if line.strip() and not line.lstrip().startswith('#')]
+
+    @staticmethod
+    def _mtime(snapshot_path: Path) -> int:
+        try:
+            return int(os.stat(snapshot_path).st_mtime)
+        except OSError:
+            return 0
+
+    def _loader(self, mount: Mount, components: Optional[List[str]] = None, depth: Optional[int] = None,
+                lazy: bool = False):
+        def load() -> Union[File, Directory]:
+            return FileSystemLoader.load_snapshot(mount.snapshot_path, '/'.join(components or []), depth, lazy)
+        return load
+
+    def build(self, partial: Optional[Tuple[Mount, List[str], Optional[int]]] = None,
+              lazy: bool = False) -> Directory:
+        """
+        Build the combined tree with every snapshot still unloaded
+
+        :param partial: A mount whose snapshot is only loaded as far as needed
+                        to list a path in it, with that path and the depth
+        :param lazy: Whether snapshots are loaded with lazy=True, as far as their format allows
+        :return: Synthetic root directory
+        """
+        root = Directory(name='.', size=0, time_modified=0, permissions=MOUNT_PERMISSIONS, contents=[])
+        for mount in self.mounts:
+            parent = root
+            mtime = self._mtime(mount.snapshot_path)
+            root.time_modified = max(root.time_modified, mtime)
+            for component in mount.components[:-1]:
+                child = parent.get_child(component)
+                if child is None:
+                    child = Directory(name=component, size=0, time_modified=0,
+                                      permissions=MOUNT_PERMISSIONS, contents=[])
+                    parent.add_child(child)
+                child.time_modified = max(child.time_modified, mtime)
+                parent = child
+            loader = (self._loader(*partial, lazy) if partial and partial[0] is mount
+                      else self._loader(mount, lazy=lazy))
+            parent.add_child(LazyDirectory(mount.components[-1], 0, mtime, MOUNT_PERMISSIONS, loader))
+        return root
+
+    def _mount_points(self, root: Directory, components: List[str]) -> List[LazyDirectory]:
+        """Return the unloaded mount points at or below a path of the combined tree"""
+        points = []
+        for mount in self.mounts:
+            if mount.components[:len(components)] != components:
+                continue
+            item = root
+            for component in mount.components:
+                item = item.get_child(component) if item.is_directory() else None
+                if item is None:
+                    break
+            if isinstance(item, LazyDirectory) and not item.is_loaded:
+                points.append(item)
+        return points
+
+    def preload(self, root: Directory, path: Optional[str] = None):
+        """
+        Load every snapshot mounted at or below a path, concurrently
+
+        :param root: Root built by this table
+        :param path: Path of the combined tree
+        """
+        points = self._mount_points(root, FileSystemNavigator.split_path(path))
+        if len(points) <= 1:
+            for point in points:
+                point.load()
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(min(len(points), MAX_LOAD_THREADS)) as executor:
+            # Consume the results so that loading errors are raised here
+            list(executor.map(LazyDirectory.load, points))
+
+    def resolve(self, components: List[str]) -> Optional[Tuple[Mount, List[str]]]:
+        """
+        Find the mount holding a path
+
+        :param components: Path components of the combined tree
+        :return: The mount and the path components inside its snapshot, or
+                 None if the path is not inside any mount
+        """
+        for mount in self.mounts:
+            if components[:len(mount.components)] == mount.components:
+                return mount, components[len(mount.components):]
+        return None
+
+    def load_snapshot(self, path: Optional[str] = None, depth: Optional[int] = 1,
+                      lazy: bool = False) -> Directory:
+        """
+        Load the part of the combined tree needed to list a path
+
+        A path inside a mount is loaded from that snapshot alone, as
+        FileSystemLoader.load_snapshot would. Above the mounts, the snapshots
+        below the path are loaded concurrently when all levels are needed, and
+        stay unloaded otherwise. With lazy, every snapshot is only loaded when
+        its mount point is first accessed, as lazily as its format allows.
+
+        :param path: Path to load, relative to the combined root
+        :param depth: Number of levels to load below path, all if None
+        :param lazy: Whether to load the snapshots below path on access
+        :return: Root of the combined tree
+        """
+        components = FileSystemNavigator.split_path(path)
+        resolved = self.resolve(components)
+        if resolved is None:
+            root = self.build(lazy=lazy)
+            if depth is None and not lazy:
+                self.preload(root, path)
+            return root
+
+        mount, inner = resolved
+        root = self.build((mount, inner, depth), lazy)
+        self.preload(root, '/'.join(mount.components))
+        return root
@@ -0,0 +1,233 @@
+import json
+import os
+import sys
+from bisect import bisect_left, bisect_right
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .file_system import File, Directory
+from .file_system_error import FileSystemError
+
+_WILDCARDS = '*?['
+
+class NameIndex:
+    """Index of every entry of a snapshot by name
+
+    Entries are numbered in the order find would visit them. Names are kept in
+    a sorted array, so an exact name or a prefix is found with two binary
+    searches, and entries are also bucketed by extension so patterns such as
+    '*.go' only look at the matching bucket. Other globs scan the sorted names,
+    starting from their literal prefix when they have one.
+
+    The index can be saved next to its snapshot and is only reused while the
+    snapshot's size and modification time are unchanged.
+    """
+    VERSION = 1
+    SUFFIX = '.names'
+
+    def __init__(self, paths: List[str], directory_flags: bytearray,
+                 order: Optional[List[int]] = None,
+                 extensions: Optional[Dict[str, List[int]]] = None):
+        """
+        :param paths: Path of every entry relative to the root
+        :param directory_flags: 1 for every entry that is a directory
+        :param order: Entries sorted by name, computed if None
+        :param extensions: Entries by extension, computed if None
+        """
+        self.paths = paths
+        self.directory_flags = directory_flags
+        names = [path.rpartition('/')[2] for path in paths]
+        if order is None:
+            order = sorted(range(len(names)), key=names.__getitem__)
+        self._order = order
+        self._sorted_names = [names[entry] for entry in order]
+        if extensions is None:
+            extensions = {}
+            for entry, name in enumerate(names):
+                _, dot, extension = name.rpartition('.')
+                if dot:
+                    extensions.setdefault(extension, []).append(entry)
+        self._extensions = extensions
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @staticmethod
+    def build(root: Union[File, Directory]) -> 'NameIndex':
+        """
+        Build the index with a single traversal of the tree
+
+        :param root: Root directory or file
+        :return: Index of every entry below root
+        """
+        paths: List[str] = []
+        directory_flags = bytearray()
+        stack: List[Tuple[str, Union[File, Directory]]] = [('', root)]
+        while stack:
+            prefix, directory = stack.pop()
+            if not directory.is_directory():
+                continue
+            seen = set()
+            children = []
+            for item in directory.contents:
+                # Shadowed duplicates are unreachable through navigation too
+                if item.name in seen:
+                    continue
+                seen.add(item.name)
+                path = f"{prefix}/{item.name}" if prefix else item.name
+                paths.append(path)
+                directory_flags.append(item.is_directory())
+                children.append((path, item))
+            stack.extend(reversed(children))
+        return NameIndex(paths, directory_flags)
+
+    @staticmethod
+    def default_path(snapshot_path: Path) -> Path:
+        """Return the path of the index saved for a snapshot"""
+        return snapshot_path.with_name(snapshot_path.name + NameIndex.SUFFIX)
+
+    @staticmethod
+    def _identity(snapshot_path: Path) -> List[int]:
+        stat = os.stat(snapshot_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def save(self, index_path: Path, snapshot_path: Path):
+        """
+        Write the index for reuse while snapshot_path is unchanged
+
+        :param index_path: Path of the index file
+        :param snapshot_path: Snapshot the index was built from
+        """
+        data = {
+            "version": self.VERSION,
+            "source": self._identity(snapshot_path),
+            "paths": self.paths,
+            "directories": list(self.directory_flags),
+            "order": self._order,
+            "extensions": self._extensions,
+        }
+        temp_path = f"{index_path}.tmp{os.getpid()}"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temp_path, index_path)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise FileSystemError(f"Cannot write '{index_path}': {e.strerror}")
+
+    @staticmethod
+    def load(index_path: Path, snapshot_path: Path) -> Optional['NameIndex']:
+        """
+        Read a saved index if it is current
+
+        :param index_path: Path of the index file
+        :param snapshot_path: Snapshot the index must have been built from
+        :return: The index, or None if it is missing, invalid or stale
+        """
+        try:
+            with open(index_path, 'r') as f:
+                data = json.load(f)
+            if data["version"] != NameIndex.VERSION or data["source"] != NameIndex._identity(snapshot_path):
+                return None
+            return NameIndex(data["paths"], bytearray(data["directories"]), data["order"], data["extensions"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _name_range(self, prefix: str) -> Tuple[int, int]:
+        """Return the range of sorted names starting with prefix"""
+        if not prefix:
+            return 0, len(self._sorted_names)
+        low = bisect_left(self._sorted_names, prefix)
+        if prefix[-1] == chr(sys.maxunicode):
+            # No character sorts after the last one, so only a shorter prefix bounds the range
+            return low, self._name_range(prefix[:-1])[1]
+        high = bisect_left(self._sorted_names, prefix[:-1] + chr(ord(prefix[-1]) + 1), low)
+        return low, high
+
+    def match_name(self, name: str) -> List[int]:
+        """
+        Find the entries with exactly the given name
+
+        :param name: Entry name
+        :return: Matching entries in no particular order
+        """
+        low = bisect_left(self._sorted_names, name)
+        return self._order[low:bisect_right(self._sorted_names, name, low)]
+
+    def match_prefix(self, prefix: str) -> List[int]:
+        """
+        Find the entries whose name starts with prefix
+
+        :param prefix: Literal name prefix
+        :return: Matching entries in no particular order
+        """
+        low, high = self._name_range(prefix)
+        return self._order[low:high]
+
+    def match_glob(self, pattern: str) -> List[int]:
+        """
+        Find the entries whose name matches a glob
+
+        :param pattern: Case-sensitive fnmatch pattern
+        :return: Matching entries in no particular order
+        """
+        first_wildcard = min((pattern.index(char) for char in _WILDCARDS if char in pattern),
+                             default=len(pattern))
+        literal_prefix = pattern[:first_wildcard]
+        if first_wildcard == len(pattern):
+            return self.match_name(pattern)
+
+        if not literal_prefix and '[' not in pattern:
+            # The literal text after the last wildcard ends every matching name
+            suffix = pattern[max(pattern.rfind('*'), pattern.rfind('?')) + 1:]
+            if '.' in suffix:
+                extension = suffix.rpartition('.')[2]
+                paths = self.paths
+                return [entry for entry in self._extensions.get(extension, [])
+                        if fnmatchcase(paths[entry].rpartition('/')[2], pattern)]
+
+        low, high = self._name_range(literal_prefix)
+        names = self._sorted_names
+        return [self._order[position] for position in range(low, high)
+                if fnmatchcase(names[position], pattern)]
+
+    def find(self, pattern: str, prefix: bool = False, under: Optional[List[str]] = None,
+             item_type: Optional[str] = None) -> Iterator[str]:
+        """
+        Generate the paths of matching entries in traversal order
+
+        :param pattern: Glob, or literal prefix if prefix is True
+        :param prefix: Whether pattern is a name prefix
+        :param under: Path components of the directory to search, the root if None;
+            a file is tested itself
+        :param item_type: 'file' or 'dir' to only return that type
+        :return: Iterator over paths relative to the root
+        """
+        entries = self.match_prefix(pattern) if prefix else self.match_glob(pattern)
+        under_path = '/'.join(under) if under else ''
+        base = under_path + '/' if under else ''
+        paths, directory_flags = self.paths, self.directory_flags
+        for entry in sorted(entries):
+            path = paths[entry]
+            if base and not path.startswith(base) and (path != under_path or directory_flags[entry]):
+                continue
+            if item_type is not None and directory_flags[entry] != (item_type == 'dir'):
+                continue
+            yield path
+
+    def is_directory(self, components: List[str]) -> Optional[bool]:
+        """
+        Look up whether a path is a directory through the name array
+
+        :param components: Path components relative to the root
+        :return: True or False, or None if the path does not exist
+        """
+        if not components:
+            return True
+        path = '/'.join(components)
+        for entry in self.match_name(components[-1]):
+            if self.paths[entry] == path:
+                return bool(self.directory_flags[entry])
+        return None
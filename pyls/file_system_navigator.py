@@ -1,37 +1,44 @@
-from typing import Union, Optional
+from typing import List, Union, Optional
 from .file_system import File, Directory
 from .file_system_error import FileSystemError
+from .file_system_index import PathIndex
 
 class FileSystemNavigator:
     """Responsible for navigating the filesystem"""
     @staticmethod
-    def navigate(root: Union[File, Directory], path: Optional[str] = None) -> Union[File, Directory]:
+    def navigate(root: Union[File, Directory], path: Optional[str] = None,
+                 index: Optional[PathIndex] = None) -> Union[File, Directory]:
         """
         Navigate to a specific path in the filesystem
         
         :param root: Root directory or file
         :param path: Path to navigate to
+        :param index: Optional path index built for root
         :return: File or Directory at the specified path
         """
-        if not path or path in ['.', './']:
-            return root
-        
-        # Remove leading ./ if present
-        path = path.lstrip('./')
-        
-        # If it's a directory
-        if isinstance(root, Directory):
-            for item in root.contents:
-                if item.name == path:
-                    return item
-            
-            # If path represents a nested directory or file
-            if '/' in path:
-                current_path = path.split('/')[0]
-                remaining_path = '/'.join(path.split('/')[1:])
-                
-                for item in root.contents:
-                    if item.name == current_path and item.is_directory():
-                        return FileSystemNavigator.navigate(item, remaining_path)
-        
-        raise FileSystemError(f"Cannot access '{path}': No such file or directory")
\ No newline at end of file
+        components = FileSystemNavigator.split_path(path)
+        if index is not None and index.root is root:
+            item = index.get(components)
+            if item is None:
+                raise FileSystemError(f"Cannot access '{path}': No such file or directory")
+            return item
+
+        item = root
+        for component in components:
+            child = item.get_child(component) if item.is_directory() else None
+            if child is None:
+                raise FileSystemError(f"Cannot access '{path}': No such file or directory")
+            item = child
+        return item
+
+    @staticmethod
+    def split_path(path: Optional[str]) -> List[str]:
+        """
+        Split a path into its components, dropping empty and '.' components
+
+        :param path: Path relative to the root
+        :return: List of names
+        """
+        if not path:
+            return []
+        return [part for part in path.split('/') if part and part != '.']
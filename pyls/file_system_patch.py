@@ -0,0 +1,245 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .file_system import File, Directory
+from .file_system_error import FileSystemError
+from .file_system_index import PathIndex
+from .file_system_navigator import FileSystemNavigator
+
+OPERATIONS = ('add', 'remove', 'modify', 'move')
+_FIELDS = ('size', 'time_modified', 'permissions')
+
+class PatchOperation:
+    """One change of a patch, keyed by the path it applies to"""
+    __slots__ = ('op', 'components', 'target', 'fields', 'is_directory', 'line')
+
+    def __init__(self, op: str, path: str, target: Optional[str] = None,
+                 fields: Optional[Dict[str, Union[int, str]]] = None,
+                 is_directory: bool = False, line: int = 0):
+        """
+        :param op: One of add, remove, modify and move
+        :param path: Path of the item, relative to the root
+        :param target: New path of a moved item
+        :param fields: Fields of an added item, or the fields a modification changes
+        :param is_directory: Whether an added item is a directory
+        :param line: Line of the patch file, for error messages
+        """
+        self.op = op
+        self.components = FileSystemNavigator.split_path(path)
+        self.target = FileSystemNavigator.split_path(target) if target is not None else None
+        self.fields = fields or {}
+        self.is_directory = is_directory
+        self.line = line
+
+    @staticmethod
+    def from_dict(entry: dict, line: int = 0) -> 'PatchOperation':
+        """
+        Validate and convert a decoded patch line
+
+        :param entry: Decoded JSON object
+        :param line: Line of the patch file
+        :return: The operation
+        """
+        if not isinstance(entry, dict) or entry.get('op') not in OPERATIONS or not isinstance(entry.get('path'), str):
+            raise FileSystemError(f"Invalid patch at line {line}")
+        op = entry['op']
+        fields = {field: entry[field] for field in _FIELDS if field in entry}
+        for field, value in fields.items():
+            if isinstance(value, bool) or not isinstance(value, str if field == 'permissions' else int):
+                raise FileSystemError(f"Invalid patch at line {line}: bad {field}")
+        if op == 'add' and len(fields) != len(_FIELDS):
+            raise FileSystemError(f"Invalid patch at line {line}: add needs {', '.join(_FIELDS)}")
+        if op == 'modify' and not fields:
+            raise FileSystemError(f"Invalid patch at line {line}: modify needs one of {', '.join(_FIELDS)}")
+        if op == 'move' and not isinstance(entry.get('to'), str):
+            raise FileSystemError(f"Invalid patch at line {line}: move needs 'to'")
+        return PatchOperation(op, entry['path'], entry.get('to'), fields, entry.get('type') == 'dir', line)
+
+class FileSystemPatch:
+    """Applies change logs to loaded trees in place
+
+    A patch file holds one JSON object per line:
+      {"op": "add", "path": "a/new.go", "type": "file", "size": 10, "time_modified": 1700000000, "permissions": "-rw-r--r--"}
+      {"op": "remove", "path": "a/old.go"}
+      {"op": "modify", "path": "a/main.go", "size": 20}
+      {"op": "move", "path": "a/main.go", "to": "b/main.go"}
+
+    Operations are applied in order. Only the directories on the changed
+    paths are touched: their name indexes, the subtree totals of their
+    ancestors and an optional PathIndex are updated along with the tree, so
+    applying a patch costs time proportional to the change rather than to
+    the tree. Applying stops at the first operation that does not fit the
+    tree, leaving the operations before it applied.
+    """
+    @staticmethod
+    def load(patch_path: Path) -> List[PatchOperation]:
+        """
+        Read a patch file
+
+        :param patch_path: Path to the patch file
+        :return: Operations in order
+        """
+        try:
+            with open(patch_path, 'r') as f:
+                return list(FileSystemPatch.parse(f))
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{patch_path}': No such file or directory")
+
+    @staticmethod
+    def parse(lines: Iterable[str]) -> Iterator[PatchOperation]:
+        """
+        Parse the lines of a patch, skipping blank ones
+
+        :param lines: Lines of the patch
+        :return: Iterator over operations
+        """
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                raise FileSystemError(f"Invalid patch at line {number}")
+            yield PatchOperation.from_dict(entry, number)
+
+    @staticmethod
+    def apply(root: Directory, operations: Iterable[PatchOperation], index: Optional[PathIndex] = None):
+        """
+        Apply operations to a tree in place
+
+        :param root: Root directory of the tree
+        :param operations: Operations in order
+        :param index: PathIndex of the tree to keep current
+        """
+        if not root.is_directory():
+            raise FileSystemError("Cannot patch a snapshot whose root is a file")
+        for operation in operations:
+            if not operation.components:
+                raise FileSystemError(f"Cannot {operation.op} the root (line {operation.line})")
+            getattr(FileSystemPatch, f"_{operation.op}")(root, operation, index)
+
+    @staticmethod
+    def _spine(root: Directory, components: List[str], operation: PatchOperation) -> List[Directory]:
+        """
+        Return the directories from the root down to the parent of a path
+
+        :param root: Root directory
+        :param components: Path components
+        :param operation: Operation being applied, for error messages
+        :return: Directories, the root first
+        """
+        spine = [root]
+        for component in components[:-1]:
+            item = spine[-1].get_child(component)
+            if item is None or not item.is_directory():
+                raise FileSystemError(f"Cannot {operation.op} '{'/'.join(components)}': "
+                                      f"No such directory (line {operation.line})")
+            spine.append(item)
+        return spine
+
+    @staticmethod
+    def _existing(root: Directory, components: List[str],
+                  operation: PatchOperation) -> Tuple[List[Directory], Union[File, Directory]]:
+        spine = FileSystemPatch._spine(root, components, operation)
+        item = spine[-1].get_child(components[-1])
+        if item is None:
+            raise FileSystemError(f"Cannot {operation.op} '{'/'.join(components)}': "
+                                  f"No such file or directory (line {operation.line})")
+        return spine, item
+
+    @staticmethod
+    def _free_spine(root: Directory, components: List[str], operation: PatchOperation) -> List[Directory]:
+        spine = FileSystemPatch._spine(root, components, operation)
+        if spine[-1].get_child(components[-1]) is not None:
+            raise FileSystemError(f"Cannot {operation.op} to '{'/'.join(components)}': "
+                                  f"File exists (line {operation.line})")
+        return spine
+
+    @staticmethod
+    def _adjust_totals(spine: List[Directory], size: int, entries: int):
+        """Add a change of subtree size and entry count to the directories of a spine"""
+        if spine[0].total_size is None:
+            return
+        for directory in spine:
+            directory.total_size += size
+            directory.total_entries += entries
+
+    @staticmethod
+    def _invalidate_digests(spine: List[Directory], item: Optional[Union[File, Directory]] = None):
+        """Drop the cached digests of the directories of a spine, and of item if it changed itself"""
+        for directory in spine:
+            directory.digest = None
+        if item is not None and item.is_directory():
+            item.digest = None
+
+    @staticmethod
+    def _subtree_totals(item: Union[File, Directory]) -> Tuple[int, int]:
+        """Return the size and entry count an item adds to its ancestors' totals"""
+        if not item.is_directory():
+            return item.size, 1
+        if item.total_size is None:
+            from .file_system_aggregator import FileSystemAggregator
+            FileSystemAggregator.compute_totals(item)
+        return item.total_size, item.total_entries + 1
+
+    @staticmethod
+    def _add(root: Directory, operation: PatchOperation, index: Optional[PathIndex]):
+        spine = FileSystemPatch._free_spine(root, operation.components, operation)
+        name = operation.components[-1]
+        if operation.is_directory:
+            item = Directory(name=name, contents=[], **operation.fields)
+            if root.total_size is not None:
+                item.total_size, item.total_entries = item.size, 0
+        else:
+            item = File(name=name, **operation.fields)
+        spine[-1].add_child(item)
+        FileSystemPatch._adjust_totals(spine, *FileSystemPatch._subtree_totals(item))
+        FileSystemPatch._invalidate_digests(spine)
+        if index is not None:
+            index.add(operation.components, item)
+
+    @staticmethod
+    def _remove(root: Directory, operation: PatchOperation, index: Optional[PathIndex]):
+        spine, item = FileSystemPatch._existing(root, operation.components, operation)
+        size, entries = FileSystemPatch._subtree_totals(item) if root.total_size is not None else (0, 0)
+        spine[-1].remove_child(item)
+        FileSystemPatch._adjust_totals(spine, -size, -entries)
+        FileSystemPatch._invalidate_digests(spine)
+        if index is not None:
+            index.remove(operation.components, spine[-1])
+
+    @staticmethod
+    def _modify(root: Directory, operation: PatchOperation, index: Optional[PathIndex]):
+        spine, item = FileSystemPatch._existing(root, operation.components, operation)
+        change = operation.fields.get('size', item.size) - item.size
+        for field, value in operation.fields.items():
+            setattr(item, field, value)
+        spine[-1].mark_changed()
+        if item.is_directory() and item.total_size is not None:
+            item.total_size += change
+        FileSystemPatch._adjust_totals(spine, change, 0)
+        FileSystemPatch._invalidate_digests(spine, item)
+
+    @staticmethod
+    def _move(root: Directory, operation: PatchOperation, index: Optional[PathIndex]):
+        source, target = operation.components, operation.target
+        spine, item = FileSystemPatch._existing(root, source, operation)
+        if not target:
+            raise FileSystemError(f"Cannot move to the root (line {operation.line})")
+        if item.is_directory() and target[:len(source)] == source:
+            raise FileSystemError(f"Cannot move '{'/'.join(source)}' into itself (line {operation.line})")
+        target_spine = FileSystemPatch._free_spine(root, target, operation)
+        size, entries = FileSystemPatch._subtree_totals(item) if root.total_size is not None else (0, 0)
+
+        spine[-1].remove_child(item)
+        FileSystemPatch._adjust_totals(spine, -size, -entries)
+        FileSystemPatch._invalidate_digests(spine)
+        if index is not None:
+            index.remove(source, spine[-1])
+        item.name = target[-1]
+        target_spine[-1].add_child(item)
+        FileSystemPatch._adjust_totals(target_spine, size, entries)
+        FileSystemPatch._invalidate_digests(target_spine, item)
+        if index is not None:
+            index.add(target, item)
@@ -1,33 +1,106 @@
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, TYPE_CHECKING
 from .file_system import FileSystemItem
 from .file_system_formatter import FileSystemFormatter, NameFormatter
 from .file_system_filter import FileSystemFilter
-from .file_system_sorter import FileSystemSorter
+from .file_system_sorter import FileSystemSorter, SortPlan
+
+if TYPE_CHECKING:
+    from .file_system_profiler import StageProfiler
 
 class FileSystemProcessor:
-    """Orchestrates the processing of filesystem items"""
+    """Orchestrates the processing of filesystem items
+
+    Filters are applied as predicates in a single lazy pass and formatted lines
+    are produced as they are consumed, so a listing that is not sorted streams
+    from the input to the output without building intermediate lists. Long
+    format is the exception: its size column needs every selected item before
+    the first line, so DetailedFormatter collects the items (but no text).
+    """
     def __init__(self,
                  filters: Optional[List[FileSystemFilter]] = None,
                  sorters: Optional[List[FileSystemSorter]] = None, 
-                 formatter: Optional[FileSystemFormatter] = None):
+                 formatter: Optional[FileSystemFormatter] = None,
+                 head: Optional[int] = None,
+                 tail: Optional[int] = None):
         self.filters = filters or []
         self.sorters = sorters or []
         self.formatter = formatter or NameFormatter()
+        self.head = head
+        self.tail = tail
 
-    def process(self, items: List[FileSystemItem]) -> List[str]:
+    def process(self, items: Iterable[FileSystemItem]) -> List[str]:
         """
         Process items through filters, sorters, and formatter
         
         :param items: List of filesystem items
         :return: Formatted list of items
         """
+        return list(self.iter_process(items))
+
+    def iter_process(self, items: Iterable[FileSystemItem],
+                     profiler: Optional['StageProfiler'] = None) -> Iterator[str]:
+        """
+        Process items lazily through filters, sorters, and formatter
+
+        :param items: Filesystem items
+        :param profiler: If enabled, each stage runs to completion and is measured
+        :return: Iterator over formatted items
+        """
+        if profiler is not None and profiler.enabled:
+            return self._profiled_process(items, profiler)
+
         # Apply filters
-        for filter_obj in self.filters:
-            items = filter_obj.filter(items)
+        items = self.select(items)
 
-        # Apply sorters
-        for sorter in self.sorters:
-            items = sorter.sort(items)
+        # Apply sorters, selecting only the requested items when limited
+        items = self._order(SortPlan(self.sorters), items)
         
         # Format and return
-        return self.formatter.format(items)
+        return self.formatter.iter_format(items)
+
+    def _order(self, plan: SortPlan, items: Iterable[FileSystemItem]) -> Iterable[FileSystemItem]:
+        if self.head is not None:
+            return plan.head(items, self.head)
+        if self.tail is not None:
+            return plan.tail(items, self.tail)
+        if not plan.is_identity:
+            return plan.sort(items)
+        return items
+
+    def _profiled_process(self, items: Iterable[FileSystemItem], profiler: 'StageProfiler') -> Iterator[str]:
+        """Run each stage eagerly on its own so it can be measured"""
+        items = list(items)
+        for filter_obj in self.filters:
+            with profiler.stage(f"filter {type(filter_obj).__name__}", len(items)) as stage:
+                items = filter_obj.filter(items)
+                stage.items_out = len(items)
+
+        sorters = ', '.join(type(sorter).__name__ for sorter in self.sorters) or 'none'
+        with profiler.stage(f"sort {sorters}", len(items)) as stage:
+            items = list(self._order(SortPlan(self.sorters), items))
+            stage.items_out = len(items)
+
+        with profiler.stage(f"format {type(self.formatter).__name__}", len(items)) as stage:
+            lines = self.formatter.format(items)
+            stage.items_out = len(lines)
+        return iter(lines)
+
+    def select(self, items: Iterable[FileSystemItem]) -> Iterator[FileSystemItem]:
+        """
+        Lazily yield the items that pass every filter
+
+        :param items: Filesystem items
+        :return: Iterator over the matching items
+        """
+        for filter_obj in self.filters:
+            items = filter_obj.select(items)
+        return iter(items)
+
+    def sort(self, items: Iterable[FileSystemItem]) -> List[FileSystemItem]:
+        """
+        Apply the sorters to items
+
+        :param items: List of filesystem items
+        :return: Sorted items
+        """
+        return SortPlan(self.sorters).sort(items)
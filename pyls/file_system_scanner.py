@@ -0,0 +1,277 @@
+import json
+import re
+from typing import Any, BinaryIO, Iterator, List, Optional
+
+from .file_system_error import FileSystemError
+
+# A run of bytes that cannot change the nesting depth: anything other than
+# quotes and brackets, or a complete string literal.  Matching it with a single
+# regex call keeps the per-byte work in C while skipping unwanted subtrees.
+_NEUTRAL_RUN = re.compile(rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*', re.DOTALL)
+# One or more comma-separated objects that contain no nested objects or arrays
+_FLAT_OBJECTS = re.compile(rb'\{%s\}(?:[ \t\r\n]*,[ \t\r\n]*\{%s\})*'
+                           % (_NEUTRAL_RUN.pattern, _NEUTRAL_RUN.pattern), re.DOTALL)
+_STRING_END = re.compile(rb'["\\]')
+_SCALAR_END = re.compile(rb'[,\]}\s]')
+_WHITESPACE = re.compile(rb'[ \t\r\n]*')
+
+class JsonStreamScanner:
+    """Pull-based scanner over a binary JSON stream that can skip values without decoding them"""
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, stream: BinaryIO, chunk_size: int = CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buf = bytearray()
+        self._pos = 0
+        self._mark: Optional[int] = None
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """
+        Read the next chunk into the buffer, discarding consumed bytes
+
+        :return: False if the stream is exhausted
+        """
+        if self._eof:
+            return False
+        keep_from = self._pos if self._mark is None else self._mark
+        if keep_from:
+            del self._buf[:keep_from]
+            self._pos -= keep_from
+            if self._mark is not None:
+                self._mark -= keep_from
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf += chunk
+        return True
+
+    def _error(self) -> FileSystemError:
+        return FileSystemError("Invalid JSON file")
+
+    def peek(self) -> bytes:
+        """
+        Skip whitespace and return the next byte without consuming it
+
+        :return: Next byte, or b'' at the end of the stream
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return bytes(self._buf[self._pos:self._pos + 1])
+            if not self._fill():
+                return b''
+
+    def expect(self, char: bytes):
+        """Consume the next non-whitespace byte, which must be char"""
+        if self.peek() != char:
+            raise self._error()
+        self._pos += 1
+
+    def read_string(self) -> str:
+        """Read a JSON string literal"""
+        self.expect(b'"')
+        # Keep an enclosing mark, which also keeps this string in the buffer
+        nested = self._mark is not None
+        if not nested:
+            self._mark = self._pos - 1
+        offset = self._pos - 1 - self._mark
+        try:
+            escaped = False
+            while True:
+                match = _STRING_END.search(self._buf, self._pos)
+                if match is None:
+                    self._pos = len(self._buf)
+                    if not self._fill():
+                        raise self._error()
+                    continue
+                if match.group() == b'\\':
+                    escaped = True
+                    self._pos = match.end()
+                    if self._pos >= len(self._buf) and not self._fill():
+                        raise self._error()
+                    self._pos += 1
+                    continue
+                self._pos = match.end()
+                raw = bytes(self._buf[self._mark + offset:self._pos])
+                break
+        finally:
+            if not nested:
+                self._mark = None
+        if escaped:
+            return json.loads(raw)
+        return raw[1:-1].decode('utf-8')
+
+    def read_value(self) -> Any:
+        """Read and fully decode the next JSON value"""
+        if self.peek() == b'"':
+            return self.read_string()
+        self._mark = self._pos
+        try:
+            self._skip()
+            raw = bytes(self._buf[self._mark:self._pos])
+        finally:
+            self._mark = None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            raise self._error()
+
+    def skip_value(self):
+        """Consume the next JSON value without decoding it"""
+        self._skip()
+
+    def _skip(self, limit: Optional[int] = None) -> bool:
+        """
+        Consume the next JSON value
+
+        :param limit: If set, stop once the value is known to span more than
+                      limit bytes from the mark
+        :return: False if the value was abandoned because of limit
+        """
+        first = self.peek()
+        if first == b'':
+            raise self._error()
+        if first == b'"':
+            self.read_string()
+            return True
+        if first not in (b'{', b'['):
+            while True:
+                match = _SCALAR_END.search(self._buf, self._pos)
+                if match is not None:
+                    self._pos = match.start()
+                    return True
+                self._pos = len(self._buf)
+                if not self._fill():
+                    return True
+
+        depth = 0
+        while True:
+            self._pos = _NEUTRAL_RUN.match(self._buf, self._pos).end()
+            if self._pos >= len(self._buf) or self._buf[self._pos] == ord('"'):
+                if limit is not None and self._pos - self._mark > limit:
+                    return False
+                # Buffer ends mid-run or mid-string: read more and rescan
+                if not self._fill():
+                    raise self._error()
+                continue
+            char = self._buf[self._pos]
+            self._pos += 1
+            if char in b'[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return True
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Iterate over the keys of a JSON object
+
+        The caller must consume (read or skip) each key's value before advancing.
+
+        :return: Iterator over keys
+        """
+        self.expect(b'{')
+        if self.peek() == b'}':
+            self._pos += 1
+            return
+        while True:
+            key = self.read_string()
+            self.expect(b':')
+            yield key
+            next_char = self.peek()
+            self._pos += 1
+            if next_char == b'}':
+                return
+            if next_char != b',':
+                raise self._error()
+
+    def iter_array(self) -> Iterator[None]:
+        """
+        Iterate over the elements of a JSON array
+
+        The caller must consume (read or skip) each element before advancing.
+
+        :return: Iterator yielding once per element
+        """
+        self.expect(b'[')
+        if self.peek() == b']':
+            self._pos += 1
+            return
+        while True:
+            yield None
+            next_char = self.peek()
+            self._pos += 1
+            if next_char == b']':
+                return
+            if next_char != b',':
+                raise self._error()
+
+    def iter_array_batches(self, limit: int) -> Iterator[Optional[List[Any]]]:
+        """
+        Iterate over the elements of a JSON array, decoding small ones in batches
+
+        Runs of consecutive elements spanning about limit bytes are decoded with
+        a single json.loads call and yielded as a list. An element that alone
+        exceeds limit is yielded as None and must be consumed (read or skipped)
+        by the caller before advancing, as with iter_array.
+
+        :param limit: Largest encoded size of a batch
+        :return: Iterator over lists of decoded elements, or None for large elements
+        """
+        self.expect(b'[')
+        if self.peek() == b']':
+            self._pos += 1
+            return
+        while True:
+            batch = None
+            closed = False
+            self._mark = self._pos
+            try:
+                # Offsets from the mark stay valid when _fill discards consumed bytes
+                end = 0
+                while True:
+                    # Consume runs of flat objects with one regex call
+                    match = _FLAT_OBJECTS.match(self._buf, self._pos)
+                    if match is not None:
+                        self._pos = match.end()
+                    else:
+                        element_start = self._pos - self._mark
+                        if not self._skip(limit):
+                            self._pos = self._mark + element_start
+                            break
+                    end = self._pos - self._mark
+                    next_char = self.peek()
+                    self._pos += 1
+                    if next_char == b']':
+                        closed = True
+                        break
+                    if next_char != b',':
+                        raise self._error()
+                    self.peek()
+                    if self._pos - self._mark >= limit:
+                        break
+                if end:
+                    batch = bytes(self._buf[self._mark:self._mark + end])
+            finally:
+                self._mark = None
+
+            if batch is None:
+                # The next element is too large to decode in one piece
+                yield None
+                next_char = self.peek()
+                self._pos += 1
+                if next_char == b']':
+                    return
+                if next_char != b',':
+                    raise self._error()
+                continue
+            try:
+                yield json.loads(b'[' + batch + b']')
+            except ValueError:
+                raise self._error()
+            if closed:
+                return
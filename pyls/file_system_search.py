@@ -0,0 +1,318 @@
+import multiprocessing
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from fnmatch import fnmatchcase
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+
+from .file_system_error import FileSystemError
+from .file_system_filter import PermissionFilter
+from .file_system_navigator import FileSystemNavigator
+from .file_system_store import ColumnarStore
+
+# Bytes of the size units of -size, as in find; numbers without a unit count 512-byte blocks
+SIZE_UNITS = {'b': 512, 'c': 1, 'w': 2, 'k': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+# Seconds of the age units of -mtime and -mmin
+TIME_UNITS = {'-mtime': 86400, '-mmin': 60}
+_NUMBER = re.compile(r'([+-]?)(\d+)([bcwkMG]?)')
+
+# A search unit: an item, the path of its parent and whether its subtree is searched too
+Unit = Tuple[int, str, bool]
+# Set in each worker process by _init_worker
+_worker_search: Optional['FileSystemSearch'] = None
+_worker_units: List[Unit] = []
+
+def _init_worker(search: 'FileSystemSearch', units: List[Unit]):
+    global _worker_search, _worker_units
+    _worker_search = search
+    _worker_units = units
+
+def _search_unit(position: int) -> List[str]:
+    return list(_worker_search._search(*_worker_units[position]))
+
+class SearchExpression:
+    """Parses find-style expressions into predicates over a columnar store
+
+    Tests are -name GLOB, -type f|d, -size [+-]N[bcwkMG], -mtime [+-]N,
+    -mmin [+-]N, -newer PATH and -perm MODE with the meaning they have for
+    find. They combine with '!' or -not, -a or -and (also implied between
+    two tests), -o or -or, and parentheses, with find's precedence. A parsed
+    expression is a tree of plain tuples, in which sizes and times are
+    already reduced to ranges, so that it can be sent to worker processes
+    and compiled there.
+    """
+    @staticmethod
+    def parse(tokens: List[str], store: ColumnarStore, now: Optional[float] = None) -> tuple:
+        """
+        Parse an expression
+
+        :param tokens: Command-line arguments of the expression
+        :param store: Store that -newer paths are looked up in
+        :param now: Time that -mtime and -mmin ages are measured from, the current time if None
+        :return: Expression tree, ('true',) for an empty expression
+        """
+        if not tokens:
+            return ('true',)
+        parser = _ExpressionParser(tokens, store, time.time() if now is None else now)
+        expression = parser.parse_or()
+        if parser.position < len(tokens):
+            raise FileSystemError(f"Unexpected '{tokens[parser.position]}' in search expression")
+        return expression
+
+    @staticmethod
+    def compile(expression: tuple, store: ColumnarStore) -> Callable[[int], bool]:
+        """
+        Turn an expression tree into a test of store indexes
+
+        :param expression: Tree returned by parse
+        :param store: Store whose items are tested
+        :return: Function returning whether the item at an index matches
+        """
+        kind = expression[0]
+        if kind == 'and':
+            left, right = (SearchExpression.compile(operand, store) for operand in expression[1:])
+            return lambda index: left(index) and right(index)
+        if kind == 'or':
+            left, right = (SearchExpression.compile(operand, store) for operand in expression[1:])
+            return lambda index: left(index) or right(index)
+        if kind == 'not':
+            operand = SearchExpression.compile(expression[1], store)
+            return lambda index: not operand(index)
+        if kind == 'true':
+            return lambda index: True
+        if kind == 'type':
+            directory_flags, is_directory = store.directory_flags, expression[1]
+            return lambda index: bool(directory_flags[index]) == is_directory
+        if kind == 'name':
+            name, pattern = store.name, expression[1]
+            return lambda index: fnmatchcase(name(index), pattern)
+        if kind == 'perm':
+            modes, matches_mode = store.modes, PermissionFilter(expression[1]).matches_mode
+            return lambda index: matches_mode(modes[index])
+        # 'size' and 'time' hold a range low < value <= high, open where None
+        values = store.sizes if kind == 'size' else store.times
+        low, high = expression[1:]
+        if low is None:
+            return lambda index: values[index] <= high
+        if high is None:
+            return lambda index: values[index] > low
+        return lambda index: low < values[index] <= high
+
+class _ExpressionParser:
+    """Recursive descent parser of SearchExpression.parse"""
+    def __init__(self, tokens: List[str], store: ColumnarStore, now: float):
+        self.tokens = tokens
+        self.store = store
+        self.now = now
+        self.position = 0
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self, after: Optional[str] = None) -> str:
+        token = self._peek()
+        if token is None:
+            raise FileSystemError(f"Missing argument to '{after}'" if after else "Incomplete search expression")
+        self.position += 1
+        return token
+
+    def parse_or(self) -> tuple:
+        expression = self.parse_and()
+        while self._peek() in ('-o', '-or'):
+            self.position += 1
+            expression = ('or', expression, self.parse_and())
+        return expression
+
+    def parse_and(self) -> tuple:
+        expression = self.parse_not()
+        while self._peek() not in (None, '-o', '-or', ')'):
+            if self._peek() in ('-a', '-and'):
+                self.position += 1
+            expression = ('and', expression, self.parse_not())
+        return expression
+
+    def parse_not(self) -> tuple:
+        if self._peek() in ('!', '-not'):
+            self.position += 1
+            return ('not', self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self) -> tuple:
+        token = self._next()
+        if token == '(':
+            expression = self.parse_or()
+            if self._next() != ')':
+                raise FileSystemError("Missing ')' in search expression")
+            return expression
+        if token == '-name':
+            return ('name', self._next(token))
+        if token == '-type':
+            value = self._next(token)
+            if value not in ('f', 'd'):
+                raise FileSystemError(f"Invalid argument '{value}' to -type: expected 'f' or 'd'")
+            return ('type', value == 'd')
+        if token == '-perm':
+            value = self._next(token)
+            try:
+                PermissionFilter(value)
+            except ValueError as e:
+                raise FileSystemError(f"Invalid argument '{value}' to -perm: {e}")
+            return ('perm', value)
+        if token == '-size':
+            sign, count, unit = self._number(token, units=True)
+            return ('size',) + self._range(sign, count, SIZE_UNITS[unit or 'b'])
+        if token in TIME_UNITS:
+            sign, count, _ = self._number(token, units=False)
+            # An age of N units is N * unit up to (N + 1) * unit seconds, as find rounds it down
+            unit = TIME_UNITS[token]
+            low, high = self._range(sign, count + 1, unit)
+            return ('time', None if high is None else int(self.now) - high,
+                    None if low is None else int(self.now) - low)
+        if token == '-newer':
+            path = self._next(token)
+            index = self.store.find_path(FileSystemNavigator.split_path(path))
+            if index is None:
+                raise FileSystemError(f"Cannot access '{path}': No such file or directory")
+            return ('time', self.store.times[index], None)
+        raise FileSystemError(f"Unknown search predicate '{token}'")
+
+    def _number(self, predicate: str, units: bool) -> Tuple[str, int, str]:
+        value = self._next(predicate)
+        match = _NUMBER.fullmatch(value)
+        if match is None or (match.group(3) and not units):
+            raise FileSystemError(f"Invalid argument '{value}' to {predicate}")
+        return match.group(1), int(match.group(2)), match.group(3)
+
+    @staticmethod
+    def _range(sign: str, count: int, unit: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Return the values low < value <= high that round up to more than,
+        less than or exactly count units
+        """
+        if sign == '+':
+            return count * unit, None
+        if sign == '-':
+            return None, (count - 1) * unit
+        return (count - 1) * unit, count * unit
+
+class FileSystemSearch:
+    """Finds every entry below a path that matches a search expression
+
+    The tree is held in a ColumnarStore, whose typed arrays are the only state
+    a search reads. With jobs > 1 the subtrees below the path are split into
+    units, each searched by a worker process that was forked with the store,
+    so the workers share its pages without copying or unpickling anything.
+    The largest subtrees are split further until every unit holds at most
+    1 / (jobs * UNITS_PER_JOB) of the entries, which the post-order layout of
+    the store tells without visiting them. Results are emitted in unit order,
+    the same depth-first order as a sequential search.
+    """
+    UNITS_PER_JOB = 4
+    # Smallest number of entries worth searching in a worker process
+    MIN_PARALLEL_ENTRIES = 10000
+
+    def __init__(self, store: ColumnarStore, expression: tuple):
+        """
+        :param store: Store holding the tree
+        :param expression: Tree returned by SearchExpression.parse
+        """
+        self.store = store
+        self.expression = expression
+        self._matches: Optional[Callable[[int], bool]] = None
+
+    def search(self, path: Optional[str] = None, jobs: int = 1) -> Iterator[str]:
+        """
+        Generate the paths of the matching entries below a path
+
+        Paths start with path, or with './' for the root, like those of the
+        find subcommand. A path naming a file is tested itself.
+
+        :param path: Path to search below, relative to the root
+        :param jobs: Number of worker processes
+        :return: Iterator over paths in depth-first order
+        """
+        components = FileSystemNavigator.split_path(path)
+        index = self.store.find_path(components)
+        if index is None:
+            raise FileSystemError(f"Cannot access '{path}': No such file or directory")
+        label = '/'.join(components) or '.'
+        if not self.store.directory_flags[index]:
+            if self._matcher()(index):
+                yield label
+            return
+
+        units = [(child, label, True) for child in self.store.child_indexes(index)]
+        if jobs <= 1 or self.store.subtree_entries(index) < self.MIN_PARALLEL_ENTRIES:
+            for unit in units:
+                yield from self._search(*unit)
+            return
+
+        units = self._split(units, self.store.subtree_entries(index) // (jobs * self.UNITS_PER_JOB))
+        methods = multiprocessing.get_all_start_methods()
+        # Forked workers inherit the store instead of unpickling it
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(jobs, mp_context=context, initializer=_init_worker,
+                                 initargs=(self, units)) as executor:
+            pending: Deque[Future] = deque()
+            next_position = 0
+            # Keep a bounded window of units in flight
+            while pending or next_position < len(units):
+                while next_position < len(units) and len(pending) < jobs * 2:
+                    pending.append(executor.submit(_search_unit, next_position))
+                    next_position += 1
+                yield from pending.popleft().result()
+
+    def _split(self, units: List[Unit], max_entries: int) -> List[Unit]:
+        """
+        Split units whose subtrees exceed max_entries entries
+
+        A unit is replaced by one for its directory alone followed by one for
+        every child's subtree, which keeps the units in depth-first order.
+
+        :param units: Units in depth-first order
+        :param max_entries: Largest number of entries of a unit
+        :return: Units in depth-first order
+        """
+        store = self.store
+        split: List[Unit] = []
+        stack = list(reversed(units))
+        while stack:
+            index, parent_label, descend = stack.pop()
+            if not descend or store.subtree_entries(index) <= max_entries:
+                split.append((index, parent_label, descend))
+                continue
+            split.append((index, parent_label, False))
+            label = f"{parent_label}/{store.name(index)}"
+            stack.extend((child, label, True) for child in reversed(store.child_indexes(index)))
+        return split
+
+    def _matcher(self) -> Callable[[int], bool]:
+        if self._matches is None:
+            self._matches = SearchExpression.compile(self.expression, self.store)
+        return self._matches
+
+    def _search(self, index: int, parent_label: str, descend: bool) -> Iterator[str]:
+        """
+        Generate the matching paths of one unit
+
+        :param index: Item of the unit
+        :param parent_label: Path of its parent
+        :param descend: Whether the items below it are searched too
+        :return: Iterator over paths in depth-first order
+        """
+        store = self.store
+        matches, name, directory_flags = self._matcher(), store.name, store.directory_flags
+        children, child_starts, child_counts = store.children, store.child_starts, store.child_counts
+        stack = [(index, parent_label)]
+        while stack:
+            index, parent_label = stack.pop()
+            if not directory_flags[index] or not descend:
+                if matches(index):
+                    yield f"{parent_label}/{name(index)}"
+                continue
+            label = f"{parent_label}/{name(index)}"
+            if matches(index):
+                yield label
+            start = child_starts[index]
+            stack.extend((child, label) for child in reversed(children[start:start + child_counts[index]]))
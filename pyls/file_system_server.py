@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import stat
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, TextIO, Tuple, TYPE_CHECKING
+
+from .file_system_aggregator import FileSystemAggregator
+from .file_system_error import FileSystemError
+from .file_system_index import PathIndex
+from .file_system_loader import FileSystemLoader
+from .file_system_session import FileSystemSession
+
+if TYPE_CHECKING:
+    from .pyls import PyLSCommandLineInterface
+
+# Requests and responses are newline-delimited JSON messages. A request is
+# {"args": [...]} with the same arguments the pyls command accepts, and the
+# response is a sequence of {"line": "..."} messages ending with
+# {"status": 0} or {"status": 1, "error": "..."}.
+
+class _RequestArgumentParser(argparse.ArgumentParser):
+    """ArgumentParser that reports errors to the client instead of exiting"""
+    def error(self, message: str):
+        raise ValueError(message)
+
+def strip_connect_argument(args: List[str]) -> List[str]:
+    """
+    Remove --connect and its value from command-line arguments
+
+    :param args: Command-line arguments
+    :return: Arguments to forward to the server
+    """
+    forwarded = []
+    skip_next = False
+    for arg in args:
+        if skip_next:
+            skip_next = False
+        elif arg == '--connect':
+            skip_next = True
+        elif not arg.startswith('--connect='):
+            forwarded.append(arg)
+    return forwarded
+
+class PyLSServer:
+    """Keeps a snapshot loaded and answers listing requests over a Unix domain socket
+
+    Before each request the snapshot file is checked and reloaded if it
+    changed. With locate, the snapshot is also picked again, so the server
+    follows the pyls command when a newer structure.json replaces the
+    compiled snapshot or the other way round. Output lines are produced in
+    the executor FLUSH_LINES at a time and written as they come.
+    """
+    FLUSH_LINES = 1024
+
+    def __init__(self, cli: 'PyLSCommandLineInterface', snapshot_path: Path, socket_path: str,
+                 locate: Optional[Callable[[], Path]] = None):
+        """
+        :param cli: Command-line interface that renders the listings
+        :param snapshot_path: Path of the snapshot to serve
+        :param socket_path: Unix domain socket to listen on
+        :param locate: Optional function returning the snapshot to serve, called before each request
+        """
+        self.cli = cli
+        self.snapshot_path = snapshot_path
+        self.socket_path = socket_path
+        self.locate = locate
+        self._root = None
+        self._index: Optional[PathIndex] = None
+        self._identity: Optional[Tuple[Path, int, int]] = None
+        self._session: Optional[FileSystemSession] = None
+        self._reload_lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def default_socket_path() -> str:
+        """
+        Return the default socket path
+
+        :return: $PYLS_SOCKET, else pyls-UID.sock in the temporary directory
+        """
+        if os.environ.get('PYLS_SOCKET'):
+            return os.environ['PYLS_SOCKET']
+        uid = os.getuid() if hasattr(os, 'getuid') else 0
+        return os.path.join(tempfile.gettempdir(), f"pyls-{uid}.sock")
+
+    def _snapshot_identity(self) -> Tuple[Path, int, int]:
+        snapshot_path = self.locate() if self.locate else self.snapshot_path
+        try:
+            stat = os.stat(snapshot_path)
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{snapshot_path}': No such file or directory")
+        return snapshot_path, stat.st_size, stat.st_mtime_ns
+
+    def load(self):
+        """Load the whole snapshot, index its paths and compute subtree totals"""
+        identity = self._snapshot_identity()
+        root = FileSystemLoader.load_snapshot(identity[0], depth=None)
+        if root.is_directory() and root.total_size is None:
+            FileSystemAggregator.compute_totals(root)
+        index = PathIndex(root)
+        self._root, self._index, self._identity = root, index, identity
+        self.snapshot_path = identity[0]
+        self._session = FileSystemSession(root, index=index)
+
+    async def _ensure_current(self):
+        """Reload the snapshot if the file changed since it was loaded"""
+        async with self._reload_lock:
+            try:
+                changed = self._snapshot_identity() != self._identity
+            except FileSystemError:
+                # Keep serving the last good tree while the file is being replaced
+                changed = False
+            if changed:
+                loop = asyncio.get_running_loop()
+                try:
+                    await loop.run_in_executor(None, self.load)
+                except FileSystemError:
+                    pass
+
+    def _render(self, args: List[str]) -> Iterator[str]:
+        parsed_args = self.cli._create_argument_parser(_RequestArgumentParser).parse_args(args)
+        if parsed_args.help:
+            return iter(self.cli.HELP_TEXT.splitlines())
+        # Take the session once, a reload may replace it meanwhile
+        session = self._session
+        lines = session.render(parsed_args)
+        return iter(lines) if lines is not None else self.cli.iter_render(session.root, parsed_args, session.index)
+
+    def _next_chunk(self, lines: Iterator[str]) -> List[str]:
+        return list(itertools.islice(lines, self.FLUSH_LINES))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            try:
+                args = json.loads(request)['args']
+                if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+                    raise ValueError("args must be a list of strings")
+                await self._ensure_current()
+                loop = asyncio.get_running_loop()
+                lines = await loop.run_in_executor(None, self._render, args)
+                # Produce the lines a chunk at a time, writing each one before the next is built
+                chunk = await loop.run_in_executor(None, self._next_chunk, lines)
+                while chunk:
+                    writer.write(b''.join(json.dumps({"line": line}).encode('utf-8') + b'\n'
+                                          for line in chunk))
+                    await writer.drain()
+                    chunk = await loop.run_in_executor(None, self._next_chunk, lines)
+            except (FileSystemError, ValueError, KeyError, TypeError) as e:
+                writer.write(json.dumps({"status": 1, "error": str(e)}).encode('utf-8') + b'\n')
+            else:
+                writer.write(b'{"status": 0}\n')
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _remove_stale_socket(self):
+        """
+        Remove a socket left behind by a server that is no longer running
+
+        :raises FileSystemError: If the path is not a socket, or a server still listens on it
+        """
+        try:
+            mode = os.stat(self.socket_path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileSystemError(f"Cannot listen on '{self.socket_path}': File exists and is not a socket")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.socket_path)
+            except ConnectionRefusedError:
+                os.unlink(self.socket_path)
+                return
+            except OSError as e:
+                raise FileSystemError(f"Cannot listen on '{self.socket_path}': {e.strerror}")
+        raise FileSystemError(f"Cannot listen on '{self.socket_path}': Another server is running")
+
+    async def _serve(self):
+        self._reload_lock = asyncio.Lock()
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        bound = os.stat(self.socket_path).st_ino
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # Only remove the socket this server created
+            try:
+                if os.stat(self.socket_path).st_ino == bound:
+                    os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    def serve_forever(self):
+        """Load the snapshot and serve requests until interrupted"""
+        self._remove_stale_socket()
+        self.load()
+        asyncio.run(self._serve())
+
+class PyLSClient:
+    """Sends listing requests to a PyLSServer"""
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    def request(self, args: List[str], output: TextIO) -> int:
+        """
+        Send a request and write the streamed output lines
+
+        :param args: Command-line arguments for the listing
+        :param output: Stream to write the lines to
+        :return: Exit status of the request
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.socket_path)
+            connection.sendall(json.dumps({"args": args}).encode('utf-8') + b'\n')
+            with connection.makefile('rb') as responses:
+                for response in responses:
+                    message = json.loads(response)
+                    if 'line' in message:
+                        output.write(message['line'] + '\n')
+                        continue
+                    if message.get('error'):
+                        output.write(f"error: {message['error']}\n")
+                    return message.get('status', 1)
+        raise ConnectionResetError("Connection closed by server")
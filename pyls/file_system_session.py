@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union, TYPE_CHECKING
+
+from .file_system import File, Directory, FileSystemItem
+from .file_system_filter import HiddenItemsFilter, TypeFilter, PermissionFilter
+from .file_system_formatter import (FileSystemFormatter, NameFormatter, DetailedFormatter,
+                                    HumanReadableSizeFormatter)
+from .file_system_navigator import FileSystemNavigator
+from .file_system_sorter import TimeSorter, SortPlan
+
+if TYPE_CHECKING:
+    import argparse
+    from .file_system_index import PathIndex
+
+class FileSystemSession:
+    """Answers repeated listings of a loaded tree from memoized results
+
+    Results are kept per directory in a bounded LRU at three levels: the
+    items that pass the filters, those items in time order, and the formatted
+    lines of each option set. A listing reuses whichever level is cached for
+    its directory, so -t and -t -r share one sort, and -l and -l -h one
+    filtering pass. Every entry records the directory's version and length
+    and is recomputed once the directory changed. Adding or removing items
+    updates the version, and FileSystemPatch marks the directories it
+    modifies. Code that sets an item's size, time_modified or permissions
+    directly must call mark_changed on its parent directory, or the session
+    keeps serving the old listing.
+    """
+    DEFAULT_MAX_ENTRIES = 1024
+    # Arguments that the session cannot answer; listings using them go through the CLI
+    UNSUPPORTED_OPTIONS = ('recursive', 'du', 'summarize', 'head', 'tail')
+
+    def __init__(self, root: Union[File, Directory], max_entries: int = DEFAULT_MAX_ENTRIES,
+                 index: Optional['PathIndex'] = None):
+        """
+        :param root: Root of the loaded tree
+        :param max_entries: Largest number of memoized results
+        :param index: Optional path index built for root
+        """
+        self.root = root
+        self.index = index
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple[Any, ...], Tuple[Directory, Tuple[int, int], Any]]' = OrderedDict()
+        self._formatters: Dict[Tuple[bool, bool], FileSystemFormatter] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, parsed_args: 'argparse.Namespace') -> Optional[List[str]]:
+        """
+        Produce the output lines of a listing as the pyls command prints them
+
+        :param parsed_args: Parsed command-line arguments
+        :return: Lines to print, or None if the arguments ask for something
+                 the session does not memoize
+        """
+        if any(getattr(parsed_args, option, None) for option in self.UNSUPPORTED_OPTIONS):
+            return None
+        lines = self.listing(parsed_args.path, all_files=parsed_args.all_files,
+                             long_format=parsed_args.long_format, reverse=parsed_args.reverse,
+                             time_sort=parsed_args.time_sort, human_readable=parsed_args.human_readable,
+                             filter=parsed_args.filter, perm=parsed_args.perm)
+        return lines if parsed_args.long_format else [" ".join(lines)]
+
+    def listing(self, path: Optional[str] = None, all_files: bool = False, long_format: bool = False,
+                reverse: bool = False, time_sort: bool = False, human_readable: bool = False,
+                filter: Optional[str] = None, perm: Optional[str] = None) -> List[str]:
+        """
+        List a path with the options of the ls command
+
+        :param path: Path to list, relative to the root
+        :param all_files: Include hidden items (-A)
+        :param long_format: Detailed lines (-l)
+        :param reverse: Reverse the order (-r)
+        :param time_sort: Order by modification time (-t)
+        :param human_readable: Human-readable sizes with long_format (-h)
+        :param filter: 'file' or 'dir' to list only that type
+        :param perm: Permission specification of PermissionFilter (--perm)
+        :return: One line per listed item
+        """
+        item = FileSystemNavigator.navigate(self.root, path, self.index)
+        formatter = self._formatter(long_format, human_readable and long_format)
+        if not item.is_directory():
+            return formatter.format(self._select([item], all_files, filter, perm))
+
+        def compute_lines() -> List[str]:
+            if time_sort:
+                items = self._memoized(('time', id(item), all_files, filter, perm), item,
+                                       lambda: SortPlan([TimeSorter()]).sort(
+                                           self._selected(item, all_files, filter, perm)))
+            else:
+                items = self._selected(item, all_files, filter, perm)
+            # The reverse of a stable sort is what the CLI's -r produces, ties reversed too
+            return formatter.format(items[::-1] if reverse else items)
+
+        key = ('lines', id(item), all_files, filter, perm, time_sort, reverse, long_format, human_readable and long_format)
+        return list(self._memoized(key, item, compute_lines))
+
+    def _selected(self, directory: Directory, all_files: bool, filter: Optional[str],
+                  perm: Optional[str]) -> List[FileSystemItem]:
+        return self._memoized(('select', id(directory), all_files, filter, perm), directory,
+                              lambda: self._select(directory.contents, all_files, filter, perm))
+
+    @staticmethod
+    def _select(items: List[FileSystemItem], all_files: bool, filter: Optional[str],
+                perm: Optional[str]) -> List[FileSystemItem]:
+        if perm:
+            items = PermissionFilter(perm).filter(items)
+        items = HiddenItemsFilter(all_files).filter(items)
+        return TypeFilter(filter).filter(items) if filter else items
+
+    def _formatter(self, long_format: bool, human_readable: bool) -> FileSystemFormatter:
+        formatter = self._formatters.get((long_format, human_readable))
+        if formatter is None:
+            formatter = DetailedFormatter() if long_format else NameFormatter()
+            if human_readable:
+                formatter = HumanReadableSizeFormatter(formatter)
+            self._formatters[(long_format, human_readable)] = formatter
+        return formatter
+
+    def _memoized(self, key: Tuple[Any, ...], directory: Directory, compute: Callable[[], Any]) -> Any:
+        stamp = self._stamp(directory)
+        value = self._get(key, directory, stamp)
+        if value is None:
+            value = compute()
+            self._put(key, directory, stamp, value)
+        return value
+
+    @staticmethod
+    def _stamp(directory: Directory) -> Tuple[int, int]:
+        # Reading contents first pages in a directory that was unloaded
+        length = len(directory.contents)
+        return getattr(directory, 'version', 0), length
+
+    def _get(self, key: Tuple[Any, ...], directory: Directory, stamp: Tuple[int, int]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is directory and entry[1] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def _put(self, key: Tuple[Any, ...], directory: Directory, stamp: Tuple[int, int], value: Any):
+        with self._lock:
+            self._entries[key] = (directory, stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every memoized result"""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,270 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+from .file_system import File, Directory, LazyDirectory
+from .file_system_error import FileSystemError
+
+MANIFEST = 'manifest.json'
+VERSION = 2
+DEFAULT_SHARD_ENTRIES = 1 << 16
+DEFAULT_MEMORY_BUDGET = 256 << 20
+# Estimated resident size of one loaded entry, with its name and index slot
+ENTRY_BYTES = 256
+
+class PagedDirectory(LazyDirectory):
+    """Directory at the root of a shard, paged in and out by its ShardedStore"""
+    __slots__ = ('_store', 'shard')
+
+    def __init__(self, name: str, size: int, time_modified: int, permissions: str,
+                 store: 'ShardedStore', shard: int):
+        super().__init__(name, size, time_modified, permissions, lambda: store.read_shard(shard))
+        self._store = store
+        self.shard = shard
+
+    def _ensure_loaded(self):
+        self._store.page_in(self)
+
+class ShardedStore:
+    """A snapshot split into shard files, paged in within a memory budget
+
+    Every shard holds one directory with as much of its subtree as fits in
+    shard_entries entries. Subdirectories that do not fit are the roots of
+    their own shards, and appear in the parent shard as PagedDirectory stubs.
+    A shard is read the first time its directory's contents are accessed and
+    the least recently used shards are dropped again when the loaded ones
+    exceed the memory budget, so trees larger than memory can be listed and
+    navigated. Items keep working after their shard is evicted, it is only
+    read again on the next access. Every directory record also stores the
+    directory's cumulative totals, so du-style reports never aggregate a tree
+    whose shards come and go. Paged trees are read-only: changes to them are
+    lost when their shard is evicted.
+    """
+    def __init__(self, store_dir: Path, memory_budget: int = DEFAULT_MEMORY_BUDGET):
+        """
+        :param store_dir: Directory written by ShardedStore.write
+        :param memory_budget: Estimated bytes of loaded shards to keep
+        """
+        self.store_dir = Path(store_dir)
+        self.memory_budget = memory_budget
+        try:
+            with open(self.store_dir / MANIFEST, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{store_dir}': No such file or directory")
+        except json.JSONDecodeError:
+            raise FileSystemError(f"Invalid shard manifest in '{store_dir}'")
+        if manifest.get('version') != VERSION:
+            raise FileSystemError(f"Unsupported shard store version in '{store_dir}'")
+        self._manifest_root: Dict[str, Any] = manifest['root']
+        self._lock = threading.RLock()
+        # Stub of every shard seen so far, so a re-read parent shard reattaches them
+        self._directories: Dict[int, PagedDirectory] = {}
+        # Loaded shards in least recently used order, with their estimated bytes
+        self._resident: 'OrderedDict[int, int]' = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def is_store(path: Path) -> bool:
+        """
+        Check whether a path is a shard store
+
+        :param path: Path to check
+        :return: True if path is a directory with a shard manifest
+        """
+        return os.path.isfile(os.path.join(path, MANIFEST))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the paging counters
+
+        :return: Hits, misses and evictions of shard accesses, and the number
+                 and estimated bytes of the loaded shards
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'resident_shards': len(self._resident), 'resident_bytes': self.resident_bytes}
+
+    def root(self) -> Union[File, Directory]:
+        """
+        Return the root of the snapshot, with nothing loaded yet
+
+        :return: Root Directory or File
+        """
+        return self._item(self._manifest_root)
+
+    def _item(self, item_dict: Dict[str, Any]) -> Union[File, Directory]:
+        if 'shard' not in item_dict:
+            return File(item_dict['name'], item_dict['size'], item_dict['time_modified'], item_dict['permissions'])
+        shard = item_dict['shard']
+        with self._lock:
+            directory = self._directories.get(shard)
+            if directory is None:
+                directory = PagedDirectory(item_dict['name'], item_dict['size'], item_dict['time_modified'],
+                                           item_dict['permissions'], self, shard)
+                self._set_totals(directory, item_dict)
+                self._directories[shard] = directory
+            return directory
+
+    @staticmethod
+    def _set_totals(directory: Directory, item_dict: Dict[str, Any]) -> Directory:
+        directory.total_size = item_dict['total_size']
+        directory.total_entries = item_dict['total_entries']
+        return directory
+
+    def _shard_path(self, shard: int) -> Path:
+        return self.store_dir / 'shards' / f"{shard}.json"
+
+    def read_shard(self, shard: int) -> Directory:
+        """
+        Read the tree of a shard from disk
+
+        :param shard: Shard number
+        :return: Directory of the shard, with stubs for the shards below it
+        """
+        try:
+            with open(self._shard_path(shard), 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{self._shard_path(shard)}': No such file or directory")
+        except json.JSONDecodeError:
+            raise FileSystemError(f"Invalid shard '{self._shard_path(shard)}'")
+
+        root = self._set_totals(Directory(data['name'], data['size'], data['time_modified'],
+                                          data['permissions'], []), data)
+        stack = [(root, data['contents'])]
+        while stack:
+            directory, contents = stack.pop()
+            for item_dict in contents:
+                if 'contents' in item_dict:
+                    item = self._set_totals(Directory(item_dict['name'], item_dict['size'],
+                                                      item_dict['time_modified'], item_dict['permissions'], []),
+                                            item_dict)
+                    stack.append((item, item_dict['contents']))
+                else:
+                    item = self._item(item_dict)
+                directory.contents.append(item)
+        return root
+
+    def page_in(self, directory: PagedDirectory) -> List[Union[File, Directory]]:
+        """
+        Return the contents of a shard's directory, loading the shard on a miss
+
+        Loading a shard evicts the least recently used other shards while the
+        loaded ones exceed the memory budget.
+
+        :param directory: Directory at the root of the shard
+        :return: Its contents
+        """
+        with self._lock:
+            if directory.shard in self._resident:
+                self.hits += 1
+                self._resident.move_to_end(directory.shard)
+                return directory._contents
+            self.misses += 1
+            directory.load()
+            cost = self._cost(directory)
+            self._resident[directory.shard] = cost
+            self.resident_bytes += cost
+            while self.resident_bytes > self.memory_budget and len(self._resident) > 1:
+                shard, cost = self._resident.popitem(last=False)
+                self.resident_bytes -= cost
+                self.evictions += 1
+                self._directories[shard].unload(lambda shard=shard: self.read_shard(shard))
+            return directory._contents
+
+    @staticmethod
+    def _cost(directory: Directory) -> int:
+        """Estimate the resident bytes of a loaded shard"""
+        entries = 0
+        stack = [directory]
+        while stack:
+            item = stack.pop()
+            entries += len(item._contents)
+            stack.extend(child for child in item._contents
+                         if child.is_directory() and not isinstance(child, PagedDirectory))
+        return entries * ENTRY_BYTES
+
+    @staticmethod
+    def _fields(item: Union[File, Directory]) -> Dict[str, Any]:
+        fields = {'name': item.name, 'size': item.size, 'time_modified': item.time_modified,
+                  'permissions': item.permissions}
+        if item.is_directory():
+            # Stored so that cumulative sizes never need the whole tree loaded at once
+            fields['total_size'] = item.total_size
+            fields['total_entries'] = item.total_entries
+        return fields
+
+    @staticmethod
+    def write(root: Union[File, Directory], store_dir: Path, shard_entries: int = DEFAULT_SHARD_ENTRIES):
+        """
+        Split a tree into a shard store, replacing any store at store_dir
+
+        A shard takes all contents of its directory, and then whole
+        subdirectories for as long as their subtrees fit in shard_entries
+        entries. Each subdirectory that does not fit becomes its own shard.
+
+        :param root: Root Directory or File
+        :param store_dir: Directory to write
+        :param shard_entries: Target number of entries per shard
+        """
+        from .file_system_aggregator import FileSystemAggregator
+        if shard_entries < 1:
+            raise FileSystemError(f"Invalid shard size '{shard_entries}'")
+        FileSystemAggregator.compute_totals(root)
+        store_dir = Path(store_dir)
+        temp_dir = Path(f"{store_dir}.tmp{os.getpid()}")
+        try:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            (temp_dir / 'shards').mkdir(parents=True)
+            manifest_root = ShardedStore._fields(root)
+            if root.is_directory():
+                manifest_root['shard'] = 0
+                ShardedStore._write_shards(root, temp_dir / 'shards', shard_entries)
+            with open(temp_dir / MANIFEST, 'w') as f:
+                json.dump({'version': VERSION, 'root': manifest_root}, f)
+            if store_dir.exists():
+                if not ShardedStore.is_store(store_dir):
+                    raise FileSystemError(f"Cannot write '{store_dir}': File exists")
+                shutil.rmtree(store_dir)
+            os.replace(temp_dir, store_dir)
+        except OSError as e:
+            raise FileSystemError(f"Cannot write '{store_dir}': {e.strerror}")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _write_shards(root: Directory, shards_dir: Path, shard_entries: int):
+        shard_roots = [root]
+        shard = 0
+        while shard < len(shard_roots):
+            directory = shard_roots[shard]
+            budget = shard_entries - len(directory.contents)
+            document = ShardedStore._fields(directory)
+            document['contents'] = []
+            stack = [(directory, document['contents'])]
+            while stack:
+                parent, contents = stack.pop()
+                for item in parent.contents:
+                    fields = ShardedStore._fields(item)
+                    contents.append(fields)
+                    if not item.is_directory():
+                        continue
+                    if parent is directory and item.total_entries > budget:
+                        fields['shard'] = len(shard_roots)
+                        shard_roots.append(item)
+                        continue
+                    if parent is directory:
+                        budget -= item.total_entries
+                    fields['contents'] = []
+                    stack.append((item, fields['contents']))
+            with open(shards_dir / f"{shard}.json", 'w') as f:
+                json.dump(document, f)
+            shard += 1
@@ -0,0 +1,379 @@
+import mmap
+import os
+import struct
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from .file_system import File, Directory, LazyDirectory
+from .file_system_error import FileSystemError
+
+MAGIC = b'PYLS'
+VERSION = 4
+# Version 2 files have no digest table and version 3 files no name order
+# table, they are still read
+_READABLE_VERSIONS = (2, 3, 4)
+
+_PREFIX = struct.Struct('<4sI')
+# magic, version, node count, node table offset, string table offset
+_HEADER_V2 = struct.Struct('<4sIQQQ')
+# magic, version, node count, node table offset, string table offset, digest table offset
+_HEADER_V3 = struct.Struct('<4sIQQQQ')
+# magic, version, node count, node table offset, string table offset, digest
+# table offset, name order table offset
+_HEADER = struct.Struct('<4sIQQQQQ')
+_HEADERS = {2: _HEADER_V2, 3: _HEADER_V3, 4: _HEADER}
+# Entry of the name order table: the index of a node
+_ORDER = struct.Struct('<I')
+# size, time_modified, name offset, name length, permissions offset,
+# permissions length, parent, first child, child count, flags, total size,
+# total entries
+_NODE = struct.Struct('<qqQIQIIIIIqQ')
+_NO_PARENT = 0xFFFFFFFF
+_FLAG_DIRECTORY = 1
+
+class SnapshotCompiler:
+    """Writes filesystem trees in the compiled binary snapshot format
+
+    The file holds a header, a table of fixed-width node records in
+    breadth-first order and a table of deduplicated UTF-8 strings. Breadth-first
+    order keeps the children of every directory contiguous, so a directory
+    record only stores the index of its first child and the number of children.
+    Directory records also carry the cumulative size and entry count of their
+    subtree. Another table holds the Merkle digest of every node, in node
+    order, for diffs. A last table holds, at the positions of every
+    directory's children, their indexes sorted by UTF-8 name, so a child is
+    found by name with a binary search while the records keep listing order.
+    """
+    @staticmethod
+    def write(root: Union[File, Directory], output_path: Path):
+        """
+        Write a filesystem tree as a compiled snapshot
+
+        :param root: Root Directory or File
+        :param output_path: Path of the compiled snapshot
+        """
+        from .file_system_aggregator import FileSystemAggregator
+        from .file_system_hash import SubtreeHasher
+        if root.is_directory() and root.total_size is None:
+            FileSystemAggregator.compute_totals(root)
+        # Digests are always recomputed, a cached one may predate changes to the tree
+        SubtreeHasher.compute(root)
+        nodes = bytearray()
+        strings = bytearray()
+        digests = bytearray()
+        # The root is nobody's child, its slot is unused
+        order = bytearray(_ORDER.pack(0))
+        string_offsets: Dict[str, Tuple[int, int]] = {}
+
+        def intern(value: str) -> Tuple[int, int]:
+            location = string_offsets.get(value)
+            if location is None:
+                encoded = value.encode('utf-8')
+                location = (len(strings), len(encoded))
+                strings.extend(encoded)
+                string_offsets[value] = location
+            return location
+
+        queue = deque([(root, _NO_PARENT)])
+        next_index = 1
+        count = 0
+        while queue:
+            item, parent = queue.popleft()
+            name_offset, name_length = intern(item.name)
+            permissions_offset, permissions_length = intern(item.permissions)
+            first_child = child_count = flags = total_size = total_entries = 0
+            if item.is_directory():
+                flags = _FLAG_DIRECTORY
+                total_size, total_entries = item.total_size, item.total_entries
+                first_child = next_index
+                child_count = len(item.contents)
+                next_index += child_count
+                queue.extend((child, count) for child in item.contents)
+                # Children are numbered in the order directories are dequeued, so their slots are appended in turn
+                names = [child.name.encode('utf-8') for child in item.contents]
+                for position in sorted(range(child_count), key=names.__getitem__):
+                    order += _ORDER.pack(first_child + position)
+            digests += SubtreeHasher.digest(item)
+            nodes += _NODE.pack(item.size, item.time_modified, name_offset, name_length,
+                                permissions_offset, permissions_length, parent,
+                                first_child, child_count, flags, total_size, total_entries)
+            count += 1
+
+        nodes_offset = _HEADER.size
+        strings_offset = nodes_offset + len(nodes)
+        digests_offset = strings_offset + len(strings)
+        order_offset = digests_offset + len(digests)
+        temp_path = f"{output_path}.tmp{os.getpid()}"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(_HEADER.pack(MAGIC, VERSION, count, nodes_offset, strings_offset, digests_offset,
+                                     order_offset))
+                f.write(nodes)
+                f.write(strings)
+                f.write(digests)
+                f.write(order)
+            os.replace(temp_path, output_path)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise FileSystemError(f"Cannot write '{output_path}': {e.strerror}")
+
+class MappedDirectory(LazyDirectory):
+    """Directory of a compiled snapshot whose children are built from the mapping on access
+
+    Subdirectories are MappedDirectory too, so a walk over the tree only
+    builds what it visits. Released directories drop their children, which
+    are built again on the next access, and the snapshot stays mapped as long
+    as any of its directories is referenced.
+    """
+    __slots__ = ('_snapshot', '_index')
+
+    def __init__(self, name: str, size: int, time_modified: int, permissions: str,
+                 snapshot: 'CompiledSnapshot', index: int):
+        super().__init__(name, size, time_modified, permissions, self._build)
+        self._snapshot = snapshot
+        self._index = index
+
+    def _build(self) -> Directory:
+        return Directory(self.name, self.size, self.time_modified, self.permissions,
+                         [self._snapshot.lazy_item(child) for child in self._snapshot.children(self._index)])
+
+    def release(self):
+        """Drop the built children, to be built again on next access"""
+        self.unload(self._build)
+
+class CompiledSnapshot:
+    """Memory-mapped reader for compiled snapshots
+
+    Only the node records and strings that are actually visited are read, so
+    the operating system pages in just the parts of the file a listing needs.
+    """
+    def __init__(self, path: Path):
+        try:
+            with open(path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{path}': No such file or directory")
+        except (OSError, ValueError):
+            raise FileSystemError(f"Invalid compiled snapshot '{path}'")
+        magic, version = _PREFIX.unpack_from(self._mmap, 0) if len(self._mmap) >= _PREFIX.size else (None, None)
+        header = _HEADERS.get(version)
+        if magic != MAGIC or version not in _READABLE_VERSIONS or len(self._mmap) < header.size:
+            self.close()
+            raise FileSystemError(f"Invalid compiled snapshot '{path}'")
+        # Tables missing from older versions are None
+        offsets = header.unpack_from(self._mmap, 0)[2:] + (None,) * ((_HEADER.size - header.size) // 8)
+        self.node_count, self._nodes_offset, self._strings_offset, self._digests_offset, self._order_offset = offsets
+
+    @staticmethod
+    def is_compiled(path: Path) -> bool:
+        """
+        Check whether a file is a compiled snapshot
+
+        :param path: Path to the file
+        :return: True if the file starts with the compiled snapshot magic
+        """
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(MAGIC)) == MAGIC
+        except OSError:
+            return False
+
+    def close(self):
+        """Release the memory mapping"""
+        self._mmap.close()
+
+    def __enter__(self) -> 'CompiledSnapshot':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _record(self, index: int) -> tuple:
+        return _NODE.unpack_from(self._mmap, self._nodes_offset + index * _NODE.size)
+
+    @property
+    def has_digests(self) -> bool:
+        """Whether the snapshot stores node digests"""
+        return self._digests_offset is not None
+
+    def digest(self, index: int) -> bytes:
+        """
+        Return the Merkle digest of a node
+
+        :param index: Index of the node record
+        :return: Digest bytes, as computed by SubtreeHasher
+        """
+        from .file_system_hash import DIGEST_SIZE
+        start = self._digests_offset + index * DIGEST_SIZE
+        return self._mmap[start:start + DIGEST_SIZE]
+
+    def children(self, index: int) -> range:
+        """
+        Return the indexes of a node's children
+
+        :param index: Index of the node record
+        :return: Range of child indexes, empty for files
+        """
+        record = self._record(index)
+        if not record[9] & _FLAG_DIRECTORY:
+            return range(0)
+        return range(record[7], record[7] + record[8])
+
+    def is_directory(self, index: int) -> bool:
+        """
+        Check whether a node is a directory
+
+        :param index: Index of the node record
+        :return: True for directories
+        """
+        return bool(self._record(index)[9] & _FLAG_DIRECTORY)
+
+    def name(self, index: int) -> str:
+        """
+        Return the name of a node
+
+        :param index: Index of the node record
+        :return: Name
+        """
+        record = self._record(index)
+        return self._string(record[2], record[3])
+
+    def item(self, index: int) -> Union[File, Directory]:
+        """
+        Build a File or Directory for a node, without its contents
+
+        :param index: Index of the node record
+        :return: File or Directory instance
+        """
+        return self._materialize(index, 0)
+
+    def lazy_item(self, index: int) -> Union[File, Directory]:
+        """
+        Build a File, or a MappedDirectory whose contents are built when accessed
+
+        :param index: Index of the node record
+        :return: File or MappedDirectory instance
+        """
+        (size, time_modified, name_offset, name_length, permissions_offset,
+         permissions_length, _, _, _, flags, total_size, total_entries) = self._record(index)
+        if not flags & _FLAG_DIRECTORY:
+            return self._materialize(index, 0)
+        directory = MappedDirectory(self._string(name_offset, name_length), size, time_modified,
+                                    self._string(permissions_offset, permissions_length), self, index)
+        directory.total_size = total_size
+        directory.total_entries = total_entries
+        return directory
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings_offset + offset
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def _find_child(self, index: int, name: bytes) -> Optional[int]:
+        """
+        Find the first child of a directory with the given name
+
+        The name order table is bisected, so only the records and names of
+        about log2(children) children are read. Snapshots without the table
+        are scanned.
+
+        :param index: Index of the directory record
+        :param name: UTF-8 encoded name
+        :return: Index of the child, or None if there is none
+        """
+        record = self._record(index)
+        if not record[9] & _FLAG_DIRECTORY:
+            return None
+        first_child, child_count = record[7], record[8]
+        if self._order_offset is not None:
+            # Equal names are ordered by index, so the leftmost match is the first child
+            low, high = first_child, first_child + child_count
+            while low < high:
+                middle = (low + high) // 2
+                if self._child_name(middle) < name:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low < first_child + child_count and self._child_name(low) == name:
+                return _ORDER.unpack_from(self._mmap, self._order_offset + low * _ORDER.size)[0]
+            return None
+        for child in range(first_child, first_child + child_count):
+            child_record = self._record(child)
+            if child_record[3] != len(name):
+                continue
+            start = self._strings_offset + child_record[2]
+            if self._mmap[start:start + len(name)] == name:
+                return child
+        return None
+
+    def _child_name(self, position: int) -> bytes:
+        """
+        Return the encoded name of the child in a slot of the name order table
+
+        :param position: Slot, within a directory's range of child indexes
+        :return: UTF-8 encoded name
+        """
+        child = _ORDER.unpack_from(self._mmap, self._order_offset + position * _ORDER.size)[0]
+        record = self._record(child)
+        start = self._strings_offset + record[2]
+        return self._mmap[start:start + record[3]]
+
+    def _materialize(self, index: int, depth: Optional[int]) -> Union[File, Directory]:
+        """
+        Build a File or Directory for a node record
+
+        :param index: Index of the node record
+        :param depth: Number of levels of contents to build, all if None
+        :return: File or Directory instance
+        """
+        (size, time_modified, name_offset, name_length, permissions_offset,
+         permissions_length, _, first_child, child_count, flags, total_size,
+         total_entries) = self._record(index)
+        name = self._string(name_offset, name_length)
+        permissions = self._string(permissions_offset, permissions_length)
+        if not flags & _FLAG_DIRECTORY:
+            return File(name=name, size=size, time_modified=time_modified, permissions=permissions)
+        contents: List[Union[File, Directory]] = []
+        if depth is None or depth > 0:
+            child_depth = None if depth is None else depth - 1
+            contents = [self._materialize(child, child_depth)
+                        for child in range(first_child, first_child + child_count)]
+        directory = Directory(name=name, size=size, time_modified=time_modified,
+                              permissions=permissions, contents=contents)
+        directory.total_size = total_size
+        directory.total_entries = total_entries
+        return directory
+
+    def load_path(self, components: List[str], depth: Optional[int] = 1,
+                  lazy: bool = False) -> Union[File, Directory]:
+        """
+        Build the part of the tree needed to list a path
+
+        The result has the same shape as FileSystemLoader.load_path_from_json.
+
+        :param components: Path components relative to the root
+        :param depth: Number of levels to load below the path, all if None
+        :param lazy: Whether the item at path is built with lazy_item instead,
+                     so its subtree is read from the mapping as it is accessed
+        :return: Root Directory or File
+        """
+        if self.node_count == 0:
+            raise FileSystemError("Invalid compiled snapshot")
+        spine = [0]
+        for component in components:
+            child = self._find_child(spine[-1], component.encode('utf-8'))
+            if child is None:
+                break
+            spine.append(child)
+
+        found = len(spine) == len(components) + 1
+        if found and lazy:
+            item = self.lazy_item(spine[-1])
+        else:
+            item = self._materialize(spine[-1], depth if found else 0)
+        for index in reversed(spine[:-1]):
+            parent = self._materialize(index, 0)
+            parent.contents = [item]
+            item = parent
+        return item
@@ -1,10 +1,18 @@
+import heapq
 from abc import ABC, abstractmethod
-from typing import List
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
 
 from .file_system import FileSystemItem
 
 class FileSystemSorter(ABC):
     """Abstract base class for sorting filesystem items"""
+    # Function giving the sort key of an item, for sorters that order by a key
+    key: Optional[Callable[[FileSystemItem], Any]] = None
+    # Whether the sorter reverses the current order
+    reverses = False
+
     @abstractmethod
     def sort(self, items: List[FileSystemItem]) -> List[FileSystemItem]:
         """Sort the given items"""
@@ -12,10 +20,130 @@ class FileSystemSorter(ABC):
 
 class ReverseSorter(FileSystemSorter):
     """Sort items in reverse direction"""
+    reverses = True
+
     def sort(self, items: List[FileSystemItem]) -> List[FileSystemItem]:
-        return reversed(items)
+        return list(reversed(items))
     
 class TimeSorter(FileSystemSorter):
     """Sort items by modification time"""
+    key = attrgetter('time_modified')
+
     def sort(self, items: List[FileSystemItem]) -> List[FileSystemItem]:
-        return sorted(items, key=lambda x: x.time_modified)
\ No newline at end of file
+        return sorted(items, key=self.key)
+
+class SortPlan:
+    """Single-pass ordering equivalent to applying sorters one after another
+
+    Applying stable sorts in sequence orders items by the last key first, then
+    by the earlier keys, then by their original position, and every reverse
+    flips all of those directions. The plan folds the sorters into that list of
+    keys so the items are sorted once, and can select the first or last items
+    of the order with a heap instead of sorting everything.
+
+    Sorters without a key that are not reversing cannot be folded; a plan
+    containing one applies the sorters one after another instead.
+    """
+    def __init__(self, sorters: Optional[List[FileSystemSorter]] = None):
+        sorters = sorters or []
+        # (key, descending) pairs, most significant first
+        self.keys: List[Tuple[Callable[[FileSystemItem], Any], bool]] = []
+        # Direction of the final tie-break on original position
+        self.position_descending = False
+        self.sequential_sorters: Optional[List[FileSystemSorter]] = None
+        for sorter in sorters:
+            if sorter.key is not None:
+                self.keys.insert(0, (sorter.key, False))
+            elif sorter.reverses:
+                self.keys = [(key, not descending) for key, descending in self.keys]
+                self.position_descending = not self.position_descending
+            else:
+                self.sequential_sorters = sorters
+                break
+
+    @property
+    def is_identity(self) -> bool:
+        """Whether the plan keeps items in their original order"""
+        return self.sequential_sorters is None and not self.keys and not self.position_descending
+
+    @staticmethod
+    def _sequence(items: Iterable[FileSystemItem]) -> Sequence[FileSystemItem]:
+        """Materialize items that cannot be iterated in reverse"""
+        return items if isinstance(items, Sequence) else list(items)
+
+    def _key(self) -> Tuple[Optional[Callable[[FileSystemItem], Any]], bool]:
+        """
+        Build a single key function and reverse flag for the plan's keys
+
+        Keys whose direction differs from the position tie-break are negated,
+        which requires them to be numeric.
+
+        :return: Key function (None if there are no keys) and whether to reverse
+        """
+        if not self.keys:
+            return None, self.position_descending
+        reverse = self.position_descending
+        if len(self.keys) == 1 and self.keys[0][1] == reverse:
+            return self.keys[0][0], reverse
+        parts = [(key, -1 if descending != reverse else 1) for key, descending in self.keys]
+        return lambda item: tuple(sign * key(item) for key, sign in parts), reverse
+
+    def sort(self, items: Iterable[FileSystemItem]) -> List[FileSystemItem]:
+        """
+        Order items according to the plan
+
+        :param items: Filesystem items
+        :return: Sorted list of items
+        """
+        if self.sequential_sorters is not None:
+            items = list(items)
+            for sorter in self.sequential_sorters:
+                items = sorter.sort(items)
+            return list(items)
+        key, reverse = self._key()
+        if key is None:
+            return list(reversed(self._sequence(items))) if reverse else list(items)
+        if reverse:
+            items = self._sequence(items)
+            # A stable descending sort of the reversed input also reverses ties
+            return sorted(reversed(items), key=key, reverse=True)
+        return sorted(items, key=key)
+
+    def head(self, items: Iterable[FileSystemItem], count: int) -> List[FileSystemItem]:
+        """
+        Select the first items of the plan's order in O(n log count)
+
+        :param items: Filesystem items
+        :param count: Number of items to select
+        :return: Selected items in order
+        """
+        if self.sequential_sorters is not None:
+            return self.sort(items)[:count]
+        key, reverse = self._key()
+        if key is None:
+            return list(islice(reversed(self._sequence(items)) if reverse else items, count))
+        if reverse:
+            items = self._sequence(items)
+            return heapq.nlargest(count, reversed(items), key=key)
+        return heapq.nsmallest(count, items, key=key)
+
+    def tail(self, items: Iterable[FileSystemItem], count: int) -> List[FileSystemItem]:
+        """
+        Select the last items of the plan's order in O(n log count)
+
+        :param items: Filesystem items
+        :param count: Number of items to select
+        :return: Selected items in order
+        """
+        if count <= 0:
+            return []
+        if self.sequential_sorters is not None:
+            return self.sort(items)[-count:]
+        items = self._sequence(items)
+        key, reverse = self._key()
+        if key is None:
+            return list(islice(items if reverse else reversed(items), count))[::-1]
+        # The last items of an order are the first items of its opposite, reversed
+        if reverse:
+            return heapq.nsmallest(count, items, key=key)[::-1]
+        return heapq.nlargest(count, reversed(items), key=key)[::-1]
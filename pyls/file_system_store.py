@@ -0,0 +1,317 @@
+import json
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+from .file_system import File, Directory
+from .file_system_error import FileSystemError
+from .file_system_mode import PermissionMode
+
+class ColumnarStore:
+    """Struct-of-arrays storage for a whole filesystem tree
+
+    Every item is identified by an integer index. Sizes, times, name ids,
+    permission modes, parent indexes and child ranges live in typed arrays,
+    and distinct names are stored once in a UTF-8 blob. Items are exposed through FileView and
+    DirectoryView objects that are created on access and behave like File and
+    Directory for filters, sorters and formatters.
+    """
+    def __init__(self):
+        self.sizes = array('q')
+        self.times = array('q')
+        self.name_ids = array('I')
+        self.modes = array('I')
+        # Permission strings that formatting the mode would not reproduce, by index
+        self.permission_strings: Dict[int, str] = {}
+        self.parents = array('i')
+        self.child_starts = array('I')
+        self.child_counts = array('I')
+        self.directory_flags = bytearray()
+        # Children of every directory, referenced by child_starts/child_counts
+        self.children = array('I')
+        self._name_blob = bytearray()
+        self._name_ends = array('Q')
+        self._child_maps: Dict[int, Dict[str, int]] = {}
+        # Cumulative directory sizes and entry counts, filled by compute_totals
+        self.total_sizes: Optional[array] = None
+        self.total_entries: Optional[array] = None
+        self.root_index = -1
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    @staticmethod
+    def from_json(json_path: Path) -> 'ColumnarStore':
+        """
+        Build a store from a JSON file without creating File or Directory objects
+
+        Items are appended in post-order while the JSON decoder completes each
+        object, so decoded dictionaries are released as soon as they are stored.
+
+        :param json_path: Path to the JSON file
+        :return: Populated store
+        """
+        store = ColumnarStore()
+        name_ids: Dict[str, int] = {}
+
+        def add_item(item_dict: Dict[str, Any]) -> int:
+            mode, permissions = PermissionMode.parse_keeping(item_dict['permissions'])
+            return store._add(name_ids, item_dict['name'], item_dict['size'], item_dict['time_modified'],
+                              mode, item_dict.get('contents'), permissions)
+
+        try:
+            with open(json_path, 'r') as f:
+                store.root_index = json.load(f, object_hook=add_item)
+        except FileNotFoundError:
+            raise FileSystemError(f"Cannot access '{json_path}': No such file or directory")
+        except (json.JSONDecodeError, KeyError, TypeError, OverflowError):
+            raise FileSystemError("Invalid JSON file")
+        if not isinstance(store.root_index, int):
+            raise FileSystemError("Invalid JSON file")
+        return store
+
+    @staticmethod
+    def from_tree(root: Union[File, Directory]) -> 'ColumnarStore':
+        """
+        Build a store from a loaded tree, in the same post-order as from_json
+
+        :param root: Root Directory or File of any loader
+        :return: Populated store
+        """
+        store = ColumnarStore()
+        name_ids: Dict[str, int] = {}
+        # Each entry holds an item, an iterator over its contents and the indexes of the children stored so far
+        stack = [(root, iter(root.contents) if root.is_directory() else None, [])]
+        while stack:
+            item, contents, indexes = stack[-1]
+            if contents is not None:
+                child = next(contents, None)
+                if child is not None:
+                    stack.append((child, iter(child.contents) if child.is_directory() else None, []))
+                    continue
+            stack.pop()
+            permissions = item.permissions
+            index = store._add(name_ids, item.name, item.size, item.time_modified, item.mode,
+                               indexes if contents is not None else None,
+                               permissions if PermissionMode.format(item.mode) != permissions else None)
+            if stack:
+                stack[-1][2].append(index)
+            else:
+                store.root_index = index
+        return store
+
+    def _add(self, name_ids: Dict[str, int], name: str, size: int, time_modified: int, mode: int,
+             contents: Optional[Sequence[int]], permissions: Optional[str] = None) -> int:
+        """
+        Append an item after its children
+
+        :param name_ids: Ids of the names stored so far
+        :param contents: Indexes of the children of a directory, None for a file
+        :param permissions: Permission string to keep if formatting mode does not reproduce it
+        :return: Index of the item
+        """
+        index = len(self.sizes)
+        if permissions is not None:
+            self.permission_strings[index] = permissions
+        name_id = name_ids.get(name)
+        if name_id is None:
+            name_id = name_ids[name] = len(self._name_ends)
+            self._name_blob += name.encode('utf-8')
+            self._name_ends.append(len(self._name_blob))
+
+        self.sizes.append(size)
+        self.times.append(time_modified)
+        self.name_ids.append(name_id)
+        self.modes.append(mode)
+        self.parents.append(-1)
+        if contents is None:
+            self.child_starts.append(0)
+            self.child_counts.append(0)
+            self.directory_flags.append(0)
+        else:
+            self.child_starts.append(len(self.children))
+            self.child_counts.append(len(contents))
+            self.directory_flags.append(1)
+            self.children.extend(contents)
+            for child in contents:
+                self.parents[child] = index
+        return index
+
+    def root(self) -> Union['FileView', 'DirectoryView']:
+        """Return a view of the root item"""
+        return self.item(self.root_index)
+
+    def item(self, index: int) -> Union['FileView', 'DirectoryView']:
+        """
+        Return a view of an item
+
+        :param index: Index of the item
+        :return: FileView or DirectoryView
+        """
+        if self.directory_flags[index]:
+            return DirectoryView(self, index)
+        return FileView(self, index)
+
+    def name(self, index: int) -> str:
+        """Return the name of an item"""
+        name_id = self.name_ids[index]
+        start = self._name_ends[name_id - 1] if name_id else 0
+        return self._name_blob[start:self._name_ends[name_id]].decode('utf-8')
+
+    def permissions(self, index: int) -> str:
+        """Return the permissions string of an item"""
+        return self.permission_strings.get(index) or PermissionMode.format(self.modes[index])
+
+    def child_indexes(self, index: int) -> array:
+        """Return the indexes of a directory's children in order"""
+        start = self.child_starts[index]
+        return self.children[start:start + self.child_counts[index]]
+
+    def find_child(self, index: int, name: str) -> Optional[int]:
+        """
+        Find the first child of a directory with the given name
+
+        The per-directory name map is built on the first lookup in that directory.
+
+        :param index: Index of the directory
+        :param name: Name of the child
+        :return: Index of the child, or None if there is none
+        """
+        child_map = self._child_maps.get(index)
+        if child_map is None:
+            child_map = {}
+            for child in self.child_indexes(index):
+                child_map.setdefault(self.name(child), child)
+            self._child_maps[index] = child_map
+        return child_map.get(name)
+
+    def find_path(self, components: List[str]) -> Optional[int]:
+        """
+        Find the item at a path
+
+        :param components: Path components relative to the root
+        :return: Index of the item, or None if the path does not exist
+        """
+        index = self.root_index
+        for component in components:
+            if not self.directory_flags[index]:
+                return None
+            index = self.find_child(index, component)
+            if index is None:
+                return None
+        return index
+
+    def subtree_entries(self, index: int) -> int:
+        """
+        Count the items below a directory without visiting them
+
+        Items are stored in post-order, so the items below a directory are the
+        ones between its first leaf and itself.
+
+        :param index: Index of the item
+        :return: Number of items below it, 0 for a file
+        """
+        first = index
+        while self.directory_flags[first] and self.child_counts[first]:
+            first = self.children[self.child_starts[first]]
+        return index - first
+
+    def compute_totals(self):
+        """
+        Compute cumulative sizes and entry counts of every directory
+
+        Items are stored in post-order, so one ascending pass sees every
+        directory's children before the directory itself.
+        """
+        total_sizes = array('q', self.sizes)
+        total_entries = array('Q', bytes(8 * len(self.sizes)))
+        for index in range(len(self.sizes)):
+            if not self.directory_flags[index]:
+                continue
+            size = total_sizes[index]
+            entries = 0
+            for child in self.child_indexes(index):
+                size += total_sizes[child]
+                entries += total_entries[child] + 1
+            total_sizes[index] = size
+            total_entries[index] = entries
+        self.total_sizes = total_sizes
+        self.total_entries = total_entries
+
+    def nbytes(self) -> int:
+        """Return the number of bytes held by the arrays and the name blob"""
+        arrays = (self.sizes, self.times, self.name_ids, self.modes, self.parents,
+                  self.child_starts, self.child_counts, self.children, self._name_ends)
+        return (sum(len(values) * values.itemsize for values in arrays)
+                + len(self.directory_flags) + len(self._name_blob))
+
+class FileView(File):
+    """File backed by a ColumnarStore entry"""
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: ColumnarStore, index: int):
+        self.store = store
+        self.index = index
+
+    name = property(lambda self: self.store.name(self.index))
+    size = property(lambda self: self.store.sizes[self.index])
+    time_modified = property(lambda self: self.store.times[self.index])
+    permissions = property(lambda self: self.store.permissions(self.index))
+    mode = property(lambda self: self.store.modes[self.index])
+
+class DirectoryView(Directory):
+    """Directory backed by a ColumnarStore entry"""
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: ColumnarStore, index: int):
+        self.store = store
+        self.index = index
+
+    name = property(lambda self: self.store.name(self.index))
+    size = property(lambda self: self.store.sizes[self.index])
+    time_modified = property(lambda self: self.store.times[self.index])
+    permissions = property(lambda self: self.store.permissions(self.index))
+    mode = property(lambda self: self.store.modes[self.index])
+
+    @property
+    def total_size(self) -> Optional[int]:
+        if self.store.total_sizes is None:
+            return None
+        return self.store.total_sizes[self.index]
+
+    @property
+    def total_entries(self) -> Optional[int]:
+        if self.store.total_entries is None:
+            return None
+        return self.store.total_entries[self.index]
+
+    @property
+    def contents(self) -> 'ColumnarContents':
+        """Lazy sequence of views of the directory's items"""
+        return ColumnarContents(self.store, self.store.child_indexes(self.index))
+
+    def get_child(self, name: str) -> Optional[Union[FileView, 'DirectoryView']]:
+        child = self.store.find_child(self.index, name)
+        return None if child is None else self.store.item(child)
+
+class ColumnarContents(Sequence):
+    """Read-only sequence of item views over a range of store indexes"""
+    __slots__ = ('store', 'indexes')
+
+    def __init__(self, store: ColumnarStore, indexes: array):
+        self.store = store
+        self.indexes = indexes
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __getitem__(self, position: Union[int, slice]) -> Union[FileView, DirectoryView, 'ColumnarContents']:
+        if isinstance(position, slice):
+            return ColumnarContents(self.store, self.indexes[position])
+        return self.store.item(self.indexes[position])
+
+    def __iter__(self) -> Iterator[Union[FileView, DirectoryView]]:
+        item = self.store.item
+        for index in self.indexes:
+            yield item(index)
+
@@ -0,0 +1,151 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterator, List, Optional, Tuple
+
+from .file_system import Directory, LazyDirectory
+from .file_system_aggregator import FileSystemAggregator
+from .file_system_filter import FileSystemFilter
+from .file_system_processor import FileSystemProcessor
+
+# A unit of a parallel walk: a directory, its label and whether its subdirectories are listed too
+Unit = Tuple[Directory, str, bool]
+# Set in each worker process by _init_worker
+_worker_walker: Optional['FileSystemWalker'] = None
+_worker_units: List[Unit] = []
+
+def _init_worker(walker: 'FileSystemWalker', units: List[Unit]):
+    global _worker_walker, _worker_units
+    _worker_walker = walker
+    _worker_units = units
+
+def _walk_unit(position: int) -> List[str]:
+    directory, label, descend = _worker_units[position]
+    lines = _worker_walker._walk(directory, label) if descend else _worker_walker._render(directory, label)
+    return list(lines)
+
+class FileSystemWalker:
+    """Lists a directory and all its subdirectories like ls -R
+
+    Directories are visited depth-first with an explicit stack and each one is
+    rendered as soon as it is reached, so output starts immediately. A tree
+    whose directories load their contents on access, such as one loaded with
+    FileSystemLoader.load_snapshot(lazy=True), is read as it is walked, and
+    every listed LazyDirectory is released once its subdirectories are on the
+    stack, so memory stays bounded by the pending sibling directories rather
+    than the whole tree. Trees loaded up front are held whole by their root.
+    """
+    UNITS_PER_JOB = 4
+    # Largest number of entries below a directory that one worker result holds
+    MAX_UNIT_ENTRIES = 1 << 16
+
+    def __init__(self, processor: FileSystemProcessor,
+                 descend_filters: Optional[List[FileSystemFilter]] = None,
+                 join_names: bool = False):
+        """
+        :param processor: Processor applied to each directory's contents
+        :param descend_filters: Filters selecting the subdirectories to descend into
+        :param join_names: Whether each directory's output is joined into one line
+        """
+        self.processor = processor
+        self.descend_filters = descend_filters or []
+        self.join_names = join_names
+
+    def walk(self, directory: Directory, label: str = '.', jobs: int = 1) -> Iterator[str]:
+        """
+        Generate the output lines of a recursive listing
+
+        With jobs > 1 the subtrees below directory are rendered in a process
+        pool and emitted in the same order as a sequential walk. Subtrees with
+        more than MAX_UNIT_ENTRIES entries, or more than their share of the
+        jobs, are split into their directory and its subtrees, so each worker
+        result stays bounded; only a single directory's listing can exceed it.
+
+        :param directory: Directory to list
+        :param label: Path printed for directory
+        :param jobs: Number of worker processes
+        :return: Iterator over output lines
+        """
+        if jobs <= 1:
+            yield from self._walk(directory, label)
+            return
+
+        yield from self._render(directory, label)
+        subtrees = self._subdirectories(directory, label)
+        if not subtrees:
+            return
+        if directory.total_entries is None:
+            FileSystemAggregator.compute_totals(directory)
+        max_entries = min(self.MAX_UNIT_ENTRIES, directory.total_entries // (jobs * self.UNITS_PER_JOB))
+        units = self._split([(subtree, subtree_label, True) for subtree, subtree_label in subtrees], max_entries)
+        methods = multiprocessing.get_all_start_methods()
+        # Forked workers inherit the tree instead of unpickling it
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(jobs, mp_context=context, initializer=_init_worker,
+                                 initargs=(self, units)) as executor:
+            pending: Deque[Future] = deque()
+            next_position = 0
+            # Keep a bounded window of units in flight
+            while pending or next_position < len(units):
+                while next_position < len(units) and len(pending) < jobs * 2:
+                    pending.append(executor.submit(_walk_unit, next_position))
+                    next_position += 1
+                yield ''
+                yield from pending.popleft().result()
+
+    def _split(self, units: List[Unit], max_entries: int) -> List[Unit]:
+        """
+        Split units whose subtrees exceed max_entries entries
+
+        A unit is replaced by one for its directory alone followed by one for
+        every subdirectory's subtree, which keeps the units in walk order.
+
+        :param units: Units in walk order
+        :param max_entries: Largest number of entries below a unit's directory
+        :return: Units in walk order
+        """
+        split: List[Unit] = []
+        stack = list(reversed(units))
+        while stack:
+            directory, label, descend = stack.pop()
+            if not descend or directory.total_entries <= max_entries:
+                split.append((directory, label, descend))
+                continue
+            split.append((directory, label, False))
+            stack.extend((subdirectory, subdirectory_label, True) for subdirectory, subdirectory_label
+                         in reversed(self._subdirectories(directory, label)))
+        return split
+
+    def _walk(self, directory: Directory, label: str) -> Iterator[str]:
+        stack = [(directory, label)]
+        first = True
+        while stack:
+            directory, label = stack.pop()
+            if not first:
+                yield ''
+            first = False
+            yield from self._render(directory, label)
+            stack.extend(reversed(self._subdirectories(directory, label)))
+            if isinstance(directory, LazyDirectory):
+                directory.release()
+
+    def _render(self, directory: Directory, label: str) -> Iterator[str]:
+        yield f"{label}:"
+        output = self.processor.iter_process(directory.contents)
+        if self.join_names:
+            yield " ".join(output)
+        else:
+            yield from output
+
+    def _subdirectories(self, directory: Directory, label: str) -> List[Tuple[Directory, str]]:
+        """
+        Select the subdirectories to descend into, in listing order
+
+        :param directory: Directory being listed
+        :param label: Path printed for directory
+        :return: Subdirectories with their labels
+        """
+        items = [item for item in directory.contents if item.is_directory()]
+        for filter_obj in self.descend_filters:
+            items = filter_obj.filter(items)
+        return [(item, f"{label.rstrip('/')}/{item.name}") for item in self.processor.sort(items)]
@@ -0,0 +1,63 @@
+import sys
+from typing import Iterable, List, Optional, TextIO
+
+class StreamWriter:
+    """Buffered writer that sends output to a stream in large chunks
+
+    Lines are collected until chunk_size characters are buffered and then
+    written with a single call, so huge listings cost a few hundred writes
+    instead of one per line, while the first chunk still goes out as soon as
+    it is full.
+    """
+    DEFAULT_CHUNK_SIZE = 1 << 16
+
+    def __init__(self, stream: Optional[TextIO] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param stream: Stream to write to, stdout if None
+        :param chunk_size: Number of characters to buffer before writing
+        """
+        self.stream = stream or sys.stdout
+        self.chunk_size = chunk_size
+        self._buffer: List[str] = []
+        self._buffered = 0
+
+    def _append(self, text: str):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.chunk_size:
+            self._drain()
+
+    def _drain(self):
+        if self._buffer:
+            self.stream.write(''.join(self._buffer))
+            self._buffer, self._buffered = [], 0
+
+    def write_lines(self, lines: Iterable[str]):
+        """
+        Write lines, each followed by a newline
+
+        :param lines: Lines to write
+        """
+        for line in lines:
+            self._append(line + '\n')
+
+    def write_joined(self, words: Iterable[str], separator: str = ' '):
+        """
+        Write words on a single line without building the line in memory
+
+        :param words: Words to write
+        :param separator: Text written between words
+        """
+        first = True
+        for word in words:
+            if first:
+                first = False
+                self._append(word)
+            else:
+                self._append(separator + word)
+        self._append('\n')
+
+    def flush(self):
+        """Write any buffered output and flush the stream"""
+        self._drain()
+        self.stream.flush()
@@ -1,21 +1,60 @@
 from pathlib import Path
-import argparse
+from types import SimpleNamespace
+import os
 import sys
 
-from typing import Optional, List
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple, Union, TYPE_CHECKING
 
+from .file_system import File, Directory
 from .file_system_loader import FileSystemLoader
 from .file_system_error import FileSystemError
-from .file_system_processor import FileSystemProcessor
-from .file_system_formatter import NameFormatter, DetailedFormatter, HumanReadableSizeFormatter
-from .file_system_filter import HiddenItemsFilter, TypeFilter
-from .file_system_sorter import ReverseSorter, TimeSorter
 from .file_system_navigator import FileSystemNavigator
+from .file_system_snapshot import CompiledSnapshot
+from .file_system_writer import StreamWriter
+from .file_system_profiler import StageProfiler
+
+# Everything else is imported by the code paths that need it, so that plain
+# listings do not pay for argparse, multiprocessing or the optional features.
+if TYPE_CHECKING:
+    import argparse
+    from .file_system_index import PathIndex
+    from .file_system_processor import FileSystemProcessor
+    from .file_system_mount import MountTable
 
 class PyLSCommandLineInterface:
     """Handles command-line argument parsing and application logic"""
+    SUBCOMMANDS = {
+        'compile': '_run_compile',
+        'serve': '_run_serve',
+        'find': '_run_find',
+        'search': '_run_search',
+        'patch': '_run_patch',
+        'diff': '_run_diff',
+    }
+
+    # Options that determine the processor of a listing
+    PROCESSOR_OPTIONS = ('all_files', 'filter', 'perm', 'time_sort', 'reverse', 'long_format',
+                         'human_readable', 'head', 'tail')
+    MAX_CACHED_PROCESSORS = 256
+
+    # Flags understood by the fast argument parser, and the values argparse
+    # gives to every option that is not used
+    FAST_FLAGS = {'A': 'all_files', 'l': 'long_format', 'r': 'reverse', 't': 'time_sort',
+                  'h': 'human_readable', 'R': 'recursive', 's': 'summarize'}
+    FAST_OPTIONS = {'--filter': ('file', 'dir'), '--head': None, '--tail': None}
+    ARGUMENT_DEFAULTS = {
+        'all_files': False, 'long_format': False, 'reverse': False, 'time_sort': False,
+        'human_readable': False, 'recursive': False, 'jobs': 1, 'du': False, 'summarize': False,
+        'max_depth': None, 'filter': None, 'perm': None, 'head': None, 'tail': None, 'cache_dir': None,
+        'cache_size': None, 'cache_verify': False, 'mount': None, 'mount_table': None,
+        'connect': None, 'batch': None,
+        'batch_format': 'text', 'profile': False, 'profile_format': None, 'profile_dump': None,
+        'help': False, 'path': None,
+    }
+
     def __init__(self, json_path: Path):
         self.json_path = json_path
+        self._processors: Dict[Tuple, 'FileSystemProcessor'] = {}
 
     def run(self, args: Optional[List[str]] = None):
         """
@@ -23,86 +62,606 @@ class PyLSCommandLineInterface:
         
         :param args: Optional list of command-line arguments
         """
-        # Parse arguments
-        parser = self._create_argument_parser()
-        parsed_args = parser.parse_args(args)
+        if args is None:
+            args = sys.argv[1:]
+        if args and args[0] in self.SUBCOMMANDS:
+            getattr(self, self.SUBCOMMANDS[args[0]])(args[1:])
+            return
+
+        # Parse arguments, leaving anything unusual to argparse
+        parsed_args = self._parse_common_args(args)
+        if parsed_args is None:
+            parsed_args = self._create_argument_parser().parse_args(args)
 
         # Handle help flag
         if parsed_args.help:
             self._show_help()
             return
+        if parsed_args.connect:
+            self._run_client(parsed_args.connect, args)
+            return
+        if parsed_args.batch:
+            self._run_batch(parsed_args)
+            return
+        profile_format = parsed_args.profile_format or os.environ.get('PYLS_PROFILE')
+        if profile_format not in (None, '', 'text', 'json'):
+            print(f"error: Invalid PYLS_PROFILE '{profile_format}': expected 'text' or 'json'")
+            sys.exit(1)
+        profile_dump = parsed_args.profile_dump or os.environ.get('PYLS_PROFILE_DUMP')
+        profiler = StageProfiler(enabled=bool(parsed_args.profile or profile_format))
+        if profile_dump:
+            import cProfile
+            dump_profiler = cProfile.Profile()
+            dump_profiler.enable()
+        profiler.start()
         try:
-            # Load filesystem
-            root = FileSystemLoader.load_from_json(self.json_path)
-
-            # Navigate to specified path if provided
-            if parsed_args.path:
-                root = FileSystemNavigator.navigate(root, parsed_args.path)
-
-            # Prepare items to process
-            items = root.contents if hasattr(root, 'contents') else [root]
-
-            # Create filters
-            filters = [
-                HiddenItemsFilter(parsed_args.all_files)
-            ]
-            if parsed_args.filter:
-                filters.append(TypeFilter(parsed_args.filter))
-
-
-            # Create sorters
-            sorters = []
-            if parsed_args.time_sort:
-                sorters.append(TimeSorter())
-            if parsed_args.reverse:
-                sorters.append(ReverseSorter())
-
-            # Determine formatter
-            formatter = DetailedFormatter() if parsed_args.long_format else NameFormatter()
-            if parsed_args.human_readable and parsed_args.long_format:
-                formatter = HumanReadableSizeFormatter(formatter)
+            # Load only the part of the filesystem needed for the listing
+            with profiler.stage('snapshot'):
+                mount_table = self._mount_table(parsed_args)
+                snapshot_path = self._snapshot_path(parsed_args) if mount_table is None else None
+                depth = self._load_depth(parsed_args, snapshot_path)
+            # -R reads the tree as it walks it, where the snapshot format allows
+            lazy = parsed_args.recursive and not (parsed_args.du or parsed_args.summarize)
+            with profiler.stage('load') as stage:
+                if mount_table is not None:
+                    root = mount_table.load_snapshot(parsed_args.path, depth, lazy)
+                else:
+                    root = FileSystemLoader.load_snapshot(snapshot_path, parsed_args.path, depth, lazy)
+            if profiler.enabled:
+                stage.items_out = profiler.count_items(root)
+
+            # Print output; for -R and --du listings this includes rendering
+            writer = StreamWriter(sys.stdout)
+            for lines, joined in self._iter_blocks(root, parsed_args, profiler=profiler):
+                with profiler.stage('write'):
+                    if joined:
+                        writer.write_joined(lines)
+                    else:
+                        writer.write_lines(lines)
+                    writer.flush()
+
+        except (FileSystemError, ValueError) as e:
+            print(f"error: {e}")
+            sys.exit(1)
+        finally:
+            profiler.stop()
+            if profile_dump:
+                dump_profiler.disable()
+                dump_profiler.dump_stats(profile_dump)
+            if profiler.enabled:
+                profiler.report(sys.stderr, 'json' if profile_format == 'json' else 'text')
+
+    def render(self, root: Union[File, Directory], parsed_args: 'argparse.Namespace',
+               index: Optional['PathIndex'] = None) -> List[str]:
+        """
+        Produce the output lines of a listing
 
-            # Create and run processor
-            # Create and run processor
-            processor = FileSystemProcessor(
-                filters=filters,
-                sorters=sorters, 
-                formatter=formatter
-            )
-            output = processor.process(items)
-
-            # Print output
-            if type(formatter) == NameFormatter:
-                print(" ".join(output))
+        :param root: Root directory or file
+        :param parsed_args: Parsed command-line arguments
+        :param index: Optional path index built for root
+        :return: Lines to print
+        """
+        return list(self.iter_render(root, parsed_args, index))
+
+    def iter_render(self, root: Union[File, Directory], parsed_args: 'argparse.Namespace',
+                    index: Optional['PathIndex'] = None) -> Iterator[str]:
+        """
+        Generate the output lines of a listing
+
+        :param root: Root directory or file
+        :param parsed_args: Parsed command-line arguments
+        :param index: Optional path index built for root
+        :return: Iterator over lines to print
+        """
+        for lines, joined in self._iter_blocks(root, parsed_args, index):
+            if joined:
+                yield " ".join(lines)
             else:
-                for line in output:
-                    print(line)
+                yield from lines
+
+    def _iter_blocks(self, root: Union[File, Directory], parsed_args: 'argparse.Namespace',
+                     index: Optional['PathIndex'] = None,
+                     profiler: Optional[StageProfiler] = None) -> Iterator[Tuple[Iterable[str], bool]]:
+        """
+        Generate the output of a listing as blocks of lines
+
+        :param root: Root directory or file
+        :param parsed_args: Parsed command-line arguments
+        :param index: Optional path index built for root
+        :param profiler: Optional profiler measuring the stages of the listing
+        :return: Iterator over (lines, joined) pairs, where joined blocks are
+                 printed on a single line separated by spaces
+        """
+        profiler = profiler or StageProfiler(enabled=False)
+        # Navigate to specified path if provided
+        if parsed_args.path:
+            with profiler.stage('navigate'):
+                root = FileSystemNavigator.navigate(root, parsed_args.path, index)
+
+        from .file_system_formatter import NameFormatter
+        from .file_system_filter import HiddenItemsFilter
+        processor = self._processor(parsed_args)
+        join_names = type(processor.formatter) == NameFormatter
+
+        if parsed_args.du or parsed_args.summarize:
+            from .file_system_aggregator import DiskUsageReporter
+            reporter = DiskUsageReporter(processor.sorters, [HiddenItemsFilter(parsed_args.all_files)],
+                                         parsed_args.human_readable)
+            max_depth = 0 if parsed_args.summarize else parsed_args.max_depth
+            yield reporter.report(root, parsed_args.path or '.', max_depth), False
+            return
+
+        if parsed_args.recursive and root.is_directory():
+            from .file_system_walker import FileSystemWalker
+            walker = FileSystemWalker(processor, [HiddenItemsFilter(parsed_args.all_files)], join_names)
+            yield walker.walk(root, parsed_args.path or '.', parsed_args.jobs), False
+            return
+
+        # Prepare items to process
+        items = root.contents if hasattr(root, 'contents') else [root]
+        yield processor.iter_process(items, profiler), join_names
+
+    def _load_depth(self, parsed_args: 'argparse.Namespace', snapshot_path: Optional[Path]) -> Optional[int]:
+        """
+        Return how many levels below the listed path must be loaded
+
+        :param parsed_args: Parsed command-line arguments
+        :param snapshot_path: Path of the snapshot to load, None for mounted snapshots
+        :return: Number of levels, all if None
+        """
+        if parsed_args.du or parsed_args.summarize:
+            # Compiled snapshots store subtree totals, JSON ones need the whole subtree
+            if snapshot_path is None or not CompiledSnapshot.is_compiled(snapshot_path):
+                return None
+            return 0 if parsed_args.summarize else parsed_args.max_depth
+        if parsed_args.recursive:
+            return None
+        return 1
+
+    def _processor(self, parsed_args: 'argparse.Namespace') -> 'FileSystemProcessor':
+        """
+        Return a processor for the listing options, reusing one created for the same options
+
+        :param parsed_args: Parsed command-line arguments
+        :return: Configured FileSystemProcessor
+        """
+        key = tuple(getattr(parsed_args, option) for option in self.PROCESSOR_OPTIONS)
+        processor = self._processors.get(key)
+        if processor is None:
+            if len(self._processors) >= self.MAX_CACHED_PROCESSORS:
+                self._processors.clear()
+            processor = self._processors[key] = self._create_processor(parsed_args)
+        return processor
+
+    def _create_processor(self, parsed_args: 'argparse.Namespace') -> 'FileSystemProcessor':
+        """
+        Create the processor for the listing options
+
+        :param parsed_args: Parsed command-line arguments
+        :return: Configured FileSystemProcessor
+        """
+        from .file_system_processor import FileSystemProcessor
+        from .file_system_formatter import NameFormatter, DetailedFormatter, HumanReadableSizeFormatter
+        from .file_system_filter import HiddenItemsFilter, TypeFilter, PermissionFilter
+        from .file_system_sorter import ReverseSorter, TimeSorter
+
+        # Create filters, the permission filter first so that it sees whole directories
+        filters = []
+        if parsed_args.perm:
+            filters.append(PermissionFilter(parsed_args.perm))
+        filters.append(HiddenItemsFilter(parsed_args.all_files))
+        if parsed_args.filter:
+            filters.append(TypeFilter(parsed_args.filter))
+
+
+        # Create sorters
+        sorters = []
+        if parsed_args.time_sort:
+            sorters.append(TimeSorter())
+        if parsed_args.reverse:
+            sorters.append(ReverseSorter())
+
+        # Determine formatter
+        formatter = DetailedFormatter() if parsed_args.long_format else NameFormatter()
+        if parsed_args.human_readable and parsed_args.long_format:
+            formatter = HumanReadableSizeFormatter(formatter)
+
+        # Create processor
+        return FileSystemProcessor(
+            filters=filters,
+            sorters=sorters, 
+            formatter=formatter,
+            head=parsed_args.head,
+            tail=parsed_args.tail
+        )
+
+    def _run_client(self, socket_path: str, args: List[str]):
+        """
+        Send a listing request to a pyls server and print its output
+
+        :param socket_path: Path of the server's Unix domain socket
+        :param args: Command-line arguments, including --connect
+        """
+        from .file_system_server import PyLSClient, strip_connect_argument
+        try:
+            status = PyLSClient(socket_path).request(strip_connect_argument(args), sys.stdout)
+        except OSError as e:
+            print(f"error: Cannot connect to '{socket_path}': {e.strerror or e}")
+            sys.exit(1)
+        if status:
+            sys.exit(status)
+
+    def _run_find(self, args: List[str]):
+        """
+        Run the find subcommand
+
+        :param args: Command-line arguments after 'find'
+        """
+        import argparse
+        from .file_system_name_index import NameIndex
+        parser = argparse.ArgumentParser(prog='pyls find',
+                                         description='Find entries of the whole snapshot by name')
+        parser.add_argument('pattern', help="Glob matched against entry names, e.g. '*.go'")
+        parser.add_argument('path', nargs='?', default=None, help='Only search below PATH')
+        parser.add_argument('--prefix', action='store_true', help='Match names starting with PATTERN instead of a glob')
+        parser.add_argument('--filter', choices=['file', 'dir'], help='Filter by type')
+        parser.add_argument('--save-index', action='store_true',
+                            help='Save the name index next to the snapshot for later searches')
+        parsed_args = parser.parse_args(args)
+        index_path = NameIndex.default_path(self.json_path)
+        try:
+            index = NameIndex.load(index_path, self.json_path)
+            if index is None:
+                index = NameIndex.build(FileSystemLoader.load_snapshot(self.json_path, depth=None))
+                if parsed_args.save_index:
+                    index.save(index_path, self.json_path)
+
+            components = FileSystemNavigator.split_path(parsed_args.path)
+            if index.is_directory(components) is None:
+                raise FileSystemError(f"Cannot access '{parsed_args.path}': No such file or directory")
+            # Paths are printed like find does: below PATH, or below '.'
+            writer = StreamWriter(sys.stdout)
+            writer.write_lines(path if components else f"./{path}"
+                               for path in index.find(parsed_args.pattern, parsed_args.prefix,
+                                                      components, parsed_args.filter))
+            writer.flush()
+        except FileSystemError as e:
+            print(f"error: {e}")
+            sys.exit(1)
+
+    def _run_search(self, args: List[str]):
+        """
+        Run the search subcommand
+
+        :param args: Command-line arguments after 'search'
+        """
+        import argparse
+        from .file_system_search import FileSystemSearch, SearchExpression
+        parser = argparse.ArgumentParser(prog='pyls search', usage='pyls search [PATH] [--jobs N] [EXPRESSION]',
+                                         description='Find entries of the whole snapshot matching a find-style '
+                                                     'expression of -name, -type, -size, -mtime, -mmin, -newer '
+                                                     'and -perm tests')
+        parser.add_argument('path', nargs='?', default=None, help='Only search below PATH')
+        parser.add_argument('--jobs', type=int, default=1, help='Search subtrees in N worker processes')
+        # The expression starts at the first test or operator, everything before it is for argparse
+        start = next((position for position, arg in enumerate(args)
+                      if arg in ('(', '!') or (arg.startswith('-') and not arg.startswith('--') and arg != '-h')),
+                     len(args))
+        parsed_args = parser.parse_args(args[:start])
+        try:
+            store = FileSystemLoader.load_store(self.json_path)
+            search = FileSystemSearch(store, SearchExpression.parse(args[start:], store))
+            writer = StreamWriter(sys.stdout)
+            writer.write_lines(search.search(parsed_args.path, parsed_args.jobs))
+            writer.flush()
+        except FileSystemError as e:
+            print(f"error: {e}")
+            sys.exit(1)
+
+    def _run_patch(self, args: List[str]):
+        """
+        Run the patch subcommand
+
+        :param args: Command-line arguments after 'patch'
+        """
+        import argparse
+        from .file_system_exporter import FORMATS, SnapshotExporter
+        from .file_system_patch import FileSystemPatch
+        parser = argparse.ArgumentParser(prog='pyls patch',
+                                         description='Apply patch files to the snapshot and write the result')
+        parser.add_argument('patches', nargs='+', type=Path, help='Patch files, applied in order')
+        parser.add_argument('-o', dest='output', type=Path,
+                            help='Snapshot to write, replaced atomically (default: JSON on stdout)')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Format of the written snapshot (default: from the suffix of OUTPUT)')
+        parsed_args = parser.parse_args(args)
+        try:
+            operations = [operation for patch_path in parsed_args.patches
+                          for operation in FileSystemPatch.load(patch_path)]
+            root = FileSystemLoader.load_snapshot(self.json_path, depth=None)
+            FileSystemPatch.apply(root, operations)
+            SnapshotExporter.write(root, parsed_args.output, parsed_args.format)
+        except FileSystemError as e:
+            print(f"error: {e}")
+            sys.exit(1)
+
+    def _run_diff(self, args: List[str]):
+        """
+        Run the diff subcommand
+
+        :param args: Command-line arguments after 'diff'
+        """
+        import argparse
+        from .file_system_diff import SnapshotDiff
+        from .file_system_formatter import DetailedFormatter, HumanReadableSizeFormatter
+        parser = argparse.ArgumentParser(prog='pyls diff', add_help=False,
+                                         description='Show the entries that differ between two snapshots')
+        parser.add_argument('old', type=Path, help='Old snapshot')
+        parser.add_argument('new', type=Path, help='New snapshot')
+        parser.add_argument('-l', dest='long_format', action='store_true', help='Long format')
+        parser.add_argument('-h', dest='human_readable', action='store_true', help='Human readable sizes')
+        parser.add_argument('--help', action='help', help='Show help message')
+        parsed_args = parser.parse_args(args)
+        try:
+            with SnapshotDiff(parsed_args.old, parsed_args.new) as diff:
+                changes = [(status, f"{path}/" if item.is_directory() and path != '.' else path, item)
+                           for status, path, item in diff.iter_changes()]
+        except FileSystemError as e:
+            print(f"error: {e}")
+            sys.exit(1)
+
+        # Directories end with a slash, and long listings show the paths in place of the names
+        lines = [path for _, path, _ in changes]
+        if parsed_args.long_format:
+            formatter = DetailedFormatter()
+            if parsed_args.human_readable:
+                formatter = HumanReadableSizeFormatter(formatter)
+            lines = formatter.format([File(path, item.size, item.time_modified, item.permissions)
+                                      for _, path, item in changes])
+        writer = StreamWriter(sys.stdout)
+        writer.write_lines(f"{status} {line}" for (status, _, _), line in zip(changes, lines))
+        writer.flush()
+
+    def _run_batch(self, parsed_args: 'argparse.Namespace'):
+        """
+        Answer the queries of a batch file, or of stdin if it is '-'
 
+        :param parsed_args: Parsed command-line arguments
+        """
+        from .file_system_batch import PyLSBatchRunner
+        try:
+            runner = PyLSBatchRunner(self, self._snapshot_path(parsed_args), parsed_args.batch_format)
+            runner.load()
+            writer = StreamWriter(sys.stdout)
+            if parsed_args.batch == '-':
+                status = runner.run(sys.stdin, writer)
+            else:
+                try:
+                    with open(parsed_args.batch, 'r') as queries:
+                        status = runner.run(queries, writer)
+                except FileNotFoundError:
+                    raise FileSystemError(f"Cannot access '{parsed_args.batch}': No such file or directory")
         except (FileSystemError, ValueError) as e:
             print(f"error: {e}")
             sys.exit(1)
+        if status:
+            sys.exit(status)
 
-    
-    def _create_argument_parser(self):
+    def _run_serve(self, args: List[str]):
+        """
+        Run the serve subcommand
+
+        :param args: Command-line arguments after 'serve'
+        """
+        import argparse
+        from .file_system_server import PyLSServer
+        parser = argparse.ArgumentParser(prog='pyls serve',
+                                         description='Keep the snapshot loaded and answer listing requests')
+        parser.add_argument('--socket', default=PyLSServer.default_socket_path(),
+                            help='Unix domain socket to listen on')
+        parsed_args = parser.parse_args(args)
+        try:
+            # Follow the snapshot the pyls command would pick when serving the default one
+            locate = default_snapshot_path if self.json_path == default_snapshot_path() else None
+            PyLSServer(self, self.json_path, parsed_args.socket, locate).serve_forever()
+        except FileSystemError as e:
+            print(f"error: {e}")
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+
+    def _mount_table(self, parsed_args: 'argparse.Namespace') -> Optional['MountTable']:
+        """
+        Return the mount table of the listing, if snapshots are mounted
+
+        :param parsed_args: Parsed command-line arguments
+        :return: MountTable built from --mount-table (or PYLS_MOUNT_TABLE) and
+                 --mount, or None to list the snapshot itself
+        """
+        table_path = parsed_args.mount_table or os.environ.get('PYLS_MOUNT_TABLE')
+        if not table_path and not parsed_args.mount:
+            return None
+        from .file_system_mount import MountTable
+        mounts = MountTable.from_file(Path(table_path)) if table_path else []
+        mounts += [MountTable.parse_spec(spec) for spec in parsed_args.mount or []]
+        return MountTable(mounts)
+
+    def _snapshot_path(self, parsed_args: 'argparse.Namespace') -> Path:
+        """
+        Return the snapshot to load, going through the compiled snapshot cache when enabled
+
+        :param parsed_args: Parsed command-line arguments
+        :return: Path of the snapshot to load
+        """
+        cache_dir = parsed_args.cache_dir or os.environ.get('PYLS_CACHE_DIR')
+        # Shard stores are paged in, compiling them would load them whole
+        if not cache_dir or CompiledSnapshot.is_compiled(self.json_path) or os.path.isdir(self.json_path):
+            return self.json_path
+        from .file_system_cache import SnapshotCache
+        max_bytes = parsed_args.cache_size
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('PYLS_CACHE_SIZE', SnapshotCache.DEFAULT_MAX_BYTES))
+        cache = SnapshotCache(Path(cache_dir), max_bytes, parsed_args.cache_verify)
+        try:
+            entry = cache.get(self.json_path)
+        except FileSystemError:
+            # Loading the snapshot itself reports the problem
+            entry = None
+        # An unusable cache directory should not break listings
+        return entry or self.json_path
+
+    def _run_compile(self, args: List[str]):
+        """
+        Run the compile subcommand
+
+        :param args: Command-line arguments after 'compile'
+        """
+        import argparse
+        from .file_system_snapshot import SnapshotCompiler
+        parser = argparse.ArgumentParser(prog='pyls compile',
+                                         description='Compile a JSON snapshot into the binary snapshot format')
+        parser.add_argument('source', type=Path, help='JSON or NDJSON snapshot to compile')
+        parser.add_argument('-o', dest='output', type=Path,
+                            help='Output file (default: SOURCE with .pyls or .ndjson suffix)')
+        parser.add_argument('--ndjson', action='store_true', help='Write the flat NDJSON format instead')
+        parser.add_argument('--shards', action='store_true',
+                            help='Write a directory of shards that are paged in on demand instead')
+        parser.add_argument('--shard-entries', type=self._count, metavar='N',
+                            help='Target number of entries per shard')
+        parsed_args = parser.parse_args(args)
+        suffix = '.shards' if parsed_args.shards else '.ndjson' if parsed_args.ndjson else '.pyls'
+        output = parsed_args.output or parsed_args.source.with_suffix(suffix)
+        try:
+            root = FileSystemLoader.load_from_json(parsed_args.source)
+            if parsed_args.shards:
+                from .file_system_shards import ShardedStore, DEFAULT_SHARD_ENTRIES
+                ShardedStore.write(root, output, parsed_args.shard_entries or DEFAULT_SHARD_ENTRIES)
+            elif parsed_args.ndjson:
+                from .file_system_flat import FlatSnapshot
+                FlatSnapshot.write(root, output)
+            else:
+                SnapshotCompiler.write(root, output)
+        except FileSystemError as e:
+            print(f"error: {e}")
+            sys.exit(1)
+
+    @staticmethod
+    def _count(value: str) -> int:
+        """Parse a non-negative item count"""
+        import argparse
+        count = int(value)
+        if count < 0:
+            raise argparse.ArgumentTypeError(f"invalid count: '{value}'")
+        return count
+
+    @staticmethod
+    def _permission_spec(value: str) -> str:
+        """Validate a --perm specification"""
+        import argparse
+        from .file_system_filter import PermissionFilter
+        try:
+            PermissionFilter(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        return value
+
+    @classmethod
+    def _parse_common_args(cls, args: List[str]) -> Optional[SimpleNamespace]:
+        """
+        Parse the arguments of a plain listing without argparse
+
+        Only short flags, --filter, --head, --tail, --help and PATH are
+        understood. Anything else, including invalid values, is left to the
+        full argument parser, which also reports the errors.
+
+        :param args: Command-line arguments
+        :return: Parsed arguments, or None if argparse has to parse them
+        """
+        values = dict(cls.ARGUMENT_DEFAULTS)
+        args = iter(args)
+        for arg in args:
+            if arg == '--help':
+                values['help'] = True
+            elif arg.startswith('--'):
+                option, equals, value = arg.partition('=')
+                if option not in cls.FAST_OPTIONS:
+                    return None
+                if not equals:
+                    value = next(args, '-')
+                choices = cls.FAST_OPTIONS[option]
+                if choices is not None:
+                    if value not in choices:
+                        return None
+                elif value.isascii() and value.isdigit():
+                    value = int(value)
+                else:
+                    return None
+                values[option[2:]] = value
+            elif arg.startswith('-') and arg != '-':
+                for flag in arg[1:]:
+                    if flag not in cls.FAST_FLAGS:
+                        return None
+                    values[cls.FAST_FLAGS[flag]] = True
+            elif values['path'] is None:
+                values['path'] = arg
+            else:
+                return None
+        if values['head'] is not None and values['tail'] is not None:
+            return None
+        return SimpleNamespace(**values)
+
+    def _create_argument_parser(self, parser_class: Optional[type] = None):
         """
         Create argument parser
         
+        :param parser_class: ArgumentParser subclass to instantiate
         :return: Configured ArgumentParser
         """
-        parser = argparse.ArgumentParser(add_help=False)
+        import argparse
+        parser = (parser_class or argparse.ArgumentParser)(add_help=False)
         parser.add_argument('-A', dest='all_files', action='store_true', help='Show all items')
         parser.add_argument('-l', dest='long_format', action='store_true', help='Long format')
         parser.add_argument('-r', dest='reverse', action='store_true', help='Reverse order')
         parser.add_argument('-t', dest='time_sort', action='store_true', help='Sort by time')
         parser.add_argument('-h', dest='human_readable', action='store_true', help='Human readable sizes')
+        parser.add_argument('-R', dest='recursive', action='store_true', help='List subdirectories recursively')
+        parser.add_argument('--jobs', type=int, default=1, help='Worker processes for recursive listings')
+        parser.add_argument('--du', action='store_true', help='Show cumulative directory sizes')
+        parser.add_argument('-s', dest='summarize', action='store_true', help='Show only the total of PATH')
+        parser.add_argument('--max-depth', type=int, help='Deepest level of directories shown by --du')
         parser.add_argument('--filter', choices=['file', 'dir'], help='Filter by type')
+        parser.add_argument('--perm', type=self._permission_spec, metavar='MODE',
+                            help='Filter by permission bits: MODE exactly, all of -MODE or any of /MODE')
+        limit = parser.add_mutually_exclusive_group()
+        limit.add_argument('--head', type=self._count, metavar='N', help='Show only the first N items')
+        limit.add_argument('--tail', type=self._count, metavar='N', help='Show only the last N items')
+        parser.add_argument('--cache-dir', help='Cache compiled snapshots in this directory')
+        parser.add_argument('--cache-size', type=int, help='Maximum size of the snapshot cache in bytes')
+        parser.add_argument('--cache-verify', action='store_true', help='Key the snapshot cache on a content hash')
+        parser.add_argument('--mount', action='append', metavar='PREFIX=FILE',
+                            help='List FILE below PREFIX, together with the other mounted snapshots')
+        parser.add_argument('--mount-table', metavar='FILE', help='Read PREFIX=FILE mounts from FILE')
+        parser.add_argument('--connect', metavar='SOCKET', help='Send the request to a pyls server')
+        parser.add_argument('--batch', metavar='FILE', help="Answer one query per line of FILE ('-' for stdin)")
+        parser.add_argument('--batch-format', choices=['text', 'json'], default='text',
+                            help='Output format of --batch')
+        parser.add_argument('--profile', action='store_true', help='Report the time spent in each stage on stderr')
+        parser.add_argument('--profile-format', choices=['text', 'json'], help='Format of the --profile report')
+        parser.add_argument('--profile-dump', metavar='FILE', help='Write cProfile statistics of the listing to FILE')
         parser.add_argument('--help', action='store_true', help='Show help message')
         parser.add_argument('path', nargs='?', default=None)
         return parser
     
-    def _show_help(self):
-        """Display help information"""
-        help_text = """Usage: python -m pyls [OPTIONS] [PATH]
+    HELP_TEXT = """Usage: python -m pyls [OPTIONS] [PATH]
+       python -m pyls compile SOURCE [-o OUTPUT] [--ndjson | --shards [--shard-entries N]]
+       python -m pyls serve [--socket SOCKET]
+       python -m pyls find PATTERN [PATH] [--prefix] [--filter=TYPE] [--save-index]
+       python -m pyls search [PATH] [--jobs N] [EXPRESSION]
+       python -m pyls patch PATCH... [-o OUTPUT] [--format=FORMAT]
+       python -m pyls diff OLD NEW [-l] [-h]
+
+A first argument naming a subcommand runs it; list a top-level entry with
+such a name as ./NAME or after '--', e.g. 'python -m pyls -l ./find'.
 
 Options:
   -A          Show all files, folders including hidden items
@@ -110,8 +669,45 @@ Options:
   -r          Reverse order while sorting
   -t          Sort by time modified
   -h          Show human-readable file sizes
+  -R          List subdirectories recursively
+  --jobs=N    Format subtrees of -R listings in N worker processes
+  --du        Show the cumulative size and entry count of every directory
+  -s          Show only the cumulative size and entry count of PATH
+  --max-depth=N
+              Show directories at most N levels below PATH with --du
   --help      Show this help message
   --filter=   Filter items by type: 'file' or 'dir'
+  --perm=MODE Show only items whose permission bits equal the octal MODE,
+              include all bits of -MODE or any bit of /MODE, or one of
+              world-writable, group-writable, executable, setuid, setgid, sticky
+  --head=N    Show only the first N items of the listing order
+  --tail=N    Show only the last N items of the listing order
+  --cache-dir=DIR
+              Cache the parsed snapshot in DIR (also enabled by PYLS_CACHE_DIR)
+  --cache-size=BYTES
+              Maximum size of the snapshot cache (default 1 GiB, or PYLS_CACHE_SIZE)
+  --cache-verify
+              Also key the cache on a hash of the snapshot content
+  --mount=PREFIX=FILE
+              Mount the snapshot FILE at PREFIX; repeat to combine several
+              snapshots into one tree, each loaded only when a path below its
+              PREFIX is listed
+  --mount-table=FILE
+              Read one PREFIX=FILE mount per line of FILE (or PYLS_MOUNT_TABLE)
+  --connect=SOCKET
+              Send the request to a server started with 'pyls serve'
+  --profile   Report the time, item counts and allocations of each stage on
+              stderr (also enabled by PYLS_PROFILE=text or PYLS_PROFILE=json)
+  --profile-format=FORMAT
+              Print the --profile report as a 'text' table or a 'json' document
+  --profile-dump=FILE
+              Write cProfile statistics of the listing to FILE (or PYLS_PROFILE_DUMP)
+  --batch=FILE
+              Load the snapshot once and answer one query per line of FILE
+              ('-' for stdin), e.g. '-l -t PATH'
+  --batch-format=FORMAT
+              Print --batch results as 'text' (a header line before each
+              result) or 'json' (one JSON object per query)
 
 Examples:
   python -m pyls                  # List files in current directory
@@ -122,19 +718,88 @@ Examples:
   python -m pyls -l -t -r         # Sort by time in revrese order
   python -m pyls -l --filter=file # Show only files
   python -m pyls -l --filter=dir  # Show only directories
+  python -m pyls -l --perm=/002   # Show only world-writable items
   python -m pyls -l PATH          # Show all files and directories of PATH if PATH exists
   python -m pyls -h               # Show humain readable file size
+  python -m pyls -l -t -r --head=20
+                                  # Show the 20 most recently modified items
+  python -m pyls -R PATH          # List PATH and all its subdirectories
+  python -m pyls --du -h --max-depth=1
+                                  # Show the size of every top-level directory
+  python -m pyls compile structure.json -o structure.pyls
+                                  # Compile the snapshot for fast listings
+  python -m pyls compile structure.json --ndjson
+                                  # Convert the snapshot to the appendable NDJSON format
+  python -m pyls patch changes.ndjson -o structure.json
+                                  # Apply a change log to the snapshot
+  python -m pyls diff yesterday.pyls today.pyls -l
+                                  # Show added (A), removed (D) and modified (M) entries
+  python -m pyls --mount eu=eu.json --mount us=us.pyls -l us/www
+                                  # List us/www, loading only us.pyls
+  python -m pyls --batch queries.txt --batch-format=json
+                                  # Answer many queries with one load
+  python -m pyls find '*.go' parser
+                                  # Show the paths of all .go files below parser
+  python -m pyls find --prefix test_ --save-index
+                                  # Find names starting with test_ and keep the index
+  python -m pyls search --jobs 8 -type f -size +100M -mtime -7
+                                  # Show files over 100 MiB modified in the last 7 days
+  python -m pyls serve &          # Keep the snapshot loaded in a server
+  python -m pyls --connect /tmp/pyls-1000.sock -l PATH
+                                  # List PATH through the server
 """
-        print(help_text)
+
+    def _show_help(self):
+        """Display help information"""
+        print(self.HELP_TEXT)
+
+def default_snapshot_path(json_path: Path = Path('structure.json'),
+                          compiled_path: Path = Path('structure.pyls'),
+                          flat_path: Path = Path('structure.ndjson'),
+                          shards_path: Path = Path('structure.shards')) -> Path:
+    """
+    Pick the snapshot to list from
+
+    The compiled snapshot is used unless it is missing or older than the JSON
+    file. The flat NDJSON snapshot replaces the JSON file when that is missing,
+    then the JSON and NDJSON snapshots compressed with gzip, bz2 or xz (such
+    as structure.json.xz), and then the shard store.
+
+    :param json_path: Path to the JSON snapshot
+    :param compiled_path: Path to the compiled snapshot
+    :param flat_path: Path to the flat NDJSON snapshot
+    :param shards_path: Path to the shard store
+    :return: Path of the snapshot to load
+    """
+    if not json_path.exists():
+        from .file_system_compression import SUFFIXES
+        candidates = [flat_path] + [Path(f"{path}{suffix}") for path in (json_path, flat_path)
+                                    for suffix in SUFFIXES] + [shards_path]
+        json_path = next((path for path in candidates if path.exists()), json_path)
+    try:
+        compiled_mtime = compiled_path.stat().st_mtime
+    except OSError:
+        return json_path
+    try:
+        if json_path.stat().st_mtime > compiled_mtime:
+            return json_path
+    except OSError:
+        pass
+    return compiled_path
 
 def main():
     """Main entry point for pyls command"""
-    # Default JSON file path (you might want to change this)
-    JSON_PATH = Path('structure.json')
-    
     # Create and run CLI
-    cli = PyLSCommandLineInterface(JSON_PATH)
-    cli.run()
+    cli = PyLSCommandLineInterface(default_snapshot_path())
+    try:
+        cli.run()
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader went away, as with pyls -R | head: stop quietly like ls, and
+        # send the rest of stdout to devnull so the flush at exit does not fail again
+        import signal
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(128 + signal.SIGPIPE)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -4,12 +4,43 @@ import json
 from pathlib import Path
 import tempfile
 import os
+import io
+import subprocess
+import sys
+import time
+import itertools
+import fnmatch
 
+from pyls.file_system import File, Directory
 from pyls.file_system_loader import FileSystemLoader
 from pyls.file_system_formatter import NameFormatter, DetailedFormatter, HumanReadableSizeFormatter
-from pyls.file_system_filter import HiddenItemsFilter, TypeFilter
-from pyls.file_system_sorter import ReverseSorter, TimeSorter
+from pyls.file_system_filter import HiddenItemsFilter, TypeFilter, PermissionFilter
+from pyls.file_system_sorter import ReverseSorter, TimeSorter, SortPlan
 from pyls.file_system_navigator import FileSystemNavigator
+from pyls.file_system_error import FileSystemError
+from pyls.file_system_snapshot import SnapshotCompiler
+from pyls.file_system_index import PathIndex
+from pyls.file_system_cache import SnapshotCache
+from pyls.file_system_server import PyLSClient
+from pyls.pyls import PyLSCommandLineInterface, default_snapshot_path
+from pyls.file_system_aggregator import FileSystemAggregator, DiskUsageReporter
+from pyls.file_system_processor import FileSystemProcessor
+from pyls.file_system_scanner import JsonStreamScanner
+from pyls.file_system_writer import StreamWriter
+from pyls.file_system_batch import PyLSBatchRunner
+from pyls.file_system_name_index import NameIndex
+from pyls import file_system_flat
+from pyls.file_system_flat import FlatSnapshot
+from pyls.file_system_patch import FileSystemPatch
+from pyls.file_system_exporter import SnapshotExporter
+from pyls.file_system_diff import SnapshotDiff
+from pyls.file_system_mount import MountTable
+from pyls.file_system_shards import ShardedStore, ENTRY_BYTES
+from pyls.file_system_session import FileSystemSession
+from pyls.file_system_compression import CompressedInput
+from pyls.file_system_mode import PermissionMode, PERMISSION_STRINGS
+from pyls.file_system_store import ColumnarStore
+from pyls.file_system_search import FileSystemSearch, SearchExpression
 
 @pytest.fixture
 def sample_filesystem_json() -> Dict[str, Any]:
@@ -362,4 +393,1010 @@ def test_humain_readable_size(temp_json_file):
                         'drwxr-xr-x 1.3K Nov 17 12:51 parser_test.go', 
                         '-rw-r--r-- 1.6K Nov 17 12:05 parser.go', 
                         'drwxr-xr-x  533 Nov 14 16:03 go.mod'
-                    ] 
\ No newline at end of file
+                    ] 
+def test_load_path_from_json(temp_json_file):
+    """Test path-directed lazy loading"""
+    root = FileSystemLoader.load_path_from_json(temp_json_file, "./parser/")
+
+    # Only the requested directory is materialized under the root
+    assert [item.name for item in root.contents] == ["parser"]
+    parser = FileSystemNavigator.navigate(root, "parser")
+    names = DetailedFormatter().format(parser.contents)
+    assert names == [
+                        'drwxr-xr-x 1342 Nov 17 12:51 parser_test.go',
+                        '-rw-r--r-- 1622 Nov 17 12:05 parser.go',
+                        'drwxr-xr-x  533 Nov 14 16:03 go.mod'
+                    ]
+
+def test_load_path_from_json_depth(temp_json_file):
+    """Test lazy loading depth limits"""
+    root = FileSystemLoader.load_path_from_json(temp_json_file)
+    lexer = FileSystemNavigator.navigate(root, "lexer")
+    assert lexer.is_directory() and lexer.contents == []
+
+    root = FileSystemLoader.load_path_from_json(temp_json_file, depth=None)
+    lexer = FileSystemNavigator.navigate(root, "lexer")
+    assert [item.name for item in lexer.contents] == ['lexer_test.go', 'go.mod', 'lexer.go']
+
+def test_load_path_from_json_missing(temp_json_file):
+    """Test lazy loading of a path that does not exist"""
+    root = FileSystemLoader.load_path_from_json(temp_json_file, "parser/missing")
+    with pytest.raises(FileSystemError):
+        FileSystemNavigator.navigate(root, "parser/missing")
+
+def test_compiled_snapshot(temp_json_file, tmp_path):
+    """Test listing from a compiled snapshot"""
+    compiled_path = tmp_path / "structure.pyls"
+    SnapshotCompiler.write(FileSystemLoader.load_from_json(temp_json_file), compiled_path)
+
+    root = FileSystemLoader.load_snapshot(compiled_path)
+    names = NameFormatter().format(root.contents)
+    assert names == ['.gitignore', 'LICENSE', 'README.md', 'ast', 'go.mod', 'lexer', 'main.go', 'parser', 'token']
+
+    root = FileSystemLoader.load_snapshot(compiled_path, "parser")
+    parser = FileSystemNavigator.navigate(root, "parser")
+    names = DetailedFormatter().format(parser.contents)
+    assert names == [
+                        'drwxr-xr-x 1342 Nov 17 12:51 parser_test.go',
+                        '-rw-r--r-- 1622 Nov 17 12:05 parser.go',
+                        'drwxr-xr-x  533 Nov 14 16:03 go.mod'
+                    ]
+
+    root = FileSystemLoader.load_snapshot(compiled_path, "parser/missing")
+    with pytest.raises(FileSystemError):
+        FileSystemNavigator.navigate(root, "parser/missing")
+
+def test_compiled_snapshot_lookup(tmp_path, monkeypatch):
+    """Test that compiled snapshots find children by name with a binary search"""
+    from pyls import file_system_snapshot
+    from pyls.file_system_snapshot import CompiledSnapshot
+    names = [f"{i * 7919 % 1000}" for i in range(1000)] + ['é', 'z', 'e', '0', '\U0010FFFF']
+    contents = [File(name=name, size=position, time_modified=0, permissions="-rw-r--r--")
+                for position, name in enumerate(names)]
+    compiled_path = tmp_path / "structure.pyls"
+    SnapshotCompiler.write(Directory(name=".", size=0, time_modified=0, permissions="drwxr-xr-x",
+                                     contents=contents), compiled_path)
+    with CompiledSnapshot(compiled_path) as snapshot:
+        # Records keep the listing order
+        assert [snapshot.name(child) for child in snapshot.children(0)] == names
+        reads = []
+        record = snapshot._record
+        monkeypatch.setattr(snapshot, '_record', lambda index: reads.append(index) or record(index))
+        for name in set(names):
+            reads.clear()
+            # The first child with a repeated name is found
+            assert snapshot._find_child(0, name.encode('utf-8')) == names.index(name) + 1
+            assert len(reads) <= 13
+        assert snapshot._find_child(0, b'missing') is None and snapshot._find_child(1, b'0') is None
+
+    # Version 3 snapshots have no name order table and are scanned
+    data = compiled_path.read_bytes()
+    header = file_system_snapshot._HEADER.unpack_from(data)
+    compiled_path.write_bytes(file_system_snapshot._HEADER_V3.pack(b'PYLS', 3, *header[2:6]) +
+                              data[file_system_snapshot._HEADER_V3.size:])
+    with CompiledSnapshot(compiled_path) as snapshot:
+        assert snapshot._find_child(0, b'0') == names.index('0') + 1 and snapshot._find_child(0, b'x') is None
+    assert FileSystemLoader.load_snapshot(compiled_path, 'z').get_child('z').size == names.index('z')
+
+def test_navigate_hidden_and_nested_paths(temp_json_file):
+    """Test navigating to names starting with dots and nested paths"""
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    assert FileSystemNavigator.navigate(root, ".gitignore").size == 8911
+    assert FileSystemNavigator.navigate(root, "./.gitignore").size == 8911
+    assert FileSystemNavigator.navigate(root, "./lexer/go.mod").size == 227
+    assert FileSystemNavigator.navigate(root, "lexer/") is root.get_child("lexer")
+    with pytest.raises(FileSystemError):
+        FileSystemNavigator.navigate(root, "main.go/lexer")
+
+def test_navigate_with_path_index(temp_json_file):
+    """Test navigating through a path index"""
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    index = PathIndex(root)
+    assert len(index) == 20
+    assert FileSystemNavigator.navigate(root, "./parser/go.mod", index).size == 533
+    assert FileSystemNavigator.navigate(root, ".", index) is root
+    with pytest.raises(FileSystemError):
+        FileSystemNavigator.navigate(root, "parser/missing", index)
+
+def test_columnar_store_views(temp_json_file):
+    """Test that columnar views work with filters, sorters and formatters"""
+    objects = FileSystemLoader.load_from_json(temp_json_file)
+    columnar = FileSystemLoader.load_columnar_from_json(temp_json_file)
+    assert len(columnar.store) == 20
+    assert columnar.name == "interpreter" and len(columnar.contents) == 9
+
+    for path in [None, "parser", "lexer/go.mod"]:
+        expected = FileSystemNavigator.navigate(objects, path)
+        actual = FileSystemNavigator.navigate(columnar, path)
+        expected_items = expected.contents if expected.is_directory() else [expected]
+        actual_items = actual.contents if actual.is_directory() else [actual]
+        for process in [
+            lambda items: DetailedFormatter().format(items),
+            lambda items: NameFormatter().format(ReverseSorter().sort(list(items))),
+            lambda items: DetailedFormatter().format(TimeSorter().sort(TypeFilter("file").filter(items))),
+            lambda items: HumanReadableSizeFormatter(DetailedFormatter()).format(
+                HiddenItemsFilter(show_hidden=False).filter(items)),
+        ]:
+            assert process(actual_items) == process(expected_items)
+
+def test_snapshot_cache(temp_json_file, sample_filesystem_json, tmp_path):
+    """Test the compiled snapshot cache and its invalidation"""
+    cache = SnapshotCache(tmp_path / "cache")
+    entry = cache.get(temp_json_file)
+    assert entry.exists()
+    assert cache.get(temp_json_file) == entry
+    root = FileSystemLoader.load_snapshot(entry, "parser")
+    assert [item.name for item in FileSystemNavigator.navigate(root, "parser").contents] == \
+        ['parser_test.go', 'parser.go', 'go.mod']
+
+    # Changing the snapshot replaces the stale entry
+    sample_filesystem_json["contents"].pop()
+    with open(temp_json_file, 'w') as f:
+        json.dump(sample_filesystem_json, f)
+    os.utime(temp_json_file, ns=(0, 0))
+    new_entry = cache.get(temp_json_file)
+    assert new_entry != entry and not entry.exists()
+    assert len(FileSystemLoader.load_snapshot(new_entry).contents) == 8
+
+def test_snapshot_cache_eviction(temp_json_file, tmp_path, monkeypatch):
+    """Test least recently used eviction of cache entries"""
+    other_json_file = tmp_path / "other.json"
+    other_json_file.write_bytes(temp_json_file.read_bytes())
+    cache = SnapshotCache(tmp_path / "cache", max_bytes=1)
+    first = cache.get(temp_json_file)
+    second = cache.get(other_json_file)
+    assert second.exists() and not first.exists()
+
+    # --cache-size 0 keeps only the entry in use, whatever PYLS_CACHE_SIZE says
+    monkeypatch.setenv('PYLS_CACHE_SIZE', str(1 << 30))
+    cli = PyLSCommandLineInterface(temp_json_file)
+    parsed_args = cli._create_argument_parser().parse_args(['--cache-dir', str(tmp_path / 'cache'), '--cache-size', '0'])
+    assert cli._snapshot_path(parsed_args) == cache.entry_path(temp_json_file) and not second.exists()
+
+    # A missing source is reported as a FileSystemError, and left to the loader by the CLI
+    with pytest.raises(FileSystemError):
+        cache.get(tmp_path / 'missing.json')
+    assert PyLSCommandLineInterface(tmp_path / 'missing.json')._snapshot_path(parsed_args) == tmp_path / 'missing.json'
+
+def test_server_and_client(temp_json_file, sample_filesystem_json, tmp_path):
+    """Test listing through a pyls server and reloading a changed snapshot"""
+    structure = tmp_path / "structure.json"
+    structure.write_bytes(temp_json_file.read_bytes())
+    socket_path = str(tmp_path / "pyls.sock")
+    env = dict(os.environ, PYTHONPATH=str(Path(__file__).resolve().parent.parent))
+    server = subprocess.Popen([sys.executable, "-m", "pyls", "serve", "--socket", socket_path],
+                              cwd=tmp_path, env=env)
+    try:
+        for _ in range(100):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.05)
+        client = PyLSClient(socket_path)
+
+        output = io.StringIO()
+        assert client.request(["-l", "-t", "parser"], output) == 0
+        assert output.getvalue().splitlines() == [
+                        'drwxr-xr-x  533 Nov 14 16:03 go.mod',
+                        '-rw-r--r-- 1622 Nov 17 12:05 parser.go',
+                        'drwxr-xr-x 1342 Nov 17 12:51 parser_test.go'
+                    ]
+
+        output = io.StringIO()
+        assert client.request(["missing"], output) == 1
+        assert output.getvalue() == "error: Cannot access 'missing': No such file or directory\n"
+
+        sample_filesystem_json["contents"].pop()
+        structure.write_text(json.dumps(sample_filesystem_json))
+        os.utime(structure, ns=(0, 0))
+        output = io.StringIO()
+        assert client.request([], output) == 0
+        assert output.getvalue() == "LICENSE README.md ast go.mod lexer main.go parser\n"
+
+        # The server follows the snapshot the pyls command would pick
+        compiled_root = FileSystemLoader.load_from_json(structure)
+        compiled_root.contents = compiled_root.contents[:2]
+        SnapshotCompiler.write(compiled_root, tmp_path / "structure.pyls")
+        os.utime(tmp_path / "structure.pyls", ns=(10 ** 9, 10 ** 9))
+        output = io.StringIO()
+        assert client.request([], output) == 0 and output.getvalue() == "LICENSE\n"
+        os.utime(structure, ns=(2 * 10 ** 9, 2 * 10 ** 9))
+        output = io.StringIO()
+        assert client.request([], output) == 0
+        assert output.getvalue() == "LICENSE README.md ast go.mod lexer main.go parser\n"
+
+        # A live server's socket and other files are never taken over
+        for path in (socket_path, str(structure)):
+            second = subprocess.run([sys.executable, "-m", "pyls", "serve", "--socket", path],
+                                    cwd=tmp_path, env=env, capture_output=True, text=True)
+            assert second.returncode == 1 and second.stdout.startswith(f"error: Cannot listen on '{path}'")
+        assert client.request([], io.StringIO()) == 0 and structure.exists()
+    finally:
+        server.terminate()
+        server.wait()
+
+    # The socket left behind by the terminated server is replaced
+    assert os.path.exists(socket_path)
+    server = subprocess.Popen([sys.executable, "-m", "pyls", "serve", "--socket", socket_path],
+                              cwd=tmp_path, env=env)
+    try:
+        for _ in range(100):
+            try:
+                if PyLSClient(socket_path).request([], io.StringIO()) == 0:
+                    break
+            except OSError:
+                time.sleep(0.05)
+        assert PyLSClient(socket_path).request([], io.StringIO()) == 0
+    finally:
+        server.terminate()
+        server.wait()
+
+def test_server_streaming(temp_json_file, tmp_path, monkeypatch):
+    """Test that server responses are produced in chunks rather than as one list"""
+    from pyls.file_system_server import PyLSServer
+    cli = PyLSCommandLineInterface(temp_json_file)
+    server = PyLSServer(cli, temp_json_file, str(tmp_path / "pyls.sock"))
+    server.load()
+    monkeypatch.setattr(PyLSServer, 'FLUSH_LINES', 4)
+    lines = server._render(["-R", "-l"])
+    assert not isinstance(lines, list)
+    chunks = list(iter(lambda: server._next_chunk(lines), []))
+    assert all(len(chunk) == 4 for chunk in chunks[:-1])
+    parsed_args = cli._create_argument_parser().parse_args(["-R", "-l"])
+    assert [line for chunk in chunks for line in chunk] == cli.render(server._root, parsed_args)
+
+def test_closed_output_pipe(tmp_path):
+    """Test that listings stop quietly when the reader closes the pipe"""
+    structure = {"name": ".", "size": 0, "time_modified": 0, "permissions": "drwxr-xr-x",
+                 "contents": [{"name": f"directory_{i}", "size": 0, "time_modified": 0, "permissions": "drwxr-xr-x",
+                               "contents": [{"name": f"file_{j}", "size": j, "time_modified": 0,
+                                             "permissions": "-rw-r--r--"} for j in range(200)]}
+                              for i in range(100)]}
+    (tmp_path / "structure.json").write_text(json.dumps(structure))
+    env = dict(os.environ, PYTHONPATH=str(Path(__file__).resolve().parent.parent))
+    for args in (["-R"], ["find", "*"], ["search", "--jobs", "2"]):
+        process = subprocess.Popen([sys.executable, "-m", "pyls"] + args, cwd=tmp_path, env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert process.stdout.readline()
+        process.stdout.close()
+        assert process.wait() == 141 and process.stderr.read() == b""
+        process.stderr.close()
+
+def test_subcommand_named_paths(tmp_path, capsys):
+    """Test that top-level entries named like subcommands are listed as ./NAME or after --"""
+    structure = {"name": ".", "size": 0, "time_modified": 0, "permissions": "drwxr-xr-x",
+                 "contents": [{"name": name, "size": 0, "time_modified": 0, "permissions": "drwxr-xr-x",
+                               "contents": [{"name": f"{name}.go", "size": 1, "time_modified": 0,
+                                             "permissions": "-rw-r--r--"}]}
+                              for name in PyLSCommandLineInterface.SUBCOMMANDS]}
+    json_path = tmp_path / "structure.json"
+    json_path.write_text(json.dumps(structure))
+    cli = PyLSCommandLineInterface(json_path)
+    for name in PyLSCommandLineInterface.SUBCOMMANDS:
+        for args in ([f"./{name}"], ["--", name], ["-l", "--", name]):
+            cli.run(args)
+            assert capsys.readouterr().out.split()[-1] == f"{name}.go"
+    # The bare name still runs the subcommand
+    cli.run(["find", "*.go"])
+    assert capsys.readouterr().out.split() == [f"./{name}/{name}.go" for name in PyLSCommandLineInterface.SUBCOMMANDS]
+
+def render_listing(json_path, args):
+    """Render a listing through the command-line interface"""
+    cli = PyLSCommandLineInterface(json_path)
+    parsed_args = cli._create_argument_parser().parse_args(args)
+    root = FileSystemLoader.load_from_json(json_path)
+    return cli.render(root, parsed_args)
+
+def test_recursive_listing(temp_json_file):
+    """Test recursive listing"""
+    assert render_listing(temp_json_file, ["-R", "-t", "-r"]) == [
+                        '.:',
+                        'parser ast lexer token main.go go.mod README.md LICENSE',
+                        '',
+                        './parser:',
+                        'parser_test.go parser.go go.mod',
+                        '',
+                        './ast:',
+                        'go.mod ast.go',
+                        '',
+                        './lexer:',
+                        'lexer.go lexer_test.go go.mod',
+                        '',
+                        './token:',
+                        'token.go go.mod'
+                    ]
+    assert render_listing(temp_json_file, ["-R", "-l", "ast"]) == [
+                        'ast:',
+                        '-rw-r--r--  225 Nov 14 15:59 go.mod',
+                        'drwxr-xr-x  837 Nov 14 15:58 ast.go'
+                    ]
+
+def test_recursive_listing_parallel(temp_json_file, monkeypatch):
+    """Test that parallel recursive listing keeps the sequential order"""
+    from pyls.file_system_walker import FileSystemWalker
+    sequential = render_listing(temp_json_file, ["-R", "-A", "-l"])
+    parallel = render_listing(temp_json_file, ["-R", "-A", "-l", "--jobs", "2"])
+    # Worker results come back as separate lines, not blocks
+    assert parallel == sequential
+
+    # Subtrees above the bound are split, so that no worker result holds more than one of them
+    monkeypatch.setattr(FileSystemWalker, 'MAX_UNIT_ENTRIES', 2)
+    parallel = render_listing(temp_json_file, ["-R", "-A", "--jobs", "3"])
+    assert parallel == render_listing(temp_json_file, ["-R", "-A"])
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    FileSystemAggregator.compute_totals(root)
+    walker = FileSystemWalker(FileSystemProcessor(), [HiddenItemsFilter(True)])
+    units = walker._split([(root, '.', True)], 2)
+    assert [(label, descend) for _, label, descend in units] == \
+        [('.', False), ('./ast', True), ('./lexer', False), ('./parser', False), ('./token', True)]
+
+def test_recursive_listing_lazy(temp_json_file, tmp_path, capsys):
+    """Test that -R reads compiled and mounted snapshots as it walks them"""
+    from pyls.file_system_snapshot import MappedDirectory
+    compiled_path = tmp_path / "structure.pyls"
+    SnapshotCompiler.write(FileSystemLoader.load_from_json(temp_json_file), compiled_path)
+    root = FileSystemLoader.load_snapshot(compiled_path, depth=None, lazy=True)
+    assert isinstance(root, MappedDirectory) and not root.is_loaded
+    assert root.total_entries == 19 and not root.get_child('parser').is_loaded
+    expected = render_listing(temp_json_file, ["-R", "-A", "-l"])
+    parsed_args = PyLSCommandLineInterface._parse_common_args(["-R", "-A", "-l"])
+    assert PyLSCommandLineInterface(compiled_path).render(root, parsed_args) == expected
+    # Listed directories are released, only the spine to a path is built up front
+    assert not root.is_loaded
+    root = FileSystemLoader.load_snapshot(compiled_path, 'parser', lazy=True)
+    assert root.contents[0].name == 'parser' and not root.contents[0].is_loaded
+
+    for args in (["-R", "-A", "-l"], ["-R", "parser"], ["-R", "--jobs", "2"]):
+        PyLSCommandLineInterface(compiled_path).run(args)
+        output = capsys.readouterr().out
+        assert output.splitlines() == render_listing(temp_json_file, args)
+    (tmp_path / 'mounts.txt').write_text("us=structure.pyls\n")
+    root = MountTable(MountTable.from_file(tmp_path / 'mounts.txt')).load_snapshot('', None, lazy=True)
+    us = root.get_child('us')
+    assert not us.is_loaded
+    assert all(isinstance(item, MappedDirectory) and not item.is_loaded
+               for item in us.contents if item.is_directory())
+
+def test_subtree_totals(temp_json_file, tmp_path):
+    """Test cumulative subtree sizes and entry counts"""
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    FileSystemAggregator.compute_totals(root)
+    assert (root.total_size, root.total_entries) == (41056, 19)
+    parser = FileSystemNavigator.navigate(root, "parser")
+    assert (parser.total_size, parser.total_entries) == (7593, 3)
+
+    columnar = FileSystemLoader.load_columnar_from_json(temp_json_file)
+    FileSystemAggregator.compute_totals(columnar)
+    assert (columnar.total_size, columnar.total_entries) == (41056, 19)
+    assert FileSystemNavigator.navigate(columnar, "lexer").total_size == 8938
+
+    # Compiled snapshots carry the totals without loading the subtree
+    compiled_path = tmp_path / "structure.pyls"
+    SnapshotCompiler.write(FileSystemLoader.load_from_json(temp_json_file), compiled_path)
+    root = FileSystemLoader.load_snapshot(compiled_path, depth=0)
+    assert root.contents == [] and (root.total_size, root.total_entries) == (41056, 19)
+
+def test_disk_usage_listing(temp_json_file):
+    """Test the du-style listing"""
+    assert render_listing(temp_json_file, ["--du", "-t"]) == [
+                        '5072\t2\t./token',
+                        '8938\t3\t./lexer',
+                        '5158\t2\t./ast',
+                        '7593\t3\t./parser',
+                        '41056\t19\t.'
+                    ]
+    assert render_listing(temp_json_file, ["--du", "-h", "--max-depth", "0", "parser"]) == ['7.4K\t3\tparser']
+    assert render_listing(temp_json_file, ["-s", "main.go"]) == ['74\t0\tmain.go']
+
+def test_sort_plan(temp_json_file):
+    """Test the fused sort plan against the sorters applied one after another"""
+    items = FileSystemLoader.load_from_json(temp_json_file).contents
+    for sorters in ([], [ReverseSorter()], [TimeSorter()], [TimeSorter(), ReverseSorter()],
+                    [ReverseSorter(), TimeSorter()], [TimeSorter(), TimeSorter(), ReverseSorter()]):
+        expected = list(items)
+        for sorter in sorters:
+            expected = sorter.sort(expected)
+        plan = SortPlan(sorters)
+        assert plan.sort(items) == expected
+        for count in (0, 3, 20):
+            assert plan.head(items, count) == expected[:count]
+            assert plan.tail(items, count) == expected[len(expected) - count:]
+
+def test_head_and_tail_listing(temp_json_file):
+    """Test --head and --tail"""
+    assert render_listing(temp_json_file, ["-t", "-r", "--head", "3"]) == ['parser ast lexer']
+    assert render_listing(temp_json_file, ["-l", "--tail", "2"]) == [
+                        'drwxr-xr-x 4096 Nov 17 12:51 parser',
+                        '-rw-r--r-- 4096 Nov 14 14:57 token'
+                    ]
+
+def test_streaming_pipeline():
+    """Test that unsorted listings are filtered and formatted lazily"""
+    def endless_items():
+        for number in itertools.count():
+            name = f".hidden{number}" if number % 2 else f"item{number}"
+            yield FileSystemLoader._convert_to_filesystem(
+                {"name": name, "size": number, "time_modified": 0, "permissions": "-rw-r--r--"})
+
+    processor = FileSystemProcessor(filters=[HiddenItemsFilter(False)])
+    assert list(itertools.islice(processor.iter_process(endless_items()), 3)) == ['item0', 'item2', 'item4']
+
+    output = io.StringIO()
+    writer = StreamWriter(output, chunk_size=4)
+    writer.write_joined(iter(['a', 'b', 'c']))
+    writer.write_lines(['d', 'e'])
+    writer.write_joined(iter([]))
+    writer.flush()
+    assert output.getvalue() == 'a b c\nd\ne\n\n'
+
+def test_scanner_array_batches():
+    """Test batched decoding of arrays across buffer refills"""
+    values = [{"name": "x]{", "size": 1}, {"name": "q\\\"u", "contents": [{"name": "a"}]}, "s]", 3, {}]
+    data = json.dumps(values, indent=1).encode('utf-8')
+    for chunk_size in (1, 3, 1 << 16):
+        for limit in (1, 20, 1 << 20):
+            scanner = JsonStreamScanner(io.BytesIO(data), chunk_size)
+            decoded = []
+            for batch in scanner.iter_array_batches(limit):
+                if batch is None:
+                    decoded.append(scanner.read_value())
+                else:
+                    decoded.extend(batch)
+            assert decoded == values
+
+def test_detailed_formatter_columns():
+    """Test size column alignment and that -h only rewrites the size column"""
+    items = [FileSystemLoader._convert_to_filesystem(item) for item in (
+        {"name": "1024", "size": 1024, "time_modified": 1699999980, "permissions": "-rw-r--r--"},
+        {"name": "big", "size": 123456789, "time_modified": 1700000039, "permissions": "-rw-r--r--"},
+    )]
+    time_text = DetailedFormatter().format(items[:1])[0].split(' ', 2)[2][:12]
+    assert DetailedFormatter().format(items) == [
+                        f'-rw-r--r--      1024 {time_text} 1024',
+                        f'-rw-r--r-- 123456789 {time_text} big'
+                    ]
+    assert HumanReadableSizeFormatter(DetailedFormatter()).format(items) == [
+                        f'-rw-r--r--   1.0K {time_text} 1024',
+                        f'-rw-r--r-- 117.7M {time_text} big'
+                    ]
+
+    # Widths are found in a first pass, the lines are only built as they are consumed
+    converted = []
+
+    def size_text(size):
+        converted.append(size)
+        return str(size)
+    for source in (items, iter(items)):
+        converted.clear()
+        lines = DetailedFormatter().iter_columns(source, size_text)
+        assert converted == [1024, 123456789]
+        assert next(lines) == f'-rw-r--r--      1024 {time_text} 1024' and len(converted) == 3
+        assert list(lines) == [f'-rw-r--r-- 123456789 {time_text} big'] and len(converted) == 4
+    assert DetailedFormatter().format([]) == []
+
+def test_batch_queries(temp_json_file):
+    """Test answering several queries with one load"""
+    cli = PyLSCommandLineInterface(temp_json_file)
+    queries = ["-t parser", "", "# comment", "missing", "-t ast"]
+
+    output = io.StringIO()
+    runner = PyLSBatchRunner(cli, temp_json_file)
+    assert runner.run(queries, StreamWriter(output)) == 1
+    assert output.getvalue().splitlines() == [
+                        '==> -t parser <==',
+                        'go.mod parser.go parser_test.go',
+                        '',
+                        '==> missing <==',
+                        "error: Cannot access 'missing': No such file or directory",
+                        '',
+                        '==> -t ast <==',
+                        'ast.go go.mod'
+                    ]
+    # Plain listings are memoized, so a repeated one is answered from memory
+    hits = runner._session.hits
+    assert runner.run(["-t parser"], StreamWriter(io.StringIO())) == 0
+    assert runner._session.hits > hits and not cli._processors
+    # Other queries with the same listing options share a processor
+    assert runner.run(["-R parser", "-R ast"], StreamWriter(io.StringIO())) == 0
+    assert len(cli._processors) == 1
+
+    output = io.StringIO()
+    runner = PyLSBatchRunner(cli, temp_json_file, 'json')
+    assert runner.run(["-t parser"], StreamWriter(output)) == 0
+    assert json.loads(output.getvalue()) == {"query": "-t parser", "status": 0,
+                                             "lines": ['go.mod parser.go parser_test.go']}
+
+def test_name_index(temp_json_file, tmp_path):
+    """Test glob and prefix searches through the name index"""
+    index = NameIndex.build(FileSystemLoader.load_from_json(temp_json_file))
+    assert len(index) == 19
+    assert list(index.find('*.go', under=['parser'])) == ['parser/parser_test.go', 'parser/parser.go']
+    assert list(index.find('lex', prefix=True)) == ['lexer', 'lexer/lexer_test.go', 'lexer/lexer.go']
+    assert list(index.find('lex*', item_type='dir')) == ['lexer']
+    assert list(index.find('*_test.go')) == ['lexer/lexer_test.go', 'parser/parser_test.go']
+    assert list(index.find('[.R]*')) == ['.gitignore', 'README.md']
+    for pattern in ('*', '*.go', 'go.*', '?o*', '*.[gm]*', 'main.go', 'missing'):
+        expected = [path for path in index.paths if fnmatch.fnmatchcase(path.rpartition('/')[2], pattern)]
+        assert list(index.find(pattern)) == expected
+    # A file path is tested itself, like in pyls search
+    assert list(index.find('*.go', under=['parser', 'parser.go'])) == ['parser/parser.go']
+    assert list(index.find('*.md', under=['parser', 'parser.go'])) == []
+    assert list(index.find('parser', under=['parser'])) == []
+    # The last code point has no successor to bound a prefix with
+    assert list(index.find('lex' + chr(sys.maxunicode), prefix=True)) == []
+    assert index.match_prefix(chr(sys.maxunicode)) == []
+    assert index.is_directory(['lexer']) and index.is_directory(['lexer', 'lexer.go']) is False
+    assert index.is_directory(['lexer', 'missing']) is None
+
+    # A saved index is only reused while the snapshot is unchanged
+    index_path = NameIndex.default_path(temp_json_file)
+    index.save(index_path, temp_json_file)
+    assert NameIndex.load(index_path, temp_json_file).paths == index.paths
+    os.utime(temp_json_file, ns=(0, 0))
+    assert NameIndex.load(index_path, temp_json_file) is None
+    index_path.unlink()
+
+def test_profile_report(temp_json_file, monkeypatch, capsys):
+    """Test the per-stage profile of a listing"""
+    monkeypatch.chdir(temp_json_file.parent)
+    monkeypatch.setenv('PYLS_PROFILE', 'json')
+    monkeypatch.setattr(sys, 'argv', ['pyls', '-t', 'parser'])
+    PyLSCommandLineInterface(temp_json_file).run()
+    captured = capsys.readouterr()
+    assert captured.out == 'go.mod parser.go parser_test.go\n'
+
+    stages = {stage["name"]: stage for stage in json.loads(captured.err)["stages"]}
+    assert list(stages) == ['snapshot', 'load', 'navigate', 'filter HiddenItemsFilter',
+                            'sort TimeSorter', 'format NameFormatter', 'write']
+    assert stages['filter HiddenItemsFilter']["items_in"] == 3
+    assert stages['format NameFormatter']["items_out"] == 3
+    assert all(stage["seconds"] >= 0 and stage["peak_bytes"] >= 0 for stage in stages.values())
+
+    # Only the two formats enable profiling, anything else is an error rather than a guess
+    for value in ('0', 'false', 'yes'):
+        monkeypatch.setenv('PYLS_PROFILE', value)
+        with pytest.raises(SystemExit):
+            PyLSCommandLineInterface(temp_json_file).run()
+        assert capsys.readouterr().out == f"error: Invalid PYLS_PROFILE '{value}': expected 'text' or 'json'\n"
+    monkeypatch.setenv('PYLS_PROFILE', '')
+    PyLSCommandLineInterface(temp_json_file).run()
+    assert capsys.readouterr().err == ''
+
+def test_fast_argument_parser():
+    """Test that the fast argument parser agrees with argparse or defers to it"""
+    cli = PyLSCommandLineInterface(Path('structure.json'))
+    parser = cli._create_argument_parser()
+    for args in ([], ['-A'], ['-ltr', 'parser'], ['-l', '-h', '--filter=dir'], ['--filter', 'file', '-t'],
+                 ['--head=3', '-R'], ['--tail', '05', 'a/b'], ['-s', '--help'], ['-'], ['']):
+        assert vars(cli._parse_common_args(args)) == vars(parser.parse_args(args))
+    for args in (['--du'], ['-x'], ['--filter=link'], ['--head=-1'], ['--head', '1', '--tail', '1'],
+                 ['a', 'b'], ['--', 'a'], ['--filt=dir'], ['--head'], ['--tail=²']):
+        assert cli._parse_common_args(args) is None
+
+def test_import_time(temp_json_file):
+    """Test that a plain listing imports only what it needs, within the budget"""
+    budget_us = 100_000
+    deferred = {'argparse', 'datetime', 'multiprocessing', 'concurrent.futures', 'asyncio',
+                'hashlib', 'tracemalloc', 'pyls.file_system_walker', 'pyls.file_system_aggregator'}
+    env = {**os.environ, 'PYTHONPATH': str(Path(__file__).resolve().parent.parent)}
+    code = f"import sys; from pyls.pyls import PyLSCommandLineInterface as C; C({str(temp_json_file)!r}).run(['-l'])"
+    timings = []
+    for _ in range(3):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                                capture_output=True, text=True, check=True)
+        imported = {}
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+                _, cumulative, name = line.split('|')
+                imported[name.strip()] = int(cumulative)
+        assert not deferred & set(imported)
+        timings.append(imported['pyls.pyls'])
+    assert min(timings) < budget_us
+
+def test_flat_snapshot(temp_json_file, tmp_path, monkeypatch):
+    """Test the NDJSON snapshot format, its chunked parsing and appends"""
+    flat_path = tmp_path / 'structure.ndjson'
+    FlatSnapshot.write(FileSystemLoader.load_from_json(temp_json_file), flat_path)
+    cli = PyLSCommandLineInterface(temp_json_file)
+    flat_cli = PyLSCommandLineInterface(flat_path)
+    for args in (['-A'], ['-l', '-t', 'parser'], ['-R']):
+        root = FileSystemLoader.load_snapshot(temp_json_file, depth=None)
+        flat_root = FileSystemLoader.load_snapshot(flat_path)
+        parsed_args = cli._create_argument_parser().parse_args(args)
+        assert flat_cli.render(flat_root, parsed_args) == cli.render(root, parsed_args)
+    assert FlatSnapshot.load(flat_path).name == 'interpreter'
+
+    # Lines starting in a byte range belong to it, wherever it is split
+    data = flat_path.read_bytes()
+    expected = file_system_flat._parse_range(str(flat_path), 0, len(data))
+    for split in range(len(data) + 1):
+        assert (file_system_flat._parse_range(str(flat_path), 0, split) +
+                file_system_flat._parse_range(str(flat_path), split, len(data))) == expected
+
+    # Appended lines update entries in place and add new ones
+    with open(flat_path, 'a') as f:
+        f.write('{"path": "./go.mod", "size": 1, "time_modified": 1, "permissions": "-rw-------"}\n')
+        f.write('{"path": "parser/extra/", "type": "dir", "size": 2, "time_modified": 2, '
+                '"permissions": "drwxr-xr-x"}\n')
+        f.write('{"path": "parser/extra/new.go", "size": 3, "time_modified": 3, "permissions": "-rw-r--r--"}\n')
+    monkeypatch.setattr(file_system_flat, '_PARALLEL_MIN_BYTES', 0)
+    monkeypatch.setattr(file_system_flat, '_MIN_CHUNK_BYTES', 64)
+    original = FileSystemLoader.load_from_json(temp_json_file)
+    for jobs in (1, 2):
+        root = FlatSnapshot.load(flat_path, jobs)
+        assert [item.name for item in root.contents] == [item.name for item in original.contents]
+        assert root.get_child('go.mod').permissions == '-rw-------'
+        parser = root.get_child('parser')
+        assert [item.name for item in parser.contents] == \
+            [item.name for item in original.get_child('parser').contents] + ['extra']
+        assert [item.name for item in parser.get_child('extra').contents] == ['new.go']
+
+    with open(flat_path, 'a') as f:
+        f.write('{"path": "missing/new.go", "size": 3, "time_modified": 3, "permissions": "-rw-r--r--"}\n')
+    with pytest.raises(FileSystemError):
+        FlatSnapshot.load(flat_path)
+
+def test_patch(temp_json_file, sample_filesystem_json, tmp_path):
+    """Test applying a patch in place, with indexes and totals kept current"""
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    FileSystemAggregator.compute_totals(root)
+    index = PathIndex(root)
+    # Build the name index of parser, so that it has to be kept current
+    root.get_child('parser').get_child('go.mod')
+    patch = [
+        '{"op": "add", "path": "parser/new.go", "size": 10, "time_modified": 1700000000, "permissions": "-rw-r--r--"}',
+        '{"op": "add", "path": "parser/sub", "type": "dir", "size": 0, "time_modified": 1, "permissions": "drwxr-xr-x"}',
+        '{"op": "move", "path": "lexer", "to": "parser/sub/lex"}',
+        '{"op": "remove", "path": "parser/go.mod"}',
+        '{"op": "modify", "path": "main.go", "size": 5, "permissions": "-rw-------"}',
+        '',
+        '{"op": "move", "path": "parser/parser.go", "to": "parser.go"}',
+    ]
+    FileSystemPatch.apply(root, FileSystemPatch.parse(patch), index)
+
+    parser = root.get_child('parser')
+    assert [item.name for item in parser.contents] == ['parser_test.go', 'new.go', 'sub']
+    assert parser.get_child('go.mod') is None and parser.get_child('sub').get_child('lex').is_directory()
+    assert root.get_child('main.go').size == 5 and root.get_child('parser.go').size == 1622
+    # Indexes and totals match ones built from scratch
+    fresh_index = PathIndex(root)
+    assert index._items == fresh_index._items
+    assert index.get(['parser', 'sub', 'lex', 'lexer.go']) is not None and index.get(['lexer']) is None
+    totals = [(directory.total_size, directory.total_entries) for directory in
+              (root, parser, parser.get_child('sub'), parser.get_child('sub').get_child('lex'))]
+    FileSystemAggregator.compute_totals(root)
+    assert totals == [(directory.total_size, directory.total_entries) for directory in
+                      (root, parser, parser.get_child('sub'), parser.get_child('sub').get_child('lex'))]
+
+    for line in ('{"op": "remove", "path": "missing"}', '{"op": "add", "path": "main.go", "size": 1, '
+                 '"time_modified": 1, "permissions": "x"}', '{"op": "move", "path": "parser", "to": "parser/x"}',
+                 '{"op": "modify", "path": "main.go"}', '{"op": "rename", "path": "main.go"}', 'nope'):
+        with pytest.raises(FileSystemError):
+            FileSystemPatch.apply(root, FileSystemPatch.parse([line]))
+
+    # An unpatched tree is written back out unchanged
+    output = io.StringIO()
+    SnapshotExporter.write(FileSystemLoader.load_from_json(temp_json_file), stream=output)
+    assert json.loads(output.getvalue()) == sample_filesystem_json
+    SnapshotExporter.write(root, tmp_path / 'patched.ndjson')
+    assert PyLSCommandLineInterface(tmp_path / 'patched.ndjson').render(
+        FileSystemLoader.load_snapshot(tmp_path / 'patched.ndjson'),
+        PyLSCommandLineInterface._parse_common_args(['parser'])) == ['parser_test.go new.go sub']
+
+def test_patch_command(temp_json_file, tmp_path, capsys):
+    """Test the patch subcommand while the compiled snapshot is the default"""
+    compiled_path = tmp_path / 'structure.pyls'
+    SnapshotCompiler.write(FileSystemLoader.load_from_json(temp_json_file), compiled_path)
+    snapshot_path = default_snapshot_path(temp_json_file, compiled_path)
+    assert snapshot_path == compiled_path
+    patch_path = tmp_path / 'changes.ndjson'
+    patch_path.write_text('{"op": "modify", "path": "main.go", "size": 5}\n')
+    output_path = tmp_path / 'patched.json'
+    PyLSCommandLineInterface(snapshot_path).run(['patch', str(patch_path), '-o', str(output_path)])
+    expected = FileSystemLoader.load_from_json(temp_json_file)
+    FileSystemPatch.apply(expected, FileSystemPatch.load(patch_path))
+    output = io.StringIO()
+    SnapshotExporter.write(expected, stream=output)
+    assert json.loads(output_path.read_text()) == json.loads(output.getvalue())
+
+    # Unreadable snapshots are reported as errors
+    invalid_path = tmp_path / 'invalid.json'
+    invalid_path.write_bytes(b'{"name": "\xff"}')
+    for snapshot_path in (invalid_path, tmp_path):
+        with pytest.raises(SystemExit) as exit_info:
+            PyLSCommandLineInterface(snapshot_path).run(['patch', str(patch_path)])
+        assert exit_info.value.code == 1 and capsys.readouterr().out.startswith('error: ')
+
+def test_snapshot_diff(temp_json_file, tmp_path):
+    """Test diffs of JSON and compiled snapshots through subtree digests"""
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    FileSystemPatch.apply(root, FileSystemPatch.parse([
+        '{"op": "add", "path": "parser/new.go", "size": 10, "time_modified": 1700000000, "permissions": "-rw-r--r--"}',
+        '{"op": "remove", "path": "lexer"}',
+        '{"op": "modify", "path": "main.go", "size": 5}',
+        '{"op": "modify", "path": "ast", "time_modified": 5}',
+    ]))
+    new_path = tmp_path / 'new.json'
+    SnapshotExporter.write(root, new_path)
+    SnapshotCompiler.write(FileSystemLoader.load_from_json(temp_json_file), tmp_path / 'old.pyls')
+    SnapshotCompiler.write(FileSystemLoader.load_from_json(new_path), tmp_path / 'new.pyls')
+
+    expected = [('M', 'ast'), ('D', 'lexer'), ('M', 'main.go'), ('A', 'parser/new.go')]
+    for old, new in ((temp_json_file, new_path), (tmp_path / 'old.pyls', tmp_path / 'new.pyls'),
+                     (tmp_path / 'old.pyls', new_path)):
+        with SnapshotDiff(old, new) as diff:
+            assert [(status, path) for status, path, _ in diff.iter_changes()] == expected
+            # Unchanged subtrees such as token are never entered
+            assert diff.nodes_compared == 14
+        with SnapshotDiff(old, old) as diff:
+            assert list(diff.iter_changes()) == [] and diff.nodes_compared == 1
+
+    # Digests cached by compiling are dropped by patches and recomputed by the next compile
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    SnapshotCompiler.write(root, tmp_path / 'before.pyls')
+    FileSystemPatch.apply(root, FileSystemPatch.parse([
+        '{"op": "modify", "path": "parser/parser.go", "size": 99}',
+        '{"op": "move", "path": "token", "to": "lexer/token"}',
+    ]))
+    assert root.digest is None and root.get_child('parser').digest is None
+    SnapshotCompiler.write(root, tmp_path / 'after.pyls')
+    root.get_child('main.go').size = 1
+    SnapshotCompiler.write(root, tmp_path / 'edited.pyls')
+    with SnapshotDiff(tmp_path / 'before.pyls', tmp_path / 'after.pyls') as diff:
+        assert [(status, path) for status, path, _ in diff.iter_changes()] == \
+            [('A', 'lexer/token'), ('M', 'parser/parser.go'), ('D', 'token')]
+    with SnapshotDiff(tmp_path / 'after.pyls', tmp_path / 'edited.pyls') as diff:
+        assert [(status, path) for status, path, _ in diff.iter_changes()] == [('M', 'main.go')]
+
+def test_mount_table(temp_json_file, tmp_path):
+    """Test mounting snapshots into one tree, each loaded only when needed"""
+    SnapshotCompiler.write(FileSystemLoader.load_from_json(temp_json_file), tmp_path / 'us.pyls')
+    (tmp_path / 'mounts.txt').write_text(f"# regions\neu/west={temp_json_file}\n\nus = us.pyls\n")
+    table = MountTable(MountTable.from_file(tmp_path / 'mounts.txt'))
+    assert [mount.snapshot_path for mount in table.mounts] == [Path(temp_json_file), tmp_path / 'us.pyls']
+
+    root = table.load_snapshot('', 1)
+    assert [item.name for item in root.contents] == ['eu', 'us']
+    west, us = root.get_child('eu').get_child('west'), root.get_child('us')
+    assert not west.is_loaded and not us.is_loaded
+    parsed_args = PyLSCommandLineInterface._parse_common_args(['us/parser'])
+    assert PyLSCommandLineInterface(temp_json_file).render(root, parsed_args) == \
+        ['parser_test.go parser.go go.mod']
+    assert us.is_loaded and not west.is_loaded
+
+    # A path inside a mount loads that snapshot alone
+    root = table.load_snapshot('us/parser', 1)
+    assert root.get_child('us').is_loaded and not root.get_child('eu').get_child('west').is_loaded
+    # Aggregate queries load every snapshot below the path
+    root = table.load_snapshot('eu', None)
+    assert root.get_child('eu').get_child('west').is_loaded and not root.get_child('us').is_loaded
+    root = table.load_snapshot('', None)
+    FileSystemAggregator.compute_totals(root)
+    original = FileSystemLoader.load_from_json(temp_json_file)
+    FileSystemAggregator.compute_totals(original)
+    # Mount points are synthetic directories of size 0
+    assert root.get_child('us').total_size == root.get_child('eu').total_size == original.total_size - original.size
+
+    for specs in (['a=x', 'a/b=y'], ['=x'], ['a']):
+        with pytest.raises(FileSystemError):
+            MountTable([MountTable.parse_spec(spec) for spec in specs])
+    with pytest.raises(FileSystemError):
+        MountTable([MountTable.parse_spec('a=missing.json')]).load_snapshot('a', 1)
+
+def test_sharded_store(temp_json_file, tmp_path, monkeypatch):
+    """Test paging shards of a snapshot in and out within a memory budget"""
+    original = FileSystemLoader.load_from_json(temp_json_file)
+    ShardedStore.write(original, tmp_path / 'structure.shards', shard_entries=4)
+    assert len(list((tmp_path / 'structure.shards' / 'shards').iterdir())) > 1
+    cli = PyLSCommandLineInterface(temp_json_file)
+    for args in (['-A'], ['-l', '-t', 'parser'], ['-R'], ['--du']):
+        parsed_args = cli._create_argument_parser().parse_args(args)
+        paged_root = FileSystemLoader.load_snapshot(tmp_path / 'structure.shards')
+        assert cli.render(paged_root, parsed_args) == \
+            cli.render(FileSystemLoader.load_from_json(temp_json_file), parsed_args)
+
+    # A budget of one shard evicts the others, which are read again when needed
+    store = ShardedStore(tmp_path / 'structure.shards', memory_budget=ENTRY_BYTES)
+    root = store.root()
+    parser = FileSystemNavigator.navigate(root, 'parser')
+    assert [item.name for item in parser.contents] == [item.name for item in original.get_child('parser').contents]
+    stats = store.stats()
+    assert stats['misses'] == 2 and stats['evictions'] == 1 and stats['resident_shards'] == 1
+    assert [item.name for item in root.contents] == [item.name for item in original.contents]
+    assert store.stats()['evictions'] == 2 and not parser.is_loaded
+    assert FileSystemNavigator.navigate(root, 'parser') is parser
+    parser.contents
+    parser.get_child('go.mod')
+    stats = store.stats()
+    assert (stats['hits'], stats['misses']) == (2, 4)
+
+    # Totals are stored in the shards, so du does not depend on what stays loaded
+    monkeypatch.setenv('PYLS_SHARD_MEMORY', str(ENTRY_BYTES))
+    for args in (['--du'], ['--du', 'parser'], ['-s']):
+        parsed_args = cli._create_argument_parser().parse_args(args)
+        assert cli.render(FileSystemLoader.load_snapshot(tmp_path / 'structure.shards'), parsed_args) == \
+            cli.render(FileSystemLoader.load_from_json(temp_json_file), parsed_args)
+
+    # Shards of subdirectories nested inside other shards are evicted while du visits them
+    def nested_tree():
+        return Directory('.', 0, 0, 'drwxr-xr-x', [
+            Directory(f'd{i}', 1, 0, 'drwxr-xr-x', [
+                Directory(f's{j}', 1, 0, 'drwxr-xr-x', [File(f'f{k}', k, 0, '-rw-r--r--') for k in range(3)])
+                for j in range(3)])
+            for i in range(3)])
+    ShardedStore.write(nested_tree(), tmp_path / 'nested.shards', shard_entries=6)
+    expected = list(DiskUsageReporter().report(nested_tree()))
+    assert list(DiskUsageReporter().report(ShardedStore(tmp_path / 'nested.shards', ENTRY_BYTES).root())) == expected
+
+    with pytest.raises(FileSystemError):
+        ShardedStore(tmp_path / 'missing')
+    with pytest.raises(FileSystemError):
+        ShardedStore.write(original, temp_json_file)
+
+def test_session_memoization(temp_json_file):
+    """Test memoized listings against the CLI, and their invalidation"""
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    session = FileSystemSession(root)
+    cli = PyLSCommandLineInterface(temp_json_file)
+    flags = ['-A', '-l', '-r', '-t', '-h', '--filter=file', '--filter=dir']
+    for _ in range(2):
+        for count in range(3):
+            for combination in itertools.combinations(flags, count):
+                for path in ([], ['parser'], ['main.go']):
+                    parsed_args = cli._create_argument_parser().parse_args(list(combination) + path)
+                    assert session.render(parsed_args) == cli.render(root, parsed_args)
+    assert session.render(cli._create_argument_parser().parse_args(['-R'])) is None
+
+    # -t and -t -r share the filtered items and their time order
+    session = FileSystemSession(root)
+    session.listing('parser', time_sort=True)
+    misses = session.misses
+    assert session.listing('parser', time_sort=True, reverse=True) == \
+        session.listing('parser', time_sort=True)[::-1]
+    assert session.misses == misses + 1
+
+    # Changes to a directory invalidate its results
+    FileSystemPatch.apply(root, FileSystemPatch.parse([
+        '{"op": "add", "path": "parser/new.go", "size": 10, "time_modified": 1, "permissions": "-rw-r--r--"}',
+        '{"op": "modify", "path": "parser/go.mod", "time_modified": 2}']))
+    assert session.listing('parser', time_sort=True) == ['new.go', 'go.mod'] + \
+        [line for line in session.listing('parser', time_sort=True) if line not in ('new.go', 'go.mod')]
+    parser_args = cli._create_argument_parser().parse_args(['-l', '-t', 'parser'])
+    assert session.render(parser_args) == cli.render(root, parser_args)
+    # Direct attribute edits are seen once the parent is marked changed
+    parser = root.get_child('parser')
+    parser.get_child('parser.go').size = 99999
+    parser.mark_changed()
+    assert session.render(parser_args) == cli.render(root, parser_args)
+    session = FileSystemSession(root, max_entries=2)
+    for path in ('', 'parser', 'ast', 'lexer'):
+        session.listing(path)
+    assert len(session._entries) == 2
+
+def test_compressed_snapshots(temp_json_file, tmp_path, monkeypatch):
+    """Test reading gzip, bz2 and xz snapshots while they are decompressed"""
+    import gzip, bz2, lzma
+    data = Path(temp_json_file).read_bytes()
+    flat_path = tmp_path / 'structure.ndjson'
+    FlatSnapshot.write(FileSystemLoader.load_from_json(temp_json_file), flat_path)
+    monkeypatch.setattr(file_system_flat, '_STREAM_CHUNK_BYTES', 100)
+    cli = PyLSCommandLineInterface(temp_json_file)
+    parsed_args = cli._create_argument_parser().parse_args(['-l', '-t', 'parser'])
+    expected = cli.render(FileSystemLoader.load_from_json(temp_json_file), parsed_args)
+    for module, suffix in ((gzip, '.gz'), (bz2, '.bz2'), (lzma, '.xz')):
+        compressed = tmp_path / f'structure.json{suffix}'
+        compressed.write_bytes(module.compress(data))
+        # Detected by the magic bytes without the suffix too
+        unnamed = tmp_path / f'snapshot{suffix[1:]}'
+        unnamed.write_bytes(module.compress(data))
+        for path in (compressed, unnamed):
+            assert CompressedInput.compression(path) == {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}[suffix]
+            assert cli.render(FileSystemLoader.load_from_json(path), parsed_args) == expected
+            assert cli.render(FileSystemLoader.load_snapshot(path, 'parser'), parsed_args) == expected
+        compressed_flat = tmp_path / f'structure.ndjson{suffix}'
+        compressed_flat.write_bytes(module.compress(flat_path.read_bytes()))
+        assert FlatSnapshot.is_flat(compressed_flat)
+        assert cli.render(FileSystemLoader.load_snapshot(compressed_flat), parsed_args) == expected
+    assert CompressedInput.compression(temp_json_file) is None
+    assert default_snapshot_path(tmp_path / 'structure.json', tmp_path / 'structure.pyls',
+                                 tmp_path / 'missing.ndjson') == tmp_path / 'structure.json.gz'
+
+    truncated = tmp_path / 'truncated.json.xz'
+    truncated.write_bytes(lzma.compress(data)[:50])
+    with pytest.raises(FileSystemError):
+        FileSystemLoader.load_from_json(truncated)
+    with pytest.raises(FileSystemError):
+        FileSystemLoader.load_path_from_json(tmp_path / 'missing.json.gz')
+
+def test_permission_modes(temp_json_file, tmp_path, capsys):
+    """Test integer permission modes and filtering by permission bits"""
+    for permissions in PERMISSION_STRINGS + ['-rwsr-xr-x', 'drwxrwxrwt', 'lrwxrwxrwx', '-rwSr-Sr-T', 'crw-rw----']:
+        assert PermissionMode.format(PermissionMode.parse(permissions)) == permissions
+    assert PermissionMode.parse('-rw-r--r--') == 0o100644 and PermissionMode.parse('drwxr-xr-x') == 0o40755
+    for permissions in ('x', '-rw-r--r-', 'zrw-r--r--', '-rw-r--r-x-', '-rwxrwxrws'[:9] + 'q', '-rw-r--r--+.'):
+        with pytest.raises(FileSystemError):
+            PermissionMode.parse(permissions)
+
+    # ACL, SELinux and extended attribute markers are kept in the printed string, not in the mode
+    for permissions in ('-rw-r--r--.', 'drwxr-xr-x+', '-rwsr-xr-x@'):
+        assert PermissionMode.parse(permissions) == PermissionMode.parse(permissions[:10])
+        marked = File('marked', 1, 0, permissions)
+        assert marked.permissions == permissions and PermissionFilter('/4000').matches(marked) == ('s' in permissions)
+        marked.permissions = permissions[:10]
+        assert marked.permissions == permissions[:10]
+    marked_json = tmp_path / 'marked.json'
+    marked_json.write_text(json.dumps({'name': '.', 'size': 0, 'time_modified': 0, 'permissions': 'drwxr-xr-x.',
+                                       'contents': [{'name': 'a', 'size': 1, 'time_modified': 0,
+                                                     'permissions': '-rw-r--r--+'}]}))
+    assert DetailedFormatter().format(FileSystemLoader.load_from_json(marked_json).contents)[0].startswith('-rw-r--r--+ ')
+    for store in (ColumnarStore.from_json(marked_json),
+                  ColumnarStore.from_tree(FileSystemLoader.load_from_json(marked_json))):
+        assert store.root().permissions == 'drwxr-xr-x.' and store.root().contents[0].permissions == '-rw-r--r--+'
+        assert store.root().contents[0].mode == 0o100644
+
+    root = FileSystemLoader.load_from_json(temp_json_file)
+    items = [item for item in root.contents] + list(root.get_child('parser').contents)
+    columnar = FileSystemLoader.load_columnar_from_json(temp_json_file)
+    for spec, expected in (('644', 0o644), ('-755', 0o755), ('/002', 0o002), ('executable', 0o111)):
+        perm_filter = PermissionFilter(spec)
+        assert perm_filter.mask == expected
+        selected = [item.name for item in items if perm_filter.matches(item)]
+        assert [item.name for item in perm_filter.filter(items)] == selected
+        assert [item.name for item in perm_filter.filter(iter(items))] == selected
+        assert [item.name for item in perm_filter.select(columnar.contents)] == \
+            [item.name for item in root.contents if perm_filter.matches(item)]
+    assert [item.name for item in PermissionFilter('-755').filter(items)] == \
+        [item.name for item in items if item.permissions[1:] == 'rwxr-xr-x']
+    for spec in ('', '9', '/', '12345', 'writable'):
+        with pytest.raises(ValueError):
+            PermissionFilter(spec)
+
+    cli = PyLSCommandLineInterface(temp_json_file)
+    parsed_args = cli._create_argument_parser().parse_args(['-A', '--perm=-755'])
+    assert cli.render(root, parsed_args) == \
+        [' '.join(item.name for item in root.contents if item.permissions.endswith('rwxr-xr-x'))]
+    assert FileSystemSession(root).render(parsed_args) == cli.render(root, parsed_args)
+    with pytest.raises(SystemExit):
+        cli._create_argument_parser().parse_args(['--perm=abc'])
+    assert 'octal mode' in capsys.readouterr().err
+
+def test_predicate_search(temp_json_file, monkeypatch, capsys):
+    """Test find-style predicate searches over the whole tree"""
+    store = FileSystemLoader.load_store(temp_json_file)
+    tree_store = ColumnarStore.from_tree(FileSystemLoader.load_from_json(temp_json_file))
+    assert list(tree_store.sizes) == list(store.sizes) and list(tree_store.children) == list(store.children)
+    assert store.subtree_entries(store.root_index) == len(store) - 1
+    assert store.subtree_entries(store.find_path(['parser'])) == 3
+
+    def search(tokens, path=None, jobs=1):
+        expression = SearchExpression.parse(tokens, store, now=1700205662 + 3600)
+        return list(FileSystemSearch(store, expression).search(path, jobs))
+
+    assert search(['-name', 'go.mod', '-a', '!', '-newer', 'go.mod']) == \
+        ['./go.mod', './lexer/go.mod', './token/go.mod']
+    assert search(['-type', 'd', '-o', '-size', '+2k']) == ['./.gitignore', './ast', './lexer', './lexer/lexer.go',
+                                                           './parser', './token']
+    assert search(['-size', '-1k', '-type', 'f']) == []
+    assert search(['-size', '837c']) == ['./ast/ast.go']
+    assert search(['-mtime', '-1']) == ['./parser', './parser/parser_test.go', './parser/parser.go']
+    assert search(['-mmin', '-61', '-not', '-type', 'd']) == ['./parser/parser_test.go']
+    assert search(['(', '-name', '*.go', '-o', '-type', 'd', ')', '!', '-name', 'l*'], 'parser') == \
+        ['parser/parser_test.go', 'parser/parser.go']
+    assert search(['-perm', '-755'], 'main.go') == []
+    everything = search([])
+    assert len(everything) == len(store) - 1 and everything[:4] == ['./.gitignore', './LICENSE', './README.md', './ast']
+
+    # Every unit is searched in a worker, the output keeps the sequential order
+    monkeypatch.setattr(FileSystemSearch, 'MIN_PARALLEL_ENTRIES', 0)
+    assert search([], jobs=2) == everything
+    assert search(['-name', 'go.mod'], jobs=3) == search(['-name', 'go.mod'])
+    units = FileSystemSearch(store, ('true',))._split([(store.root_index, '', True)], 3)
+    assert [(store.name(index), descend) for index, _, descend in units][:3] == \
+        [('interpreter', False), ('.gitignore', True), ('LICENSE', True)]
+
+    for tokens in (['-size'], ['-size', '1x'], ['-mtime', '1k'], ['-type', 'l'], ['-perm', 'abc'],
+                   ['-newer', 'missing'], ['(', '-type', 'f'], ['-type', 'f', ')'], ['-depth']):
+        with pytest.raises(FileSystemError):
+            SearchExpression.parse(tokens, store)
+
+    PyLSCommandLineInterface(temp_json_file).run(['search', 'lexer', '--jobs', '2', '-name', '*.go'])
+    assert capsys.readouterr().out == 'lexer/lexer_test.go\nlexer/lexer.go\n'